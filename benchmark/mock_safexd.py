@@ -0,0 +1,309 @@
+#!/usr/bin/python3.6
+
+import argparse
+import binascii
+import hashlib
+import os.path
+import sys
+import threading
+import time
+import ujson
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.http_server import ThreadingServer, KeepAliveHandler
+
+'''
+Local stand-in for safexd and safex-wallet-rpc, used for benchmarking utility scripts without real network.
+
+Three modes are supported:
+ synthetic (default) - deterministic chain generated from parameters (height, txs per block, inputs per tx, payments
+                       per block), served by methods used in this repo.
+ record              - proxy forwarding every request to --upstream and appending request/response pairs to
+                       --record file (JSONL).
+ replay              - answering requests from previously recorded --replay file.
+
+Daemon methods: getinfo, get_transactions, get_transaction_pool, json_rpc get_block_headers_range, get_block,
+                get_block_header_by_height.
+Wallet methods: json_rpc get_bulk_payments, get_transfers (pool only), get_height, get_address, make_integrated_address,
+                get_balance, transfer, transfer_token, migrate (transfers always succeed and return new txid).
+JSON-RPC batch requests are supported in synthetic and replay modes.
+
+Every request is delayed by --latency milliseconds. With --block-time synthetic chain grows by one block every
+--block-time seconds, payments of next block are reported in tx pool. Txs submitted through wallet methods stay in
+tx pool and are mined in next block.
+'''
+
+ADDRESS = 'SFXtzV5sWsN1Bb27yzX3mk5Ew2iR5Ehtj2e5UvvGDJZUYE3nHrkvKZwPYz52tgQiWW4W6ozmQtLG5LzTbgUgqXYPG1VaxH3mUo'
+
+
+def digest(*parts):
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+# Deterministic chain. Txid carries height and index of tx (first 12 bytes), so tx can be regenerated from txid.
+class SyntheticChain:
+    def __init__(self, height=1000, txs_per_block=10, inputs_per_tx=2, payments_per_block=2, users=100,
+                 block_time=0.0):
+        self.txs_per_block = txs_per_block
+        self.inputs_per_tx = inputs_per_tx
+        self.payments_per_block = payments_per_block
+        self.users = users
+        self.block_time = block_time
+        self.__start_height = height
+        self.__started = time.time()
+        # Height of block submitted txs are mined in -> their txids.
+        self.__submitted = {}
+        self.__submitted_lock = threading.Lock()
+
+    @property
+    def height(self):
+        if self.block_time <= 0:
+            return self.__start_height
+        return self.__start_height + int((time.time() - self.__started) / self.block_time)
+
+    def numTxes(self, height):
+        return 0 if height == 0 else self.txs_per_block + len(self.__submitted.get(height, []))
+
+    # Tx goes to block which is mined next, without block time chain never reaches that block and tx stays in pool
+    # forever. Txid encodes height and index after synthetic txs of that block, like txids of synthetic txs.
+    # @return - txid of submitted tx.
+    def submit(self):
+        with self.__submitted_lock:
+            height = self.height
+            txids = self.__submitted.setdefault(height, [])
+            txids.append(self.txid(height, self.txs_per_block + len(txids)))
+            return txids[-1]
+
+    def poolTxs(self):
+        with self.__submitted_lock:
+            pending = [txid for height, txids in self.__submitted.items() if height >= self.height for txid in txids]
+        return [{"id_hash": txid, "blob_size": 1500, "receive_time": int(time.time())} for txid in pending]
+
+    def blockHash(self, height):
+        return digest('block', height)
+
+    def txid(self, height, index):
+        return '%016x%08x' % (height, index) + digest('tx', height, index)[:40]
+
+    def keyImage(self, height, index, input):
+        return digest('k_image', height, index, input)
+
+    def header(self, height):
+        return {"height": height, "hash": self.blockHash(height),
+                "prev_hash": self.blockHash(height - 1) if height > 0 else '0' * 64,
+                "num_txes": self.numTxes(height), "timestamp": 1500000000 + 120 * height,
+                "block_size": 200 + 1500 * self.numTxes(height), "major_version": 1, "minor_version": 1,
+                "orphan_status": False}
+
+    def block(self, height):
+        return {"block_header": self.header(height), "miner_tx_hash": digest('miner', height),
+                "tx_hashes": [self.txid(height, i) for i in range(self.txs_per_block if height > 0 else 0)] +
+                             list(self.__submitted.get(height, [])), "status": "OK"}
+
+    def tx(self, txid):
+        height, index = int(txid[:16], 16), int(txid[16:24], 16)
+        vin = [{"key": {"amount": 0, "key_offsets": [1, 2, 3], "k_image": self.keyImage(height, index, i)}}
+               for i in range(self.inputs_per_tx)]
+        if index % 10 == 0:
+            vin.append({"migration": {"amount": 100, "k_image": self.keyImage(height, index, 'migration')}})
+        as_json = {"version": 1, "unlock_time": 0, "vin": vin, "vout": [], "extra": []}
+        return {"tx_hash": txid, "block_height": height, "in_pool": False, "as_json": ujson.dumps(as_json)}
+
+    # Payment ids follow deposit_system_example.createUser scheme, user n gets n as 32 byte little endian.
+    def paymentId(self, user):
+        return binascii.hexlify(((user % self.users) + 1).to_bytes(32, 'little')).decode('utf-8')
+
+    def payment(self, height, i):
+        token = i % 2 == 1
+        return {"payment_id": self.paymentId(height * self.payments_per_block + i),
+                "tx_hash": digest('payment', height, i), "block_height": height,
+                "unlock_time": 0, "amount": 0 if token else 1000 + i,
+                "token_amount": 10 + i if token else 0, "token_transaction": token}
+
+    # Like wallet, only payments strictly above min_block_height are returned.
+    def payments(self, min_block_height):
+        return [self.payment(height, i) for height in range(max(1, min_block_height + 1), self.height)
+                for i in range(self.payments_per_block)]
+
+    # Payments of block which is not mined yet, as get_transfers pool entries.
+    def poolTransfers(self):
+        transfers = []
+        for i in range(self.payments_per_block if self.block_time > 0 else 0):
+            payment = self.payment(self.height, i)
+            transfers.append({"txid": payment["tx_hash"], "payment_id": payment["payment_id"], "height": 0,
+                              "amount": payment["amount"], "token_amount": payment["token_amount"],
+                              "token_transaction": payment["token_transaction"], "type": "pool"})
+        return transfers
+
+
+class MockDaemon:
+    def __init__(self, chain=None, latency=0.0, replay=None, upstream=None, record=None):
+        self.chain = chain
+        self.latency = latency
+        self.upstream = upstream
+        self.requests = 0
+        self.transfers = 0
+        self.__transfers_lock = threading.Lock()
+        self.__record = open(record, 'a') if record is not None else None
+        self.__record_lock = threading.Lock()
+        self.__replay = {}
+        if replay is not None:
+            with open(replay) as file:
+                for line in file:
+                    entry = ujson.loads(line)
+                    self.__replay[self.__key(entry["path"], entry.get("method"), entry.get("params"))] = \
+                        entry["response"]
+
+    # @return - response body as python object.
+    def handle(self, path, body=None):
+        self.requests = self.requests + 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if self.upstream is not None:
+            return self.__proxy(path, body)
+        if path == '/json_rpc':
+            if isinstance(body, list):
+                return [self.__jsonRPC(request) for request in body]
+            return self.__jsonRPC(body)
+        return self.__answer(path, None, body)
+
+    def __jsonRPC(self, request):
+        try:
+            result = self.__answer('/json_rpc', request["method"], request.get("params") or {})
+            return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+        except KeyError as e:
+            return {"jsonrpc": "2.0", "id": request.get("id"),
+                    "error": {"code": -32601, "message": "Method not found or bad params: " + str(e)}}
+
+    def __answer(self, path, method, params):
+        if self.chain is None:
+            return self.__replay[self.__key(path, method, params)]
+        chain = self.chain
+        if path in ('/getinfo', '/get_info'):
+            return {"height": chain.height, "target_height": chain.height, "status": "OK"}
+        if path == '/get_transaction_pool':
+            return {"transactions": chain.poolTxs(), "status": "OK"}
+        if path == '/get_transactions':
+            return {"txs": [chain.tx(txid) for txid in params["txs_hashes"]], "status": "OK"}
+        if method == 'get_block_headers_range':
+            end_height = min(params["end_height"], chain.height - 1)
+            return {"headers": [chain.header(height) for height in range(params["start_height"], end_height + 1)],
+                    "status": "OK"}
+        if method == 'get_block':
+            return chain.block(params["height"])
+        if method == 'get_block_header_by_height':
+            return {"block_header": chain.header(params["height"]), "status": "OK"}
+        if method == 'get_bulk_payments':
+            return {"payments": chain.payments(int(params.get("min_block_height", 0)))}
+        if method == 'get_transfers':
+            return {"pool": chain.poolTransfers()} if params.get("pool") else {}
+        if method == 'get_height':
+            return {"height": chain.height}
+        if method == 'get_address':
+            return {"address": ADDRESS}
+        if method == 'make_integrated_address':
+            payment_id = params.get("payment_id") or digest('pid', time.time())[:16]
+            return {"integrated_address": ADDRESS + payment_id, "payment_id": payment_id}
+        if method == 'get_balance':
+            return {"balance": 10 ** 16, "unlocked_balance": 10 ** 16, "token_balance": 10 ** 15,
+                    "unlocked_token_balance": 10 ** 15}
+        if method in ('transfer', 'transfer_token', 'migrate'):
+            with self.__transfers_lock:
+                self.transfers = self.transfers + 1
+            txid = chain.submit()
+            return {"tx_hash": txid, "fee": 100000000}
+        raise KeyError(method if method is not None else path)
+
+    def __proxy(self, path, body):
+        if body is None:
+            res = requests.get(self.upstream + path)
+        else:
+            res = requests.post(self.upstream + path, data=ujson.dumps(body))
+        response = ujson.loads(res.text)
+        with self.__record_lock:
+            requests_list = body if isinstance(body, list) else [body]
+            responses = response if isinstance(response, list) else [response]
+            for request, answer in zip(requests_list, responses):
+                if path == '/json_rpc':
+                    entry = {"path": path, "method": request["method"], "params": request.get("params") or {},
+                             "response": answer.get("result")}
+                else:
+                    entry = {"path": path, "params": request, "response": answer}
+                self.__record.write(ujson.dumps(entry) + "\n")
+            self.__record.flush()
+        return response
+
+    def __key(self, path, method, params):
+        return ujson.dumps([path, method, params], sort_keys=True)
+
+
+class MockHTTPServer(ThreadingServer):
+    # Default listen backlog of 5 resets connections when several clients open their pools at once.
+    request_queue_size = 128
+
+    def __init__(self, address, mock):
+        self.mock = mock
+        super().__init__(address, MockRequestHandler)
+
+
+class MockRequestHandler(KeepAliveHandler):
+    def do_GET(self):
+        self.__respond(None)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = ujson.loads(self.rfile.read(length)) if length > 0 else {}
+        self.__respond(body)
+
+    def __respond(self, body):
+        try:
+            data = ujson.dumps(self.server.mock.handle(self.path, body)).encode()
+            code = 200
+        except KeyError:
+            data = b'{"status": "Method not found"}'
+            code = 404
+        self.sendData(code, data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock safexd / safex-wallet-rpc for offline benchmarks')
+    parser.add_argument('--bind', help="host:port to listen on", required=False, type=str,
+                        default="127.0.0.1:17402")
+    parser.add_argument('--latency', help="Delay of every response in milliseconds",
+                        required=False, type=float, default=0.0)
+    parser.add_argument('--height', help="Synthetic chain height", required=False, type=int, default=1000)
+    parser.add_argument('--txs-per-block', help="Synthetic txs per block", required=False, type=int, default=10)
+    parser.add_argument('--inputs-per-tx', help="Synthetic key images per tx", required=False, type=int, default=2)
+    parser.add_argument('--payments-per-block', help="Synthetic wallet payments per block",
+                        required=False, type=int, default=2)
+    parser.add_argument('--users', help="Number of payment ids payments are spread over",
+                        required=False, type=int, default=100)
+    parser.add_argument('--block-time', help="Seconds between synthetic blocks, 0 keeps chain height fixed",
+                        required=False, type=float, default=0.0)
+    parser.add_argument('--replay', help="Answer from recorded JSONL file instead of synthetic chain",
+                        required=False, type=str)
+    parser.add_argument('--upstream', help="Proxy requests to real daemon/wallet url and record them",
+                        required=False, type=str)
+    parser.add_argument('--record', help="JSONL file for recorded responses, used with --upstream",
+                        required=False, type=str, default="./recorded.jsonl")
+    args = vars(parser.parse_args())
+
+    chain = None
+    if args['replay'] is None and args['upstream'] is None:
+        chain = SyntheticChain(height=args['height'], txs_per_block=args['txs_per_block'],
+                               inputs_per_tx=args['inputs_per_tx'], payments_per_block=args['payments_per_block'],
+                               users=args['users'], block_time=args['block_time'])
+    daemon = MockDaemon(chain=chain, latency=args['latency'] / 1000.0, replay=args['replay'],
+                        upstream=args['upstream'].rstrip('/') if args['upstream'] else None,
+                        record=args['record'] if args['upstream'] else None)
+    host, port = args['bind'].rsplit(':', 1)
+    server = MockHTTPServer((host, int(port)), daemon)
+    print("Mock daemon listening on http://{}:{}".format(host, port))
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/python3.6
+
+import argparse
+import hashlib
+import os
+import os.path
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import ujson
+
+import requests
+
+'''
+Offline benchmark of utility scripts against mock_safexd.py.
+
+Reported metrics:
+ index_blocks_per_s, index_txs_per_s - full sync of find_txid_by_k_image.py from height 0
+ index_peak_rss_mb                   - peak RSS of indexer process during sync
+ query_p50_ms, query_p90_ms, query_p99_ms - latency of key image lookups over indexer HTTP server (half hits, half
+                                            misses)
+ deposit_payments_per_s              - System.scanForPayments of deposit_system_example.py
+ deposit_users_per_s                 - System.createUsers with integrated addresses
+
+Results can be saved with --save and later runs compared with --compare, exit code is 1 if any metric is worse than
+baseline by more than --tolerance.
+'''
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MOCK = os.path.join(REPO, 'benchmark', 'mock_safexd.py')
+INDEXER = os.path.join(REPO, 'find_txid_with_kimage', 'find_txid_by_k_image.py')
+
+sys.path.insert(0, os.path.join(REPO, 'benchmark'))
+sys.path.insert(0, os.path.join(REPO, 'deposit_system_example'))
+import mock_safexd
+sys.path.insert(0, REPO)
+from common import metrics
+
+HIGHER_IS_BETTER = {'index_blocks_per_s', 'index_txs_per_s', 'deposit_payments_per_s', 'deposit_users_per_s'}
+
+
+def freePort():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def waitForServer(url, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.exceptions.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError('Server at ' + url + ' did not start')
+
+
+def startMock(args):
+    port = freePort()
+    process = subprocess.Popen([sys.executable, MOCK, '--bind', '127.0.0.1:{}'.format(port),
+                                '--latency', str(args['latency']), '--height', str(args['height']),
+                                '--txs-per-block', str(args['txs_per_block']),
+                                '--inputs-per-tx', str(args['inputs_per_tx']),
+                                '--payments-per-block', str(args['payments_per_block']),
+                                '--users', str(args['users'])], stdout=subprocess.DEVNULL)
+    url = 'http://127.0.0.1:{}'.format(port)
+    waitForServer(url + '/getinfo')
+    return process, url
+
+
+# Sync is measured on separate process, os.wait4 gives resource usage of that process only.
+def benchmarkIndexSync(args, url, directory):
+    command = [sys.executable, INDEXER, '--db-path', os.path.join(directory, 'main.db'), '--daemon-rpc-url', url,
+               '--key-image', '00' * 32] + args['indexer_args'].split()
+    started = time.time()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.time() - started
+    if status != 0:
+        raise RuntimeError('Indexer sync failed with status {}'.format(status))
+    blocks = args['height'] - 1
+    return {'index_blocks_per_s': blocks / elapsed,
+            'index_txs_per_s': blocks * args['txs_per_block'] / elapsed,
+            'index_peak_rss_mb': rusage.ru_maxrss / 1024.0}
+
+
+def benchmarkQueries(args, url, directory):
+    chain = mock_safexd.SyntheticChain(height=args['height'], txs_per_block=args['txs_per_block'],
+                                       inputs_per_tx=args['inputs_per_tx'])
+    random.seed(0)
+    k_images = []
+    for i in range(args['lookups']):
+        if i % 2 == 0:
+            k_images.append(chain.keyImage(random.randint(1, args['height'] - 1),
+                                           random.randint(0, args['txs_per_block'] - 1),
+                                           random.randint(0, args['inputs_per_tx'] - 1)))
+        else:
+            k_images.append(hashlib.sha256(str(i).encode()).hexdigest())
+
+    bind = '127.0.0.1:{}'.format(freePort())
+    process = subprocess.Popen([sys.executable, INDEXER, '--db-path', os.path.join(directory, 'main.db'),
+                                '--daemon-rpc-url', url, '--http-bind', bind] + args['indexer_args'].split(),
+                               stdout=subprocess.DEVNULL)
+    try:
+        waitForServer('http://' + bind + '/kimage/' + '00' * 32)
+        session = requests.Session()
+        latencies = []
+        for k_image in k_images:
+            started = time.time()
+            session.get('http://' + bind + '/kimage/' + k_image)
+            latencies.append(time.time() - started)
+    finally:
+        process.terminate()
+        process.wait()
+    return {'query_p50_ms': metrics.percentile(latencies, 0.5) * 1000,
+            'query_p90_ms': metrics.percentile(latencies, 0.9) * 1000,
+            'query_p99_ms': metrics.percentile(latencies, 0.99) * 1000}
+
+
+# Deposit DB is created in current directory, so benchmark is run from temporary directory.
+def benchmarkDepositScan(args, url, directory):
+    cwd = os.getcwd()
+    os.makedirs(os.path.join(directory, 'deposit'))
+    os.chdir(os.path.join(directory, 'deposit'))
+    try:
+        import deposit_system_example
+        system = deposit_system_example.System(url=url + '/')
+        started = time.time()
+        system.createUsers(['user{}'.format(i) for i in range(args['users'])], integrated_address=True)
+        provision_elapsed = time.time() - started
+        started = time.time()
+        system.scanForPayments()
+        elapsed = time.time() - started
+    finally:
+        os.chdir(cwd)
+    return {'deposit_payments_per_s': (args['height'] - 1) * args['payments_per_block'] / elapsed,
+            'deposit_users_per_s': args['users'] / provision_elapsed}
+
+
+# @return - list of (metric, baseline, current) for metrics worse than baseline by more than tolerance.
+def findRegressions(results, baseline, tolerance):
+    regressions = []
+    for metric, value in results.items():
+        if metric not in baseline:
+            continue
+        if metric in HIGHER_IS_BETTER:
+            worse = value < baseline[metric] * (1 - tolerance)
+        else:
+            worse = value > baseline[metric] * (1 + tolerance)
+        if worse:
+            regressions.append((metric, baseline[metric], value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark utility scripts against local mock daemon')
+    parser.add_argument('--height', help="Synthetic chain height", required=False, type=int, default=2000)
+    parser.add_argument('--txs-per-block', help="Synthetic txs per block", required=False, type=int, default=20)
+    parser.add_argument('--inputs-per-tx', help="Synthetic key images per tx", required=False, type=int, default=2)
+    parser.add_argument('--payments-per-block', help="Synthetic payments per block",
+                        required=False, type=int, default=5)
+    parser.add_argument('--users', help="Number of deposit users", required=False, type=int, default=1000)
+    parser.add_argument('--latency', help="Mock response latency in milliseconds",
+                        required=False, type=float, default=2.0)
+    parser.add_argument('--lookups', help="Number of key image lookups", required=False, type=int, default=2000)
+    parser.add_argument('--indexer-args', help="Extra arguments passed to indexer, e.g. '--threads 16'",
+                        required=False, type=str, default="")
+    parser.add_argument('--save', help="Save results as JSON to given file", required=False, type=str)
+    parser.add_argument('--compare', help="Compare results with JSON baseline", required=False, type=str)
+    parser.add_argument('--tolerance', help="Allowed relative regression when comparing with baseline",
+                        required=False, type=float, default=0.2)
+    args = vars(parser.parse_args())
+
+    mock, url = startMock(args)
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            print("Syncing key image index of {} blocks".format(args['height']))
+            results.update(benchmarkIndexSync(args, url, directory))
+            print("Querying {} key images".format(args['lookups']))
+            results.update(benchmarkQueries(args, url, directory))
+            print("Scanning deposits of {} users".format(args['users']))
+            results.update(benchmarkDepositScan(args, url, directory))
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    print("----------------------------------------------------------")
+    for metric in sorted(results):
+        print("{:<26} {:>12.3f}".format(metric, results[metric]))
+    print("----------------------------------------------------------")
+
+    if args['save'] is not None:
+        with open(args['save'], 'w') as file:
+            file.write(ujson.dumps(results, indent=2))
+    if args['compare'] is not None:
+        with open(args['compare']) as file:
+            regressions = findRegressions(results, ujson.loads(file.read()), args['tolerance'])
+        for metric, baseline, value in regressions:
+            print("REGRESSION {}: baseline {:.3f}, now {:.3f}".format(metric, baseline, value))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
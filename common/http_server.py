@@ -0,0 +1,39 @@
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+'''
+Base classes of small HTTP servers run by utility scripts (metrics endpoint, key image query server, mock daemon).
+
+Every request is handled on its own daemon thread, so server never keeps process alive. Responses always carry
+Content-Length, so clients with pooled sessions keep connections open between requests.
+'''
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, without TCP_NODELAY small responses wait for delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    # @data - bytes of response body.
+    def sendData(self, code=200, data=b'', content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+# Running server.serve_forever in background thread.
+# @return - started thread.
+def serveInBackground(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,275 @@
+import atexit
+import cProfile
+import sys
+import threading
+import time
+
+from common.http_server import ThreadingServer, KeepAliveHandler, serveInBackground
+
+'''
+Prometheus-style metrics shared by utility scripts, without dependency on prometheus_client.
+
+Metrics are registered in module level REGISTRY by name, so the same metric can be looked up from any module:
+
+    RPC_SECONDS = metrics.histogram('rpc_request_seconds', 'Latency of RPC requests', ['method'])
+    with RPC_SECONDS.time(method='get_block'):
+        ...
+
+startMetricsServer serves REGISTRY in text exposition format on GET /metrics. startProfiling runs cProfile for the rest
+of the process and at exit writes profile (readable with pstats) together with per-stage timing report built from
+all histograms.
+'''
+
+# Upper bounds of histogram buckets in seconds.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metric:
+    type = ''
+
+    def __init__(self, name='', help='', labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    # @return - list of (labels dict, value) for every label combination seen so far.
+    def samples(self):
+        with self._lock:
+            return [(dict(zip(self.labels, key)), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} {}'.format(self.name, self.type)]
+        for labels, value in sorted(self.samples(), key=lambda sample: sorted(sample[0].items())):
+            lines.append(self.name + formatLabels(labels) + ' ' + formatValue(value))
+        return lines
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError('Metric {} expects labels {}, got {}'.format(self.name, self.labels, tuple(labels)))
+        return tuple(str(labels[name]) for name in self.labels)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value=0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name='', help='', labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    # Value of every label combination is [count per bucket..., count, sum], buckets are not cumulative here.
+    def observe(self, value=0.0, **labels):
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 3)
+            state[index] = state[index] + 1
+            state[-2] = state[-2] + 1
+            state[-1] = state[-1] + value
+
+    # Context manager observing time spent in its block.
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} {}'.format(self.name, self.type)]
+        for labels, state in sorted(self.samples(), key=lambda sample: sorted(sample[0].items())):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative = cumulative + count
+                bucket_labels = dict(labels, le='+Inf' if bound == float('inf') else formatValue(bound))
+                lines.append(self.name + '_bucket' + formatLabels(bucket_labels) + ' ' + str(cumulative))
+            lines.append(self.name + '_count' + formatLabels(labels) + ' ' + str(state[-2]))
+            lines.append(self.name + '_sum' + formatLabels(labels) + ' ' + formatValue(state[-1]))
+        return lines
+
+
+class Timer:
+    def __init__(self, histogram, labels):
+        self.__histogram = histogram
+        self.__labels = labels
+
+    def __enter__(self):
+        self.__started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.__histogram.observe(time.perf_counter() - self.__started, **self.__labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self.__metrics = {}
+        self.__lock = threading.Lock()
+
+    def counter(self, name='', help='', labels=()):
+        return self.__register(Counter, name, help, labels)
+
+    def gauge(self, name='', help='', labels=()):
+        return self.__register(Gauge, name, help, labels)
+
+    def histogram(self, name='', help='', labels=(), buckets=DEFAULT_BUCKETS):
+        return self.__register(Histogram, name, help, labels, buckets=buckets)
+
+    def metrics(self):
+        with self.__lock:
+            return [self.__metrics[name] for name in sorted(self.__metrics)]
+
+    # @return - all metrics in Prometheus text exposition format.
+    def render(self):
+        lines = []
+        for metric in self.metrics():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    # Metric registered again under the same name is returned as is, so modules can declare metrics they share.
+    def __register(self, cls, name, help, labels, **kwargs):
+        with self.__lock:
+            metric = self.__metrics.get(name)
+            if metric is None:
+                metric = self.__metrics[name] = cls(name, help, labels, **kwargs)
+            elif not isinstance(metric, cls) or metric.labels != tuple(labels):
+                raise ValueError('Metric {} is already registered with different type or labels'.format(name))
+            return metric
+
+
+REGISTRY = Registry()
+
+
+def counter(name='', help='', labels=()):
+    return REGISTRY.counter(name, help, labels)
+
+
+def gauge(name='', help='', labels=()):
+    return REGISTRY.gauge(name, help, labels)
+
+
+def histogram(name='', help='', labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, help, labels, buckets)
+
+
+def formatLabels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in sorted(labels.items())) + '}'
+
+
+def formatValue(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Nearest-rank percentile of raw samples, used by benchmarks and reports which keep every measured value.
+# @p - fraction between 0 and 1.
+# @return - sample at given percentile or None if there are no samples.
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class MetricsServer(ThreadingServer):
+    def __init__(self, address, registry=REGISTRY):
+        self.registry = registry
+        super().__init__(address, MetricsHandler)
+
+
+class MetricsHandler(KeepAliveHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.sendData(404, b'Not found\n', 'text/plain; version=0.0.4')
+        else:
+            self.sendData(200, self.server.registry.render().encode(), 'text/plain; version=0.0.4')
+
+
+# Starting /metrics endpoint in background thread.
+# @bind - "host:port" string.
+def startMetricsServer(bind='127.0.0.1:9100', registry=REGISTRY):
+    host, port = bind.rsplit(':', 1)
+    server = MetricsServer((host, int(port)), registry=registry)
+    thread = serveInBackground(server)
+    print("Serving metrics on http://{}:{}/metrics".format(host, port), file=sys.stderr)
+    return server, thread
+
+
+# Table of all histograms: number of observations, total and mean time. Histograms measure stages of scripts (RPC calls,
+# decoding, commits), so table shows where time of the run went.
+def stageReport(registry=REGISTRY):
+    rows = []
+    for metric in registry.metrics():
+        if not isinstance(metric, Histogram):
+            continue
+        for labels, state in metric.samples():
+            rows.append((metric.name + formatLabels(labels), state[-2], state[-1]))
+    rows.sort(key=lambda row: -row[2])
+    lines = ['{:<70} {:>10} {:>12} {:>12}'.format('stage', 'count', 'total [s]', 'mean [ms]')]
+    for name, count, total in rows:
+        lines.append('{:<70} {:>10} {:>12.3f} {:>12.3f}'.format(name, count, total, total / count * 1000 if count else 0))
+    return '\n'.join(lines) + '\n'
+
+
+class Profiler:
+    # @path - cProfile output, stage report is written to <path>.stages.txt
+    def __init__(self, path='', registry=REGISTRY):
+        self.path = path
+        self.__registry = registry
+        self.__profile = cProfile.Profile()
+        self.__stopped = False
+
+    def start(self):
+        self.__profile.enable()
+
+    def stop(self):
+        if self.__stopped:
+            return
+        self.__stopped = True
+        self.__profile.disable()
+        self.__profile.dump_stats(self.path)
+        report = stageReport(self.__registry)
+        with open(self.path + '.stages.txt', 'w') as file:
+            file.write(report)
+        sys.stderr.write(report)
+        sys.stderr.write("Profile written to {} (python3 -m pstats {})\n".format(self.path, self.path))
+
+
+# Profiling main thread until process exits. Other threads are not profiled, their time shows in stage report.
+def startProfiling(path=''):
+    profiler = Profiler(path)
+    profiler.start()
+    atexit.register(profiler.stop)
+    return profiler
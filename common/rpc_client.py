@@ -0,0 +1,132 @@
+import time
+import ujson
+import requests
+from requests.adapters import HTTPAdapter
+from common import metrics
+
+'''
+HTTP client shared by utility scripts for talking to safexd and safex-wallet-rpc.
+
+One requests.Session is kept per client, so TCP connections are reused between calls (keep-alive) and up to pool_size
+connections can be used concurrently from different threads.
+
+Every request is counted and timed per method in rpc_* metrics, batches are labeled batch:<method of first call>.
+'''
+
+RPC_SECONDS = metrics.histogram('rpc_request_seconds', 'Latency of RPC requests', ['method'])
+RPC_ERRORS = metrics.counter('rpc_errors_total', 'RPC requests which failed or returned error', ['method'])
+RPC_BYTES = metrics.counter('rpc_response_bytes_total', 'Size of RPC responses', ['method'])
+
+# Error codes of single response server sends to whole batch array when it doesn't accept batches (Invalid Request,
+# Parse error).
+BATCH_UNSUPPORTED_CODES = (-32600, -32700)
+
+
+class RPCError(Exception):
+    def __init__(self, method, error):
+        self.method = method
+        self.error = error
+        super().__init__('RPC method {} failed: {}'.format(method, error))
+
+
+class RPCClient:
+    # @url - base url of daemon or wallet rpc, e.g. http://localhost:17402/
+    # @pool_size - max number of connections kept open, should be at least number of threads using client.
+    # @timeout - seconds to wait for response, None means wait forever.
+    def __init__(self, url='', pool_size=10, timeout=None):
+        self.url = url if url.endswith('/') else url + '/'
+        self.timeout = timeout
+        self.__session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
+        # Daemons built on epee dont necessarily accept JSON-RPC batch arrays. If batch is rejected as invalid request
+        # client falls back to sending calls one by one over the same keep-alive connection.
+        self.__batch_supported = True
+
+    # @method - name of targeted method
+    # @params - parameters for given method.
+    # @return - result field of response.
+    def sendJSONRPCRequest(self, method="", params=None):
+        return self.sendJSONRPCRequestWithSize(method=method, params=params)[0]
+
+    # Same as sendJSONRPCRequest, but size of response body in bytes is returned as well.
+    # @return - result field of response and size of response.
+    def sendJSONRPCRequestWithSize(self, method="", params=None):
+        res = self.__post("json_rpc", ujson.dumps(self.__request(method, params)), method)
+        return self.__result(method, ujson.loads(res.text)), len(res.content)
+
+    # Sending many calls in one JSON-RPC 2.0 batch POST. Batching is turned off only when server answers whole batch
+    # with invalid request or parse error, any other failure (connection, unparsable or incomplete response) is raised
+    # and next batch is tried again.
+    # @calls - list of (method, params) pairs
+    # @return - list of results in the same order as calls.
+    def sendJSONRPCBatch(self, calls=[]):
+        if not calls:
+            return []
+        if self.__batch_supported:
+            label = "batch:" + calls[0][0]
+            batch = [self.__request(method, params, id=i) for i, (method, params) in enumerate(calls)]
+            res = ujson.loads(self.__post("json_rpc", ujson.dumps(batch), label).text)
+            if isinstance(res, list):
+                if len(res) != len(calls):
+                    RPC_ERRORS.inc(method=label)
+                    raise RPCError(label, 'Got {} responses for {} calls'.format(len(res), len(calls)))
+                results = [None] * len(calls)
+                for response in res:
+                    i = int(response["id"])
+                    results[i] = self.__result(calls[i][0], response)
+                return results
+            error = res.get("error") if isinstance(res, dict) else None
+            if not isinstance(error, dict) or error.get("code") not in BATCH_UNSUPPORTED_CODES:
+                RPC_ERRORS.inc(method=label)
+                raise RPCError(label, error if error is not None else res)
+            self.__batch_supported = False
+        return [self.sendJSONRPCRequest(method=method, params=params) for method, params in calls]
+
+    # Requests to daemon methods which are not part of JSON-RPC interface, e.g. get_transactions.
+    def sendPlainRequest(self, method="", body=None):
+        res = self.__post(method, ujson.dumps(body), method)
+        return ujson.loads(res.text)
+
+    def sendGetRequest(self, method=""):
+        started = time.perf_counter()
+        try:
+            res = self.__session.get(self.url + method, timeout=self.timeout)
+        except:
+            RPC_ERRORS.inc(method=method)
+            raise
+        self.__observe(method, started, res)
+        return ujson.loads(res.text)
+
+    def close(self):
+        self.__session.close()
+
+    # @label - method label of metrics.
+    def __post(self, method, data, label):
+        started = time.perf_counter()
+        try:
+            res = self.__session.post(self.url + method, data=data, timeout=self.timeout)
+        except:
+            RPC_ERRORS.inc(method=label)
+            raise
+        self.__observe(label, started, res)
+        return res
+
+    def __observe(self, label, started, res):
+        RPC_SECONDS.observe(time.perf_counter() - started, method=label)
+        RPC_BYTES.inc(len(res.content), method=label)
+
+    def __request(self, method, params, id=0):
+        return {
+            "jsonrpc": "2.0",
+            "id": str(id),
+            "method": method,
+            "params": params
+        }
+
+    def __result(self, method, response):
+        if "error" in response:
+            RPC_ERRORS.inc(method=method)
+            raise RPCError(method, response["error"])
+        return response["result"]
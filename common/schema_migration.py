@@ -0,0 +1,82 @@
+import argparse
+import os.path
+import sqlite3
+import sys
+
+'''
+Versioned schema migrations of SQLite DBs used by utility scripts.
+
+Schema version is kept in state table under key schema_version. Every tool keeps its own migrate_db.py with
+SCHEMA_VERSION, createSchema and MIGRATIONS - dict of version -> function(conn) bringing DB from that version to the
+next one - and runs them with migrate. Steps don't commit. migrate runs every step in explicit transaction, because
+sqlite3 module runs CREATE, ALTER and DROP outside of transaction it opens implicitly. SQLite DDL is transactional, so
+step which fails or is interrupted leaves DB at previous version and migration can be run again.
+'''
+
+
+# @legacy_version - function(cursor) returning version of DB which has state table but no schema_version (written
+#                   by tool before versioning was added), 0 if it is not DB of the tool.
+# @return - schema version, 0 if DB is not DB of the tool.
+def getSchemaVersion(cursor, legacy_version=None):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='state'")
+    if cursor.fetchone() is None:
+        return 0
+    cursor.execute("SELECT value FROM state WHERE key='schema_version'")
+    res = cursor.fetchone()
+    if res is not None:
+        return int(res[0])
+    return legacy_version(cursor) if legacy_version is not None else 0
+
+
+def setSchemaVersion(cursor, version):
+    cursor.execute("DELETE FROM state WHERE key='schema_version'")
+    cursor.execute("INSERT INTO state(key, value) VALUES('schema_version', ?)", [str(version)])
+
+
+# Bringing DB on given connection to schema_version. Each step runs and is committed in its own transaction.
+# @name - what DB holds, used in error messages.
+def migrate(conn, migrations={}, schema_version=0, name='', legacy_version=None):
+    cursor = conn.cursor()
+    version = getSchemaVersion(cursor, legacy_version)
+    if version == 0:
+        raise ValueError('Database does not contain {} schema!'.format(name))
+    if version > schema_version:
+        raise ValueError('Database schema version {} is newer than supported {}!'.format(version, schema_version))
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        while version < schema_version:
+            print("Migrating DB schema from version {} to {}".format(version, version + 1), file=sys.stderr)
+            cursor.execute("BEGIN")
+            try:
+                migrations[version](conn)
+                cursor.execute("COMMIT")
+            except:
+                if conn.in_transaction:
+                    cursor.execute("ROLLBACK")
+                raise
+            version = version + 1
+    finally:
+        conn.isolation_level = isolation_level
+
+
+# Command line entry point of migrate_db.py scripts.
+# @migrate - function(conn) migrating DB of the tool.
+def main(description='', migrate=None, schema_version=0):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--db-path', help="Path to Database file",
+                        required=False, type=str, default="./main.db")
+    parser.add_argument('--vacuum', help="Rebuild DB file after migration to reclaim space of dropped tables",
+                        action='store_true')
+    args = vars(parser.parse_args())
+
+    if not os.path.exists(args['db_path']):
+        print("There is no DB at {}".format(args['db_path']))
+        sys.exit(1)
+
+    conn = sqlite3.connect(args['db_path'])
+    migrate(conn)
+    if args['vacuum']:
+        conn.execute("VACUUM")
+    conn.close()
+    print("DB {} is at schema version {}".format(args['db_path'], schema_version))
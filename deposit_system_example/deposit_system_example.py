@@ -1,55 +1,133 @@
 
-import ujson
-import requests
+import argparse
+import asyncio
 import os.path
 import sqlite3
 import binascii
 import time
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import migrate_db
+from deposit_watcher import DepositWatcher
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.rpc_client import RPCClient
+from common import metrics
+
+# Number of make_integrated_address calls sent in one JSON-RPC batch while provisioning users.
+ADDRESS_BATCH_SIZE = 100
+
+# Number of batches of make_integrated_address calls in flight at once.
+ADDRESS_THREADS = 4
+
+SCAN_SECONDS = metrics.histogram('deposit_scan_seconds', 'Time spent in scan stages', ['stage'])
+COMMIT_SECONDS = metrics.histogram('sqlite_commit_seconds', 'Latency of SQLite commits', ['db'])
+PAYMENTS_CREDITED = metrics.counter('deposit_payments_credited_total', 'Payments credited to users', ['wallet'])
+PAYMENTS_UNKNOWN = metrics.counter('deposit_unknown_payments_total', 'Payment IDs which belong to no user',
+                                   ['wallet'])
+PENDING_CREDITS = metrics.gauge('deposit_pending_credits', 'Payments below confirmation depth or in tx pool',
+                                ['wallet'])
+LAST_BLOCK_SCANNED = metrics.gauge('deposit_last_block_scanned', 'Last block credited entirely', ['wallet'])
+WALLET_HEIGHT = metrics.gauge('deposit_wallet_height', 'Blockchain height reported by wallet', ['wallet'])
+USERS_CREATED = metrics.counter('deposit_users_created_total', 'Users created')
 
 ''' 
-DB will have next tables for now.
-pid_txid (id integer, pid text, txid text, block_height)
-state (id integer, key text, value text)
-user (id integer, username text, pid text, cash integer, token integer, integrated_address text)
+DB will have next tables for now (see migrate_db.py for schema versions).
+pid_txid (id INTEGER PRIMARY KEY, pid text, txid text UNIQUE, block_height integer)
+state (id INTEGER PRIMARY KEY, key text UNIQUE, value text)
+user (id INTEGER PRIMARY KEY, username text UNIQUE, pid text UNIQUE, cash integer, token integer, integrated_address text,
+      wallet integer)
+pending_credit (id INTEGER PRIMARY KEY, pid text, txid text UNIQUE, cash integer, token integer, block_height integer,
+                wallet integer)
+unclaimed_payment (id INTEGER PRIMARY KEY, pid text, txid text UNIQUE, cash integer, token integer,
+                   block_height integer, wallet integer)
+
+wallet is index of wallet-rpc endpoint (see DepositCoordinator), 0 when single wallet is used.
 '''
 
 # Class for handling saving data. Its sqlite3 database.
 class DB:
-    def __init__(self):
-        self.__db_path = 'main.db'
+    def __init__(self, db_path='main.db'):
+        self.__db_path = db_path
         exists = os.path.exists(self.__db_path)
         self.__db_conn = sqlite3.connect(self.__db_path)
         self.__cursor = self.__db_conn.cursor()
         if not exists:
             self.__recreateSchemaDB()
+        else:
+            migrate_db.migrate(self.__db_conn)
+        # PID -> user id. Users are never removed and their PID never changes, so entries don't need invalidation.
+        self.__user_ids = {}
 
     # Recreating db tables in case that db doesnt exists
     def __recreateSchemaDB(self):
-        self.__cursor.execute("CREATE TABLE pid_txid (id integer, pid text, txid text, block_height)")
-        self.__cursor.execute("CREATE TABLE state (id integer, key text, value text)")
-        self.__cursor.execute("CREATE TABLE user (id integer, username text, pid VARCHAR(64), cash integer, token integer, integrated_address text)")
+        migrate_db.createSchema(self.__cursor)
         self.__cursor.execute("INSERT INTO state(key, value) VALUES('last_block_scanned', '0')")
+        migrate_db.setSchemaVersion(self.__cursor, migrate_db.SCHEMA_VERSION)
         self.__db_conn.commit()
 
     # Creating user entry in user table.
-    def createUser(self, username='', pid='', integrated_address=''):
-        self.__cursor.execute("INSERT INTO user (username, pid, cash, token, integrated_address) VALUES(?,?,?,?,?)",
-                              [username, pid, 0, 0, integrated_address])
+    def createUser(self, username='', pid='', integrated_address='', wallet=0):
+        self.__cursor.execute("INSERT INTO user (username, pid, cash, token, integrated_address, wallet) "
+                              "VALUES(?,?,?,?,?,?)", [username, pid, 0, 0, integrated_address, wallet])
         self.__db_conn.commit()
 
+    # Creating many users in one transaction.
+    # @users - list of (username, pid, integrated_address, wallet) tuples.
+    def createUsers(self, users=[]):
+        try:
+            self.__cursor.executemany("INSERT INTO user (username, pid, cash, token, integrated_address, wallet) "
+                                      "VALUES(?,?,0,0,?,?)", users)
+            with COMMIT_SECONDS.time(db='deposit'):
+                self.__db_conn.commit()
+        except:
+            self.__db_conn.rollback()
+            raise
+
+    # Reserving count consecutive numbers from persisted PID sequence. Sequence starts at number of users, which is
+    # what older versions used as PID of next user. Reserved numbers are committed before they are used, so crash
+    # leaves gap in sequence, but never gives the same PID twice.
+    # @return - first reserved number.
+    def reservePaymentIDs(self, count=1):
+        try:
+            self.__cursor.execute("SELECT value FROM state WHERE key='pid_sequence'")
+            res = self.__cursor.fetchone()
+            if res is None:
+                last = self.getNumberOfUsers()
+            else:
+                last = int(res[0])
+            self.__setState('pid_sequence', str(last + count))
+            self.__db_conn.commit()
+        except:
+            self.__db_conn.rollback()
+            raise
+        return last + 1
+
     # Updating balance of user in table.
     def updateUserBalance(self, pid='', cash=0, token=0):
-        self.__cursor.execute("SELECT * FROM user WHERE pid = ?", [pid])
-        res = self.__cursor.fetchone()
-        if res is None:
+        user_id = self.getUserID(pid)
+        if user_id is None:
             return
 
-        token_val = res[4] + token
-        cash_val = res[3] + cash
-
-        self.__cursor.execute("UPDATE user set token=?, cash=? where pid=?", [token_val, cash_val, pid])
+        self.__cursor.execute("UPDATE user set token = token + ?, cash = cash + ? where id=?", [token, cash, user_id])
         self.__db_conn.commit()
 
+    # @return - id of user with given PID or None if there is no such user.
+    def getUserID(self, pid=''):
+        user_id = self.__user_ids.get(pid)
+        if user_id is None:
+            self.__cursor.execute("SELECT id FROM user WHERE pid = ?", [pid])
+            res = self.__cursor.fetchone()
+            if res is None:
+                return None
+            user_id = self.__user_ids[pid] = res[0]
+        return user_id
+
+    def hasUser(self, username=''):
+        self.__cursor.execute("SELECT 1 FROM user WHERE username=?", [username])
+        return self.__cursor.fetchone() is not None
+
     # Getting paymentID for given username
     def getPaymentID(self, username=''):
         self.__cursor.execute("SELECT pid FROM user WHERE username=?", [username])
@@ -62,6 +140,12 @@ class DB:
         res = self.__cursor.fetchone()
         return res[0]
 
+    # Getting index of wallet given user deposits to.
+    def getWallet(self, username=''):
+        self.__cursor.execute("SELECT wallet FROM user WHERE username=?", [username])
+        res = self.__cursor.fetchone()
+        return res[0]
+
     # Getting current number of users.
     def getNumberOfUsers(self):
         self.__cursor.execute("SELECT count(*) FROM user")
@@ -73,22 +157,18 @@ class DB:
 
     # Last scanned block height. Idea is to store in db everything needed so it can be continued without any problems
     # after possible shutdown of system.
-    def getLastScannedBlockHeight(self):
-        return self.getStateValue('last_block_scanned')
+    # Every wallet has its own checkpoint, wallet which was not scanned yet starts from 0.
+    def getLastScannedBlockHeight(self, wallet=0):
+        try:
+            return self.getStateValue(self.__checkpointKey(wallet))
+        except ValueError:
+            if wallet == 0:
+                raise
+            return '0'
 
     # Updating state  table.
     def updateState(self, key='', value=''):
-        if key == '' or value == '':
-            raise ValueError('Empty key or value! NOT PERMITTED!')
-
-        self.__cursor.execute("SELECT value FROM state WHERE key='"+key+"'")
-        res = self.__cursor.fetchone()
-
-        if res is None:
-            self.__cursor.execute("INSERT INTO state (key, value) VALUES(?,?)", [key, value])
-        else:
-            self.__cursor.execute("UPDATE state set value = ? where key=?", [value, key])
-
+        self.__setState(key, value)
         self.__db_conn.commit()
 
     # Retrieving value from state table
@@ -117,6 +197,62 @@ class DB:
 
         self.__db_conn.commit()
 
+    # Applying all payments of one scan in single transaction together with last_block_scanned. Payments with txid
+    # already stored are skipped thanks to unique index on pid_txid.txid, amounts are summed per PID in memory, so
+    # every user row is updated once and whole scan costs one commit.
+    # Payments for PIDs which don't belong to any user are kept in unclaimed_payment instead of pid_txid and credited
+    # by first scan after user with that PID is created. Unclaimed payments are credited before new ones, so payment
+    # fetched again meanwhile is already in pid_txid and is not credited twice.
+    # @payments - list of payments as returned by get_bulk_payments.
+    # @pending - if given, pending credits of wallet are replaced with these payments in the same transaction.
+    # @wallet - wallet payments were received by, its checkpoint is updated.
+    # @return - number of credited payments and list of unknown PIDs.
+    def creditPayments(self, payments=[], last_block_scanned=0, pending=None, wallet=0):
+        deltas = {}
+        unknown = []
+        try:
+            self.__cursor.execute("SELECT pid, txid, cash, token, block_height FROM unclaimed_payment "
+                                  "WHERE pid IN (SELECT pid FROM user)")
+            for pid, txid, cash, token, block_height in self.__cursor.fetchall():
+                self.__addCredit(deltas, pid, txid, cash, token, block_height)
+            self.__cursor.execute("DELETE FROM unclaimed_payment WHERE pid IN (SELECT pid FROM user)")
+
+            for payment in payments:
+                # NOTE: Be carefull here, its possible that transaction has some amount value
+                # even if its token transaction this is due fees which are paid in Safex Cash.
+                token = payment['token_amount'] if payment['token_transaction'] else 0
+                cash = 0 if payment['token_transaction'] else payment['amount']
+                if self.getUserID(payment["payment_id"]) is not None:
+                    self.__addCredit(deltas, payment["payment_id"], payment["tx_hash"], cash, token,
+                                     payment["block_height"])
+                    continue
+                self.__cursor.execute("INSERT OR IGNORE INTO unclaimed_payment (pid, txid, cash, token, block_height, "
+                                      "wallet) VALUES(?,?,?,?,?,?)", [payment["payment_id"], payment["tx_hash"], cash,
+                                                                      token, payment["block_height"], wallet])
+                if self.__cursor.rowcount == 1 and payment["payment_id"] not in unknown:
+                    unknown.append(payment["payment_id"])
+
+            credited = 0
+            for pid, (cash, token, count) in deltas.items():
+                self.__cursor.execute("UPDATE user set cash = cash + ?, token = token + ? where id = ?",
+                                      [cash, token, self.getUserID(pid)])
+                credited = credited + count
+            if pending is not None:
+                self.__replacePendingCredits(pending, wallet)
+            self.__setState(self.__checkpointKey(wallet), str(last_block_scanned))
+            with COMMIT_SECONDS.time(db='deposit'):
+                self.__db_conn.commit()
+        except:
+            self.__db_conn.rollback()
+            raise
+        return credited, unknown
+
+    # @return - cash and token amounts of payments for given PID which are not credited yet.
+    def getPendingBalance(self, pid=''):
+        self.__cursor.execute("SELECT coalesce(sum(cash), 0), coalesce(sum(token), 0) FROM pending_credit "
+                              "WHERE pid = ?", [pid])
+        return self.__cursor.fetchone()
+
     def printUsers(self):
         self.__cursor.execute("SELECT * FROM user")
         for row in self.__cursor:
@@ -127,28 +263,81 @@ class DB:
         for row in self.__cursor:
             print(row)
 
+    # Recording payment in pid_txid and adding its amounts to deltas of its PID, unless it was credited already.
+    # @deltas - dict of PID -> (cash, token, number of payments).
+    def __addCredit(self, deltas, pid, txid, cash, token, block_height):
+        self.__cursor.execute("INSERT OR IGNORE INTO pid_txid (pid, txid, block_height) VALUES(?,?,?)",
+                              [pid, txid, block_height])
+        if self.__cursor.rowcount == 0:
+            return
+        total_cash, total_token, count = deltas.get(pid, (0, 0, 0))
+        deltas[pid] = (total_cash + cash, total_token + token, count + 1)
+
+    # Payment which was credited meanwhile (e.g. pool was fetched before tx got into block) is not pending anymore.
+    def __replacePendingCredits(self, payments=[], wallet=0):
+        self.__cursor.execute("DELETE FROM pending_credit WHERE wallet = ?", [wallet])
+        for payment in payments:
+            token = payment['token_amount'] if payment['token_transaction'] else 0
+            cash = 0 if payment['token_transaction'] else payment['amount']
+            self.__cursor.execute("INSERT OR IGNORE INTO pending_credit (pid, txid, cash, token, block_height, wallet) "
+                                  "SELECT ?,?,?,?,?,? WHERE NOT EXISTS (SELECT 1 FROM pid_txid WHERE txid = ?)",
+                                  [payment["payment_id"], payment["tx_hash"], cash, token, payment["block_height"],
+                                   wallet, payment["tx_hash"]])
+
+    def __checkpointKey(self, wallet=0):
+        return 'last_block_scanned' if wallet == 0 else 'last_block_scanned_{}'.format(wallet)
+
+    def __setState(self, key='', value=''):
+        if key == '' or value == '':
+            raise ValueError('Empty key or value! NOT PERMITTED!')
+
+        self.__cursor.execute("UPDATE state set value = ? where key=?", [value, key])
+        if self.__cursor.rowcount == 0:
+            self.__cursor.execute("INSERT INTO state (key, value) VALUES(?,?)", [key, value])
+
 # Class for emulating exchange system.
 class System:
 
     # Initializing database
-    def __init__(self):
-        self.db = DB()
-        self.url = "http://localhost:17405/"
+    # @wallet - index of wallet when several wallets share one DB (see DepositCoordinator).
+    # @db - DB shared with other wallets, opened from db_path if not given.
+    def __init__(self, url="http://localhost:17405/", db_path='main.db', wallet=0, db=None):
+        self.db = db if db is not None else DB(db_path)
+        self.url = url
+        self.wallet = wallet
+        self.__rpc = RPCClient(self.url)
         self.__getAddress()
 
     # Creating user in database
     def createUser(self, username=""):
-        # Following simplest strategy by giving PaymentID by number of users already in DB.
-        num_of_users = self.db.getNumberOfUsers() + 1
-        #
-        pid = binascii.hexlify((num_of_users.to_bytes(32, 'little'))).decode('utf-8')
-        self.db.createUser(username=username, pid=pid)
+        # Following simplest strategy by giving PaymentID by next number of persisted sequence.
+        pid = self.__paymentID(self.db.reservePaymentIDs(1))
+        self.db.createUser(username=username, pid=pid, wallet=self.wallet)
+        USERS_CREATED.inc()
+
+    # Creating many users at once. PIDs are taken from the same sequence as in createUser, integrated addresses are
+    # made for 8 byte prefix of PID, which is the same PID padded with zeros.
+    # @usernames - list of unique usernames.
+    # @integrated_address - also generate integrated address for every user.
+    def createUsers(self, usernames=[], integrated_address=False):
+        if not usernames:
+            return
+        first = self.db.reservePaymentIDs(len(usernames))
+        numbers = range(first, first + len(usernames))
+        addresses = [''] * len(usernames)
+        if integrated_address:
+            addresses = self.__makeIntegratedAddresses([number.to_bytes(8, 'little').hex() for number in numbers])
+        self.db.createUsers([(username, self.__paymentID(number), address, self.wallet)
+                             for username, number, address in zip(usernames, numbers, addresses)])
+        USERS_CREATED.inc(len(usernames))
 
     # Creating user with integrated address and randomly generated paymentID
     # Optionally can be used to generate integrated address based on given payment ID
     def createUserWithIntegratedAddr(self, username=""):
         intAddress, PID = self.getIntegratedAddress()
-        self.db.createUser(username=username, pid=PID.ljust(64, '0'), integrated_address=intAddress)
+        self.db.createUser(username=username, pid=PID.ljust(64, '0'), integrated_address=intAddress,
+                           wallet=self.wallet)
+        USERS_CREATED.inc()
 
     # Generate integrated address with or without PaymentID
     def getIntegratedAddress(self, paymentID=''):
@@ -157,45 +346,80 @@ class System:
         return res["integrated_address"], res["payment_id"]
 
     # Scanning for payments
-    def scanForPayments(self):
-        # Getting from db last block height scanned
-        last_block_scanned = self.db.getLastScannedBlockHeight()
-
-        # Retrieve payments
-        res = self.__sendJSONRPCRequest(method="get_bulk_payments", params={"min_block_height": last_block_scanned})
-
-        # Get blockchain height from wallet. Its possible that we have lost some block
-        # Consider that loading payments can last for example 3 minutes. While response is loading
-        # new block can arrive. Thats why we are having linking between PaymentID and TXID and substracting 1 from
-        # resulting height.
-        height = self.__sendJSONRPCRequest(method="get_height", params={})['height'] - 1
-
+    # @confirmations - number of confirmations needed before payment is credited.
+    # @include_pool - record payments in tx pool as pending credits.
+    # @return - number of credited payments.
+    def scanForPayments(self, confirmations=1, include_pool=False):
+        height, payments, pool = self.fetchPayments(self.getLastScannedBlockHeight(), include_pool=include_pool)
+        return self.applyPayments(payments=payments, height=height, confirmations=confirmations, pool=pool)
+
+    # Getting from db last block height scanned in this wallet
+    def getLastScannedBlockHeight(self):
+        return int(self.db.getLastScannedBlockHeight(self.wallet))
+
+    # Only talks to wallet, so it can run in other thread than the one owning DB.
+    # @return - wallet height, payments above last_block_scanned and pool payments.
+    def fetchPayments(self, last_block_scanned=0, include_pool=False):
+        # Get blockchain height from wallet before payments. Consider that loading payments can last for example
+        # 3 minutes and new block can arrive meanwhile. Payments of that block are not credited in this scan, as only
+        # blocks below height taken here are marked as scanned.
+        with SCAN_SECONDS.time(stage='fetch'):
+            height = self.getHeight()
+
+            # Retrieve payments
+            payments = self.getPayments(min_block_height=last_block_scanned)
+            pool = self.getPoolPayments() if include_pool else []
+        return height, payments, pool
+
+    # Payments with at least given number of confirmations are credited, younger ones and pool payments are stored as
+    # pending credits. Block at height - confirmations is last block credited entirely, so it is saved as last block
+    # scanned and younger payments are fetched again next time.
+    # @height - wallet height taken before payments were fetched.
+    # @return - number of credited payments.
+    def applyPayments(self, payments=[], height=0, confirmations=1, pool=[]):
+        last_block_scanned = height - confirmations
+        confirmed = [payment for payment in payments if payment["block_height"] <= last_block_scanned]
+        pending = [payment for payment in payments if payment["block_height"] > last_block_scanned] + pool
+
+        # Payments are credited and last block height scanned is saved at once. Already processed transactions are
+        # skipped.
+        with SCAN_SECONDS.time(stage='apply'):
+            credited, unknown = self.db.creditPayments(payments=confirmed, last_block_scanned=last_block_scanned,
+                                                       pending=pending, wallet=self.wallet)
+        PAYMENTS_CREDITED.inc(credited, wallet=self.wallet)
+        PAYMENTS_UNKNOWN.inc(len(unknown), wallet=self.wallet)
+        PENDING_CREDITS.set(len(pending), wallet=self.wallet)
+        LAST_BLOCK_SCANNED.set(last_block_scanned, wallet=self.wallet)
+        if unknown:
+            print("Payments for unknown payment IDs: {}".format(", ".join(unknown)))
+        return credited
+
+    # Getting number of blocks known to wallet.
+    def getHeight(self):
+        height = self.__sendJSONRPCRequest(method="get_height", params={})['height']
+        WALLET_HEIGHT.set(height, wallet=self.wallet)
+        return height
+
+    # @return - payments in blocks above min_block_height.
+    def getPayments(self, min_block_height=0):
+        res = self.__sendJSONRPCRequest(method="get_bulk_payments", params={"min_block_height": min_block_height})
         # If there is no payments, preventing error of accessing non existing data.
         if not res:
-            res["payments"] = []
-
-        # Iterate through payments
-        for payment in res["payments"]:
-            try:
-                # If there is already processed transaction id it will raise exception and just skip that payment, as
-                # its already processed
-                self.db.updatePID2TXID(pid=payment["payment_id"],
-                                       txid=payment["tx_hash"],
-                                       block_height=payment["block_height"])
-
-                # Update corresponding amount
-                # NOTE: Be carefull here, its possible that transaction has some amount value
-                # even if its token transaction this is due fees which are paid in Safex Cash.
-                if payment['token_transaction']:
-                    self.db.updateUserBalance(payment['payment_id'], cash=0, token=payment['token_amount'])
-                else:
-                    self.db.updateUserBalance(payment['payment_id'], cash=payment['amount'], token=0)
-            except:
-                # Skip transaction in case that its already processed
+            return []
+        return res["payments"]
+
+    # Incoming transfers in tx pool converted to get_bulk_payments format, block_height is None.
+    def getPoolPayments(self):
+        res = self.__sendJSONRPCRequest(method="get_transfers", params={"pool": True})
+        payments = []
+        for transfer in (res or {}).get("pool", []):
+            if int(transfer.get("payment_id") or '0', 16) == 0:
                 continue
-
-        # Save last block height scanned
-        self.db.updateState(key="last_block_scanned", value=str(height))
+            token_amount = transfer.get("token_amount", 0)
+            payments.append({"payment_id": transfer["payment_id"].ljust(64, '0'), "tx_hash": transfer["txid"],
+                             "block_height": None, "amount": transfer.get("amount", 0), "token_amount": token_amount,
+                             "token_transaction": transfer.get("token_transaction", token_amount > 0)})
+        return payments
 
     # Updating user balance
     def updateUser(self, pid='', token=0, cash=0):
@@ -209,6 +433,21 @@ class System:
 
     def setWalletRPCURL(self, url=''):
         self.url = url
+        self.__rpc.close()
+        self.__rpc = RPCClient(self.url)
+
+    def __paymentID(self, number):
+        return binascii.hexlify(number.to_bytes(32, 'little')).decode('utf-8')
+
+    # Making integrated addresses in JSON-RPC batches, several batches in parallel over pooled connections.
+    # @return - list of integrated addresses in order of payment_ids.
+    def __makeIntegratedAddresses(self, payment_ids=[]):
+        batches = [[("make_integrated_address", {"payment_id": payment_id, "standard_address": self.address})
+                    for payment_id in payment_ids[i:i + ADDRESS_BATCH_SIZE]]
+                   for i in range(0, len(payment_ids), ADDRESS_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=ADDRESS_THREADS) as executor:
+            return [res["integrated_address"] for results in executor.map(self.__rpc.sendJSONRPCBatch, batches)
+                    for res in results]
 
     def __getAddress(self):
         res = self.__sendJSONRPCRequest(method="get_address", params={})
@@ -216,28 +455,133 @@ class System:
 
     # Private method handling requests to wallet-rpc
     def __sendJSONRPCRequest(self, method="", params=None):
-        data = {
-            "jsonrpc": "2.0",
-            "id": "0",
-            "method": method,
-            "params": params
-        }
+        return self.__rpc.sendJSONRPCRequest(method=method, params=params)
+
+# Deposit system spread over several wallet-rpc instances sharing one DB. Users are assigned to wallets round-robin when
+# they are created and get integrated address of their wallet. PIDs come from one sequence, so payment is credited by
+# PID regardless of wallet which received it. Every wallet is scanned from its own checkpoint. Wallet requests run
+# concurrently, results are applied to DB from calling thread, one transaction per wallet.
+class DepositCoordinator:
+    # @urls - wallet-rpc urls, order of urls is wallet index stored in DB, so it must not change between runs.
+    def __init__(self, urls=[], db_path='main.db'):
+        self.db = DB(db_path)
+        self.systems = [System(url=url, wallet=wallet, db=self.db) for wallet, url in enumerate(urls)]
+        self.__executor = ThreadPoolExecutor(max_workers=len(self.systems))
+        self.__lock = threading.Lock()
+        self.__next_wallet = 0
+
+    def createUser(self, username=""):
+        self.__nextSystem().createUser(username)
+
+    def createUserWithIntegratedAddr(self, username=""):
+        self.__nextSystem().createUserWithIntegratedAddr(username)
+
+    def createUsers(self, usernames=[], integrated_address=False):
+        for system in self.systems:
+            system.createUsers(usernames[system.wallet::len(self.systems)], integrated_address=integrated_address)
+
+    # Wallet which fails is skipped until next scan, its checkpoint stays where it was.
+    # @return - number of credited payments.
+    def scanForPayments(self, confirmations=1, include_pool=False):
+        futures = [self.__executor.submit(system.fetchPayments, system.getLastScannedBlockHeight(), include_pool)
+                   for system in self.systems]
+        credited = 0
+        for system, future in zip(self.systems, futures):
+            try:
+                height, payments, pool = future.result()
+            except Exception as e:
+                print("Error while scanning wallet {}: {}".format(system.url, e))
+                continue
+            credited = credited + system.applyPayments(payments=payments, height=height, confirmations=confirmations,
+                                                       pool=pool)
+        return credited
+
+    # Running one DepositWatcher per wallet on the same event loop.
+    async def watch(self, confirmations=1, poll_interval=1.0, include_pool=False):
+        watchers = [DepositWatcher(system, confirmations=confirmations, poll_interval=poll_interval,
+                                   include_pool=include_pool) for system in self.systems]
+        await asyncio.gather(*[watcher.run() for watcher in watchers])
+
+    def printStats(self):
+        self.systems[0].printStats()
+
+    # Wallets take turns in creating single users. Turn is kept in memory, so creating user doesn't count users in DB.
+    def __nextSystem(self):
+        with self.__lock:
+            system = self.systems[self.__next_wallet]
+            self.__next_wallet = (self.__next_wallet + 1) % len(self.systems)
+        return system
+
+
+def handleCLIArguments():
+    parser = argparse.ArgumentParser(description='Example deposit system crediting payments received by wallet')
+    parser.add_argument('--wallet-rpc-url', help="Url of the Safex wallet RPC, several urls spread users and scanning "
+                                                 "over several wallets (keep their order between runs)",
+                        required=False, type=str, nargs='+', default=["http://localhost:17405"])
+    parser.add_argument('--db-path', help="Path to Database file",
+                        required=False, type=str, default="./main.db")
+    parser.add_argument('--watch', help="Follow wallet height with asyncio watcher instead of periodic full scans",
+                        action='store_true')
+    parser.add_argument('--poll-interval', help="Seconds between two scans, default is 10, or 1 with --watch",
+                        required=False, type=float)
+    parser.add_argument('--confirmations', help="Number of confirmations needed before payment is credited, "
+                                                "younger payments are kept as pending credits",
+                        required=False, type=int, default=1)
+    parser.add_argument('--include-pool', help="Keep payments from tx pool as pending credits",
+                        action='store_true')
+    parser.add_argument('--provision-users', help="Create users from file with one username per line and exit",
+                        required=False, type=str)
+    parser.add_argument('--integrated-addresses', help="Generate integrated address for every provisioned user",
+                        action='store_true')
+    parser.add_argument('--metrics-bind', help="Serve Prometheus metrics on http://<host:port>/metrics",
+                        required=False, type=str)
+    parser.add_argument('--profile', help="Profile run with cProfile, write profile to given file and stage timing "
+                                          "report to <file>.stages.txt",
+                        required=False, type=str)
+    args = vars(parser.parse_args())
+    if args['confirmations'] < 1:
+        parser.error('--confirmations must be at least 1')
+    if args['poll_interval'] is None:
+        args['poll_interval'] = 1.0 if args['watch'] else 10.0
+    return args
 
-        res = requests.post(self.url + "json_rpc", data=ujson.dumps(data))
-        return ujson.loads(res.text)["result"]
 
 def main():
-    sys = System()
-    sys.setWalletRPCURL(url="http://localhost:17405/")
-    sys.createUser("t3v4")
-    sys.createUser("atan")
-    sys.createUserWithIntegratedAddr("Uki")
+    args = handleCLIArguments()
+    if args['profile'] is not None:
+        metrics.startProfiling(args['profile'])
+    if args['metrics_bind'] is not None:
+        metrics.startMetricsServer(args['metrics_bind'])
+
+    sys = DepositCoordinator(urls=[url + "/" for url in args['wallet_rpc_url']], db_path=args['db_path'])
+    if args['provision_users'] is not None:
+        with open(args['provision_users']) as file:
+            usernames = [line.strip() for line in file if line.strip() != '']
+        started = time.time()
+        sys.createUsers(usernames, integrated_address=args['integrated_addresses'])
+        print("Created {} users in {:.1f}s".format(len(usernames), time.time() - started))
+        return
+
+    # Usernames are unique, so example users are created only on first run.
+    for username in ["t3v4", "atan"]:
+        if not sys.db.hasUser(username):
+            sys.createUser(username)
+    if not sys.db.hasUser("Uki"):
+        sys.createUserWithIntegratedAddr("Uki")
 
     sys.printStats()
+    if args['watch']:
+        print("Watching wallet for payments")
+        asyncio.get_event_loop().run_until_complete(sys.watch(confirmations=args['confirmations'],
+                                                              poll_interval=args['poll_interval'],
+                                                              include_pool=args['include_pool']))
+        return
+
     print("Starting active check")
     while True:
-        sys.scanForPayments()
+        sys.scanForPayments(confirmations=args['confirmations'], include_pool=args['include_pool'])
         sys.printStats()
-        time.sleep(10)
+        time.sleep(args['poll_interval'])
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
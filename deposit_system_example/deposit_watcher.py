@@ -0,0 +1,60 @@
+import asyncio
+
+'''
+Near real-time crediting for deposit system.
+
+Instead of full scan every few seconds, watcher polls cheap get_height and fetches get_bulk_payments only when wallet
+height changed, starting above last block credited. Payment is credited as soon as its block reaches confirmation
+depth, younger payments and (optionally) payments from tx pool are kept in pending_credit table, so they can be shown
+to users right away.
+
+Wallet requests run in default executor, so pool and height are fetched concurrently and slow wallet doesn't block
+event loop. DB is touched only from event loop thread, sqlite connection belongs to it.
+'''
+
+
+class DepositWatcher:
+    # @system - deposit_system_example.System
+    def __init__(self, system, confirmations=1, poll_interval=1.0, include_pool=False):
+        self.confirmations = confirmations
+        self.poll_interval = poll_interval
+        self.include_pool = include_pool
+        self.__system = system
+        self.__height = None
+        self.__payments = []
+        self.__pool_txids = None
+
+    async def run(self):
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                print("Error while watching wallet: {}".format(e))
+            await asyncio.sleep(self.poll_interval)
+
+    # Single round of watching. Nothing is written to DB if neither wallet height nor pool changed.
+    # @return - number of credited payments.
+    async def poll(self):
+        loop = asyncio.get_event_loop()
+        height, pool = await asyncio.gather(loop.run_in_executor(None, self.__system.getHeight),
+                                            self.__getPoolPayments(loop))
+        pool_txids = {payment["tx_hash"] for payment in pool}
+        if height == self.__height and pool_txids == self.__pool_txids:
+            return 0
+
+        # Payments above last credited block are fetched again only when new block arrived.
+        if height != self.__height:
+            last_block_scanned = self.__system.getLastScannedBlockHeight()
+            self.__payments = await loop.run_in_executor(None, self.__system.getPayments, last_block_scanned)
+        credited = self.__system.applyPayments(payments=self.__payments, height=height,
+                                               confirmations=self.confirmations, pool=pool)
+        self.__height = height
+        self.__pool_txids = pool_txids
+        if credited > 0:
+            print("Credited {} payments up to block {}".format(credited, height - self.confirmations))
+        return credited
+
+    async def __getPoolPayments(self, loop):
+        if not self.include_pool:
+            return []
+        return await loop.run_in_executor(None, self.__system.getPoolPayments)
@@ -0,0 +1,110 @@
+#!/usr/bin/python3.6
+
+import os.path
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import schema_migration
+from common.schema_migration import setSchemaVersion
+
+'''
+Schema handling for deposit system DB.
+
+Version 1 (legacy) - pid_txid, state and user tables without keys or indexes (id columns were never filled), every
+                     lookup by pid, username or txid is full table scan.
+Version 2 - integer primary keys, unique username and pid in user, unique txid in pid_txid and unique key in state.
+Version 3 - pending_credit table with payments which are not credited yet (in pool or below confirmation depth).
+Version 4 - wallet column in user and pending_credit, index of wallet-rpc endpoint user belongs to / payment was seen
+            by. Scan checkpoint of wallet 0 stays last_block_scanned, other wallets use last_block_scanned_<wallet>.
+Version 5 - unclaimed_payment table with confirmed payments for PIDs which don't belong to any user yet, credited once
+            user with that PID exists.
+'''
+
+SCHEMA_VERSION = 5
+
+
+# Creating tables of current schema version.
+def createSchema(cursor):
+    cursor.execute("CREATE TABLE pid_txid (id INTEGER PRIMARY KEY, pid text, txid text UNIQUE, block_height integer)")
+    cursor.execute("CREATE TABLE state (id INTEGER PRIMARY KEY, key text UNIQUE, value text)")
+    cursor.execute("CREATE TABLE user (id INTEGER PRIMARY KEY, username text UNIQUE, pid VARCHAR(64) UNIQUE, "
+                   "cash integer, token integer, integrated_address text, wallet integer NOT NULL DEFAULT 0)")
+    cursor.execute("CREATE TABLE pending_credit (id INTEGER PRIMARY KEY, pid text, txid text UNIQUE, cash integer, "
+                   "token integer, block_height integer, wallet integer NOT NULL DEFAULT 0)")
+    cursor.execute("CREATE INDEX pending_credit_pid ON pending_credit (pid)")
+    cursor.execute("CREATE TABLE unclaimed_payment (id INTEGER PRIMARY KEY, pid text, txid text UNIQUE, cash integer, "
+                   "token integer, block_height integer, wallet integer NOT NULL DEFAULT 0)")
+
+
+# Version 1 DBs have state table, but no schema_version in it.
+def legacyVersion(cursor):
+    return 1
+
+
+# Tables are rewritten in rowid order, so users get ids in order they were created. Duplicate usernames or PIDs can't
+# be merged automatically without losing balance, so migration stops and they have to be resolved by hand.
+def migrateV1ToV2(conn):
+    cursor = conn.cursor()
+    for column in ['username', 'pid']:
+        cursor.execute("SELECT " + column + " FROM user GROUP BY " + column + " HAVING count(*) > 1")
+        duplicates = [row[0] for row in cursor.fetchall()]
+        if duplicates:
+            raise ValueError('Duplicate {} in user table: {}'.format(column, ', '.join(map(str, duplicates))))
+
+    cursor.execute("CREATE TABLE user_v2 (id INTEGER PRIMARY KEY, username text UNIQUE, pid VARCHAR(64) UNIQUE, "
+                   "cash integer, token integer, integrated_address text)")
+    cursor.execute("INSERT INTO user_v2 (username, pid, cash, token, integrated_address) "
+                   "SELECT username, pid, cash, token, integrated_address FROM user ORDER BY rowid")
+    cursor.execute("DROP TABLE user")
+    cursor.execute("ALTER TABLE user_v2 RENAME TO user")
+
+    # Txid is stored once per payment, so repeated rows are copies of the same payment.
+    cursor.execute("CREATE TABLE pid_txid_v2 (id INTEGER PRIMARY KEY, pid text, txid text UNIQUE, "
+                   "block_height integer)")
+    cursor.execute("INSERT OR IGNORE INTO pid_txid_v2 (pid, txid, block_height) "
+                   "SELECT pid, txid, block_height FROM pid_txid ORDER BY rowid")
+    cursor.execute("DROP TABLE pid_txid")
+    cursor.execute("ALTER TABLE pid_txid_v2 RENAME TO pid_txid")
+
+    # Last written value of key wins.
+    cursor.execute("CREATE TABLE state_v2 (id INTEGER PRIMARY KEY, key text UNIQUE, value text)")
+    cursor.execute("INSERT OR REPLACE INTO state_v2 (key, value) SELECT key, value FROM state ORDER BY rowid")
+    cursor.execute("DROP TABLE state")
+    cursor.execute("ALTER TABLE state_v2 RENAME TO state")
+    setSchemaVersion(cursor, 2)
+
+
+# block_height is NULL for payments in tx pool.
+def migrateV2ToV3(conn):
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE pending_credit (id INTEGER PRIMARY KEY, pid text, txid text UNIQUE, cash integer, "
+                   "token integer, block_height integer)")
+    cursor.execute("CREATE INDEX pending_credit_pid ON pending_credit (pid)")
+    setSchemaVersion(cursor, 3)
+
+
+# Existing users and pending credits belong to the only wallet used so far.
+def migrateV3ToV4(conn):
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE user ADD COLUMN wallet integer NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE pending_credit ADD COLUMN wallet integer NOT NULL DEFAULT 0")
+    setSchemaVersion(cursor, 4)
+
+
+# Payments for unknown PIDs stored by older versions are in pid_txid without amounts, so they can't be moved here.
+def migrateV4ToV5(conn):
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE unclaimed_payment (id INTEGER PRIMARY KEY, pid text, txid text UNIQUE, cash integer, "
+                   "token integer, block_height integer, wallet integer NOT NULL DEFAULT 0)")
+    setSchemaVersion(cursor, 5)
+
+
+MIGRATIONS = {1: migrateV1ToV2, 2: migrateV2ToV3, 3: migrateV3ToV4, 4: migrateV4ToV5}
+
+
+def migrate(conn):
+    schema_migration.migrate(conn, MIGRATIONS, SCHEMA_VERSION, name='deposit system', legacy_version=legacyVersion)
+
+
+if __name__ == '__main__':
+    schema_migration.main('One-shot migration of deposit system DB to current schema', migrate, SCHEMA_VERSION)
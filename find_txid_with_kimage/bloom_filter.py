@@ -0,0 +1,92 @@
+import math
+import mmap
+import os.path
+import struct
+
+'''
+Bloom filter of indexed key images, stored in memory-mapped file next to DB (<db-path>.bloom).
+
+Key images are outputs of hash function, so bit positions are derived from key image bytes directly with double
+hashing instead of hashing them again. Filter answers "not indexed" without touching SQLite, "maybe indexed" still
+has to be confirmed by DB.
+
+File starts with header (magic, number of hashes, number of bits, capacity, count, synced height, synced block hash)
+followed by bit array. synced_height is last_block_scanned at which filter contains every key image in DB and
+synced_hash is hash of block at that height. They are written after DB commit, so filter with synced_height or
+synced_hash different from DB (e.g. DB was rolled back and resynced to same height without filter) has to be rebuilt.
+'''
+
+MAGIC = b'KIB2'
+HEADER_FORMAT = '<4sIQQQq32s'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+DEFAULT_CAPACITY = 10000000
+DEFAULT_FP_RATE = 0.01
+
+
+class BloomFilter:
+    def __init__(self, path=''):
+        self.path = path
+        self.__file = open(path, 'r+b')
+        self.__map = mmap.mmap(self.__file.fileno(), 0)
+        magic, self.num_hashes, self.num_bits, self.capacity, self.count, self.synced_height, self.synced_hash = \
+            struct.unpack_from(HEADER_FORMAT, self.__map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('File ' + path + ' is not key image bloom filter!')
+
+    # Creating empty filter file sized for capacity key images with given false positive rate.
+    @staticmethod
+    def create(path='', capacity=DEFAULT_CAPACITY, fp_rate=DEFAULT_FP_RATE):
+        num_bits = int(math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        num_bits = (num_bits + 7) // 8 * 8
+        num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        with open(path, 'wb') as file:
+            file.write(struct.pack(HEADER_FORMAT, MAGIC, num_hashes, num_bits, capacity, 0, -1, b''))
+            file.truncate(HEADER_SIZE + num_bits // 8)
+        return BloomFilter(path)
+
+    @staticmethod
+    def exists(path=''):
+        return os.path.exists(path)
+
+    # @k_image - 32 bytes
+    def add(self, k_image=b''):
+        for bit in self.__bits(k_image):
+            offset = HEADER_SIZE + (bit >> 3)
+            self.__map[offset] = self.__map[offset] | (1 << (bit & 7))
+        self.count = self.count + 1
+
+    def addMany(self, k_images=[]):
+        for k_image in k_images:
+            self.add(k_image)
+
+    # @return - False if key image is surely not indexed, True if it might be.
+    def mightContain(self, k_image=b''):
+        for bit in self.__bits(k_image):
+            if not self.__map[HEADER_SIZE + (bit >> 3)] & (1 << (bit & 7)):
+                return False
+        return True
+
+    def isFull(self):
+        return self.count > self.capacity
+
+    # Storing count, height and block hash which filter is in sync with.
+    # @block_hash - 32 bytes, hash of block at given height.
+    def setSyncedHeight(self, height=0, block_hash=b''):
+        self.synced_height = height
+        self.synced_hash = block_hash.ljust(32, b'\0')
+        struct.pack_into(HEADER_FORMAT, self.__map, 0, MAGIC, self.num_hashes, self.num_bits, self.capacity,
+                         self.count, self.synced_height, self.synced_hash)
+
+    def flush(self):
+        self.__map.flush()
+
+    def close(self):
+        self.__map.close()
+        self.__file.close()
+
+    def __bits(self, k_image):
+        h1 = int.from_bytes(k_image[0:8], 'little')
+        h2 = int.from_bytes(k_image[8:16], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
@@ -1,19 +1,62 @@
 #!/usr/bin/python3.6
 
 import ujson
-import requests
+import csv
+import glob
+import multiprocessing
+import multiprocessing.connection
 import os.path
 import sqlite3
 import sys
 import argparse
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Full
+import bloom_filter
+import migrate_db
+import query_server
+import tx_decoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import metrics
+from common.rpc_client import RPCClient
 
 ''' 
-DB will have two main tables for now.
-txid_k_images - id, txid, type, k_images
+DB will have four main tables for now.
+txs - id, txid, type, block_height (txid is 32 byte BLOB, type is tx_decoder type code)
+k_images - k_image, tx_id (one row per key image, k_image is 32 byte BLOB primary key)
+blocks - height, hash (hashes of synced blocks, used for detecting reorgs)
 state - key, value
 '''
 
-config = {"db-path":"", "daemon-url":""}
+config = {"db-path":"", "daemon-url":"", "threads":8, "chunk-size":1000, "sqlite-synchronous":"NORMAL",
+          "sqlite-cache-size":64, "decode-workers":0, "bloom":False}
+
+# Number of txs requested from daemon in one get_transactions call.
+TX_BATCH_SIZE = 500
+
+# Number of get_block calls sent in one JSON-RPC batch.
+BLOCK_BATCH_SIZE = 50
+
+# Batches smaller than this are decoded in-process, sending them to decoder pool costs more than it saves.
+MIN_PARALLEL_DECODE = 200
+
+# Number of stored block hashes compared with daemon at once while looking for fork point.
+REORG_WINDOW = 100
+
+# Seconds between two backfill progress printouts.
+BACKFILL_PROGRESS_INTERVAL = 1.0
+
+STAGE_SECONDS = metrics.histogram('indexer_stage_seconds', 'Time spent in sync stages', ['stage'])
+COMMIT_SECONDS = metrics.histogram('sqlite_commit_seconds', 'Latency of SQLite commits', ['db'])
+BLOCKS_SYNCED = metrics.counter('indexer_blocks_synced_total', 'Blocks synced into DB')
+TXS_PROCESSED = metrics.counter('indexer_txs_processed_total', 'Txs decoded and stored in DB')
+LAST_BLOCK_SCANNED = metrics.gauge('indexer_last_block_scanned', 'Last block height stored in DB')
+DAEMON_HEIGHT = metrics.gauge('indexer_daemon_height', 'Blockchain height reported by daemon')
+SYNC_LAG = metrics.gauge('indexer_sync_lag_blocks', 'Number of daemon blocks not synced into DB yet')
+QUEUE_DEPTH = metrics.gauge('indexer_queue_depth', 'Header pages fetched ahead and requests in flight', ['queue'])
 
 # Initial data store capabilities for tool(s)
 class DB:
@@ -22,31 +65,37 @@ class DB:
         exists = os.path.exists(self.__db_path)
         self.__db_conn = sqlite3.connect(self.__db_path)
         self.__cursor = self.__db_conn.cursor()
+        self.__setPragmas()
         if not exists:
             self.__recreateSchemaDB()
+        else:
+            migrate_db.migrate(self.__db_conn)
+        self.__bloom = None
+        if config['bloom']:
+            self.__openBloomFilter()
+
+    # WAL lets commit append to log instead of rewriting pages, so with synchronous=NORMAL every chunk costs single
+    # fsync at most. Cache size is given in MiB.
+    def __setPragmas(self):
+        self.__cursor.execute("PRAGMA journal_mode=WAL")
+        self.__cursor.execute("PRAGMA synchronous=" + config['sqlite-synchronous'])
+        self.__cursor.execute("PRAGMA cache_size=" + str(-1024 * int(config['sqlite-cache-size'])))
 
     def __recreateSchemaDB(self):
-        # Create txid_k_images
-        self.__cursor.execute("CREATE TABLE txid_k_images (id integer, txid text, type text, k_images text)")
-        self.__cursor.execute("CREATE TABLE state (id integer, key text, value text)")
+        migrate_db.createSchema(self.__cursor)
         self.__cursor.execute("INSERT INTO state(key, value) VALUES('last_block_scanned', '0')")
+        migrate_db.setSchemaVersion(self.__cursor, migrate_db.SCHEMA_VERSION)
         self.__db_conn.commit()
 
     def getLastScannedBlockHeight(self):
         return self.getStateValue('last_block_scanned')
 
-    def updateState(self, key='', value=''):
-        if key == '' or value == '':
-            raise ValueError('Empty key or value! NOT PERMITTED!')
-
-        self.__cursor.execute("SELECT value FROM state WHERE key='"+key+"'")
-        res = self.__cursor.fetchone()
-
-        if res == None:
-            self.__cursor.execute("INSERT INTO state (key, value) VALUES(?,?)", [key, value])
-        else:
-            self.__cursor.execute("UPDATE state set value = '"+str(value)+"' where key='"+key+"'")
+    # @return - BloomFilter of indexed key images or None if it is not enabled.
+    def getBloomFilter(self):
+        return self.__bloom
 
+    def updateState(self, key='', value=''):
+        self.__setState(key, value)
         self.__db_conn.commit()
 
     def getStateValue(self, key=''):
@@ -59,84 +108,426 @@ class DB:
         else:
             return res[0]
 
-    def updateTx2KImage(self, txid='', type='', k_images=[]):
+    def updateTx2KImage(self, txid='', type='', k_images=[], block_height=0):
         if txid == '' or type == '' or k_images == []:
             raise ValueError('Some of input data is empty!')
-        insert_sql_query = "INSERT INTO txid_k_images (txid, type, k_images) VALUES(?,?,?)"
-        self.__cursor.execute("SELECT value FROM txid_k_images WHERE txid='" + str(txid) + "'")
+        self.__cursor.execute("SELECT id FROM txs WHERE txid=?", [bytes.fromhex(txid)])
         res = self.__cursor.fetchone()
 
         if res == None:
-            self.__cursor.execute(insert_sql_query, [txid, type, str(k_images)])
+            self.__insertTx(bytes.fromhex(txid), tx_decoder.TYPE_CODES[type],
+                            [bytes.fromhex(k_image) for k_image in k_images], block_height)
         else:
             raise OverflowError
         self.__db_conn.commit()
 
+    # @data - list of (txid, type, k_images, block_height) tuples, txid and k_images are hex strings, type is
+    # 'plain' or 'migration'.
     def updateTx2KImageMany(self, data=[]):
-        insert_sql_query = "INSERT INTO txid_k_images (txid, type, k_images) VALUES(?,?,?)"
-        self.__cursor.executemany(insert_sql_query, data)
+        for txid, type, k_images, block_height in data:
+            self.__insertTx(bytes.fromhex(txid), tx_decoder.TYPE_CODES[type],
+                            [bytes.fromhex(k_image) for k_image in k_images], block_height)
         self.__db_conn.commit()
 
+    # Txs and block hashes of synced chunk and last_block_scanned are written in one transaction, so DB never contains
+    # txs above checkpoint or checkpoint above missing txs. Repeating chunk after crash is no-op thanks to
+    # INSERT OR IGNORE.
+    # @data - list of compact tuples produced by tx_decoder.
+    # @block_hashes - list of (height, hash) pairs, hash is hex string.
+    def saveChunk(self, data=[], block_hashes=[], last_block_scanned=0):
+        try:
+            for txid, type, k_images, block_height in data:
+                self.__insertTx(txid, type, tx_decoder.unpackKeyImages(k_images), block_height)
+            self.__cursor.executemany("INSERT OR REPLACE INTO blocks (height, hash) VALUES(?,?)",
+                                      [(height, bytes.fromhex(hash)) for height, hash in block_hashes])
+            self.__setState('last_block_scanned', last_block_scanned)
+            with COMMIT_SECONDS.time(db='indexer'):
+                self.__db_conn.commit()
+        except:
+            self.__db_conn.rollback()
+            raise
+        self.__syncBloomFilter(last_block_scanned)
+
+    # Appending txs, key images and block hashes of finished shard DB in one transaction. Shard has to start right
+    # after last_block_scanned. Tx ids are reassigned on insert, so key images are joined to new ids through txid.
+    # @path - path of shard DB synced up to end_height.
+    def mergeShard(self, path='', start_height=0, end_height=0):
+        last_block_scanned = int(self.getLastScannedBlockHeight())
+        if last_block_scanned != start_height - 1:
+            raise ValueError('Shard {} - {} does not continue DB synced up to {}!'.format(start_height, end_height,
+                                                                                        last_block_scanned))
+        self.__cursor.execute("ATTACH DATABASE ? AS shard", [path])
+        try:
+            self.__cursor.execute("INSERT OR IGNORE INTO txs (txid, type, block_height) "
+                                  "SELECT txid, type, block_height FROM shard.txs ORDER BY id")
+            self.__cursor.execute("INSERT OR IGNORE INTO k_images (k_image, tx_id) "
+                                  "SELECT shard_k_images.k_image, txs.id FROM shard.k_images AS shard_k_images "
+                                  "JOIN shard.txs AS shard_txs ON shard_txs.id = shard_k_images.tx_id "
+                                  "JOIN main.txs AS txs ON txs.txid = shard_txs.txid")
+            self.__cursor.execute("INSERT OR REPLACE INTO blocks (height, hash) SELECT height, hash FROM shard.blocks")
+            if self.__bloom is not None:
+                cursor = self.__db_conn.cursor()
+                cursor.execute("SELECT k_image FROM shard.k_images")
+                for row in cursor:
+                    self.__bloom.add(row[0])
+            self.__setState('last_block_scanned', end_height)
+            with COMMIT_SECONDS.time(db='indexer'):
+                self.__db_conn.commit()
+        except:
+            self.__db_conn.rollback()
+            raise
+        finally:
+            self.__cursor.execute("DETACH DATABASE shard")
+        self.__syncBloomFilter(end_height)
+
+    # @return - dict of height -> hash (hex string) for stored blocks in [start_height, end_height].
+    def getBlockHashes(self, start_height=0, end_height=0):
+        self.__cursor.execute("SELECT height, hash FROM blocks WHERE height BETWEEN ? AND ?", [start_height, end_height])
+        return {height: hash.hex() for height, hash in self.__cursor.fetchall()}
+
+    # Removing everything above given height in one transaction, used when blocks above it were orphaned.
+    def rollbackToHeight(self, height=0):
+        try:
+            self.__cursor.execute("DELETE FROM k_images WHERE tx_id IN (SELECT id FROM txs WHERE block_height > ?)",
+                                  [height])
+            self.__cursor.execute("DELETE FROM txs WHERE block_height > ?", [height])
+            self.__cursor.execute("DELETE FROM blocks WHERE height > ?", [height])
+            self.__setState('last_block_scanned', height)
+            self.__db_conn.commit()
+        except:
+            self.__db_conn.rollback()
+            raise
+        # Bits of orphaned key images can't be cleared, they only cause false positives answered by DB.
+        self.__syncBloomFilter(height)
+
     def findTxByKImage(self, k_image=""):
-        self.__cursor.execute("SELECT txid FROM txid_k_images WHERE k_images like '%"+str(k_image)+"%'")
+        if self.__bloom is not None and not self.__bloom.mightContain(bytes.fromhex(k_image)):
+            return 0
+        self.__cursor.execute("SELECT txs.txid FROM k_images JOIN txs ON txs.id = k_images.tx_id "
+                              "WHERE k_images.k_image=?", [bytes.fromhex(k_image)])
         res = self.__cursor.fetchone()
         if res == None:
             return 0
         else:
-            return res[0]
+            return res[0].hex()
+
+    # Looking up many key images with single indexed join against temp table instead of one query per key image.
+    # @k_images - iterable of key images as hex strings.
+    # @return - dict of k_image -> txid, txid is None for key images which are not found.
+    def findTxsByKImages(self, k_images=[]):
+        result = {}
+        for k_image in k_images:
+            try:
+                result[k_image] = None
+                bytes.fromhex(k_image)
+            except ValueError:
+                raise ValueError('Invalid key image ' + str(k_image) + '!')
+        try:
+            self.__cursor.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_k_images (k_image BLOB PRIMARY KEY) "
+                                  "WITHOUT ROWID")
+            candidates = [bytes.fromhex(k_image) for k_image in result]
+            if self.__bloom is not None:
+                candidates = [k_image for k_image in candidates if self.__bloom.mightContain(k_image)]
+            self.__cursor.executemany("INSERT OR IGNORE INTO lookup_k_images (k_image) VALUES(?)",
+                                      [(k_image,) for k_image in candidates])
+            self.__cursor.execute("SELECT lookup_k_images.k_image, txs.txid FROM lookup_k_images "
+                                  "JOIN k_images ON k_images.k_image = lookup_k_images.k_image "
+                                  "JOIN txs ON txs.id = k_images.tx_id")
+            found = {k_image.hex(): txid.hex() for k_image, txid in self.__cursor.fetchall()}
+        finally:
+            self.__db_conn.rollback()
+        for k_image in result:
+            result[k_image] = found.get(k_image.lower())
+        return result
+
+    def __setState(self, key='', value=''):
+        if key == '' or value == '':
+            raise ValueError('Empty key or value! NOT PERMITTED!')
+
+        self.__cursor.execute("UPDATE state set value = ? where key = ?", [str(value), key])
+        if self.__cursor.rowcount == 0:
+            self.__cursor.execute("INSERT INTO state (key, value) VALUES(?,?)", [key, str(value)])
+
+    # Tx already stored (e.g. batch repeated after crash) is reused instead of duplicated.
+    # @txid - 32 bytes
+    # @type - tx_decoder type code
+    # @k_images - list of 32 byte key images.
+    def __insertTx(self, txid, type, k_images, block_height):
+        self.__cursor.execute("INSERT OR IGNORE INTO txs (txid, type, block_height) VALUES(?,?,?)",
+                              [txid, type, block_height])
+        if self.__cursor.rowcount == 1:
+            tx_id = self.__cursor.lastrowid
+        else:
+            self.__cursor.execute("SELECT id FROM txs WHERE txid=?", [txid])
+            tx_id = self.__cursor.fetchone()[0]
+        self.__cursor.executemany("INSERT OR IGNORE INTO k_images (k_image, tx_id) VALUES(?,?)",
+                                  [(k_image, tx_id) for k_image in k_images])
+        # Key images are added before commit, so filter never misses committed key image.
+        if self.__bloom is not None:
+            self.__bloom.addMany(k_images)
+
+    # Filter which is not in sync with last_block_scanned and its block hash (e.g. process was killed between DB commit
+    # and filter update, or DB was rolled back and resynced to same height by run without filter), is over its capacity
+    # or was written in older format is rebuilt from the index.
+    def __openBloomFilter(self):
+        path = self.__db_path + '.bloom'
+        last_block_scanned = int(self.getLastScannedBlockHeight())
+        if bloom_filter.BloomFilter.exists(path):
+            try:
+                self.__bloom = bloom_filter.BloomFilter(path)
+            except ValueError:
+                self.__bloom = None
+            if self.__bloom is not None:
+                if self.__bloom.synced_height == last_block_scanned and not self.__bloom.isFull() and \
+                        self.__bloom.synced_hash == self.__getBlockHash(last_block_scanned):
+                    return
+                self.__bloom.close()
+        self.__rebuildBloomFilter(path, last_block_scanned)
+
+    # Filter is built into temporary file in one streaming pass over k_images and then moved over old one.
+    def __rebuildBloomFilter(self, path, last_block_scanned):
+        print("Building key image bloom filter", file=sys.stderr)
+        self.__cursor.execute("SELECT count(*) FROM k_images")
+        capacity = max(bloom_filter.DEFAULT_CAPACITY, 2 * self.__cursor.fetchone()[0])
+        bloom = bloom_filter.BloomFilter.create(path + '.tmp', capacity=capacity)
+        cursor = self.__db_conn.cursor()
+        cursor.execute("SELECT k_image FROM k_images")
+        for row in cursor:
+            bloom.add(row[0])
+        bloom.flush()
+        bloom.setSyncedHeight(last_block_scanned, self.__getBlockHash(last_block_scanned))
+        bloom.close()
+        os.replace(path + '.tmp', path)
+        self.__bloom = bloom_filter.BloomFilter(path)
+
+    # Bits are flushed before synced height is written, so stored height never claims bits which are not on disk.
+    # Full filter is replaced by rebuilt one but not closed, query server threads may still hold it, its map is released
+    # when last reference is dropped.
+    def __syncBloomFilter(self, last_block_scanned):
+        if self.__bloom is None:
+            return
+        if self.__bloom.isFull():
+            self.__rebuildBloomFilter(self.__bloom.path, last_block_scanned)
+            return
+        self.__bloom.flush()
+        self.__bloom.setSyncedHeight(last_block_scanned, self.__getBlockHash(last_block_scanned))
+
+    # @return - 32 bytes hash of stored block at given height, zeros if it is not stored (DB written before block
+    # hashes were kept).
+    def __getBlockHash(self, height):
+        self.__cursor.execute("SELECT hash FROM blocks WHERE height=?", [height])
+        res = self.__cursor.fetchone()
+        return res[0] if res is not None else bytes(32)
+
+# Paging get_block_headers_range over [start_height, end_height] in background thread, so headers are always available
+# ahead of block fetching. Window is doubled while responses are fast and small and halved when they are slow or big.
+class HeaderPager:
+    MIN_WINDOW = 100
+    MAX_WINDOW = 20000
+    TARGET_LATENCY = 1.0 # seconds
+    TARGET_SIZE = 4 * 1024 * 1024 # bytes
+    PAGES_AHEAD = 4 # pages fetched ahead of consumer
+
+    # @fetch - callable(start_height, end_height) returning headers and size of response in bytes.
+    def __init__(self, fetch, start_height=0, end_height=0, window=1000):
+        self.window = window
+        self.__fetch = fetch
+        self.__start_height = start_height
+        self.__end_height = end_height
+        self.__queue = Queue(maxsize=HeaderPager.PAGES_AHEAD)
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    # Generator yielding (start_height, end_height, headers) pages in height order.
+    def pages(self):
+        while True:
+            page = self.__queue.get()
+            QUEUE_DEPTH.set(self.__queue.qsize(), queue='headers')
+            if page is None:
+                return
+            if isinstance(page, Exception):
+                raise page
+            yield page
+
+    def close(self):
+        self.__stopped.set()
+
+    def __run(self):
+        height = self.__start_height
+        try:
+            while height <= self.__end_height and not self.__stopped.is_set():
+                end_height = min(height + self.window - 1, self.__end_height)
+                started = time.time()
+                headers, size = self.__fetch(height, end_height)
+                self.__adaptWindow(time.time() - started, size)
+                self.__put((height, end_height, headers))
+                height = end_height + 1
+            self.__put(None)
+        except Exception as e:
+            self.__put(e)
+
+    def __adaptWindow(self, latency, size):
+        if latency > HeaderPager.TARGET_LATENCY or size > HeaderPager.TARGET_SIZE:
+            self.window = max(HeaderPager.MIN_WINDOW, self.window // 2)
+        elif latency < HeaderPager.TARGET_LATENCY / 2 and size < HeaderPager.TARGET_SIZE / 2:
+            self.window = min(HeaderPager.MAX_WINDOW, self.window * 2)
+
+    # Put which gives up when pager is closed, so thread doesnt hang on full queue after consumer is gone.
+    def __put(self, item):
+        while not self.__stopped.is_set():
+            try:
+                self.__queue.put(item, timeout=0.5)
+                QUEUE_DEPTH.set(self.__queue.qsize(), queue='headers')
+                return
+            except Full:
+                continue
 
 class BlockchainInfo:
     def __init__(self):
         self.url = config['daemon-url'] +"/"
+        # Pool is sized for sync workers plus HeaderPager thread.
+        self.__rpc = RPCClient(self.url, pool_size=config['threads'] + 1)
         self.__info = self.__getBlockchainInfo()
         self.__data_store = DB()
+        self.__decoder = None
+        if config['decode-workers'] > 0:
+            self.__decoder = tx_decoder.TxDecoder(workers=config['decode-workers'])
 
 ####### PUBLIC API #########
 
     def getBlockchainHeight(self):
         return self.__info["height"]
 
-    def getDataFromBlockchain(self):
-        last_block_scanned = int(self.__data_store.getLastScannedBlockHeight()) + 1
-        curr_height = int(self.getBlockchainHeight())-1
-
-        if last_block_scanned >= curr_height:
+    def updateBlockchainInfo(self):
+        self.__info = self.__getBlockchainInfo()
+        self.__updateLagMetrics()
+
+    # Long running mode keeping DB at blockchain tip. Daemon is polled every poll_interval seconds, orphaned blocks are
+    # rolled back before new ones are applied.
+    # @on_rollback - optional callable(fork_height) called after orphaned blocks are removed.
+    def followBlockchain(self, poll_interval=1.0, on_rollback=None):
+        while True:
+            try:
+                self.updateBlockchainInfo()
+                fork_height = self.rollbackOrphanedBlocks()
+                if fork_height is not None and on_rollback is not None:
+                    on_rollback(fork_height)
+                self.getDataFromBlockchain()
+            except Exception as e:
+                print("Error while following blockchain: {}".format(e), file=sys.stderr)
+            time.sleep(poll_interval)
+
+    # Comparing stored block hashes with daemon, going back REORG_WINDOW blocks at time while whole window is orphaned.
+    # Fork point is just below lowest mismatching height. Heights synced before block hashes were stored can't be
+    # checked and are considered valid.
+    # @return - fork height, or None if there was no reorg.
+    def rollbackOrphanedBlocks(self):
+        last_block_scanned = int(self.__data_store.getLastScannedBlockHeight())
+        curr_height = int(self.getBlockchainHeight()) - 1
+        end_height = last_block_scanned
+        fork_height = last_block_scanned
+        while end_height > 0:
+            start_height = max(0, end_height - REORG_WINDOW + 1)
+            stored = self.__data_store.getBlockHashes(start_height, end_height)
+            if not stored:
+                break
+            daemon = {}
+            if start_height <= curr_height:
+                headers, _ = self.__getBlockHeaders(start_height, min(end_height, curr_height))
+                daemon = {header["height"]: header["hash"] for header in headers}
+            mismatching = [height for height in stored if daemon.get(height) != stored[height]]
+            if not mismatching:
+                break
+            fork_height = min(mismatching) - 1
+            if fork_height >= start_height:
+                break
+            end_height = start_height - 1
+
+        if fork_height == last_block_scanned:
+            return None
+        print("Reorg detected, rolling back blocks {} - {}".format(fork_height + 1, last_block_scanned),
+              file=sys.stderr)
+        self.__data_store.rollbackToHeight(fork_height)
+        return fork_height
+
+    # @start_height - first height synced into empty DB, used by backfill shards.
+    # @end_height - last height to sync, blockchain tip if None.
+    def getDataFromBlockchain(self, start_height=0, end_height=None):
+        last_block_scanned = max(int(self.__data_store.getLastScannedBlockHeight()) + 1, start_height)
+        curr_height = int(self.getBlockchainHeight())-1 if end_height is None else end_height
+
+        if last_block_scanned > curr_height:
             return
 
-        # As miner txs don't have k_image field there is no need to include them in search
-        # @todo Check which interval boundrary is included.
-        print("Getting block heights")
-        block_heights = self.__getBlockHeightsWithTxs(last_block_scanned, curr_height)
-        print("Block heights acquired. Total {} blocks to load".format(len(block_heights)))
-        print("Loading blocks and getting txids")
-        txids = self.__getTxIds(block_heights)
-        n = len(txids)
-        if n == 0:
-            self.__data_store.updateState(key='last_block_scanned', value=curr_height)
+        # Range is synced chunk by chunk, every chunk goes through headers, blocks, tx batches and DB commit.
+        # last_block_scanned is advanced after every chunk, so interrupted sync loses at most one chunk of work.
+        # Header pages are fetched ahead in pager thread, independently of chunk boundaries.
+        print("Syncing blocks from {} to {}".format(last_block_scanned, curr_height), file=sys.stderr)
+        n = 0
+        chunk_start = last_block_scanned
+        block_heights = []
+        block_hashes = []
+        pager = HeaderPager(self.__getBlockHeaders, last_block_scanned, curr_height, window=config['chunk-size'])
+        try:
+            with ThreadPoolExecutor(max_workers=config['threads']) as executor:
+                for start_height, end_height, headers in pager.pages():
+                    for header in headers:
+                        # As miner txs don't have k_image field there is no need to include them in search
+                        height = header["height"]
+                        block_hashes.append((height, header["hash"]))
+                        if header["num_txes"] != 0:
+                            block_heights.append(height)
+                        if height - chunk_start + 1 < config['chunk-size'] and height != curr_height:
+                            continue
+                        n = n + self.__syncChunk(executor, block_heights, block_hashes, height)
+                        chunk_start = height + 1
+                        block_heights = []
+                        block_hashes = []
+                        sys.stderr.write("Synced %d of %d blocks, processed %d txs\r" % (height, curr_height, n))
+                        sys.stderr.flush()
+        finally:
+            pager.close()
+        print("Synced {} of {} blocks, processed {} txs".format(curr_height, curr_height, n), file=sys.stderr)
+
+    # Historical sync split into height ranges synced by separate processes, each into its own shard DB file
+    # (<db-path>.shard-<start>-<end>) with its own daemon connections. Finished shards are merged into DB in height
+    # order and removed. Shard DB keeps its own last_block_scanned, so interrupted backfill resumes every shard where
+    # it stopped. Shard files left from previous run are resumed instead of planning new ranges.
+    def backfill(self, shards=2):
+        start_height = int(self.__data_store.getLastScannedBlockHeight()) + 1
+        end_height = int(self.getBlockchainHeight()) - 1
+        ranges = self.__planShards(shards, start_height, end_height)
+        if not ranges:
             return
-        i = 0
-        step = 500
-        next = step
-        print('Acquiring tx data, total txs to load: {}'.format(n))
-        while i < n:
-            tx_buffer =[]
-            block_height = 0
-            fragment = self.__getTxData(txids[i:next])
-            for tx in fragment['txs']:
-                if int(tx['block_height']) > block_height:
-                    block_height = int(tx['block_height'])
-                tx_buffer.append(self.__processTx(tx))
-            i = next + 1
-            next = next + step
-            if next > n:
-                next = n
-
-            self.__saveCurrentState(block_height=block_height, data=tx_buffer)
-            if n < step:
-                print("Processed {} of {} txs".format(n, n))
-            else:
-                sys.stdout.write("Processed %d of %d txs\r" % (i-1, n))
-                sys.stdout.flush()
+
+        print("Backfilling blocks from {} to {} in {} shards".format(ranges[0][0], ranges[-1][1], len(ranges)),
+              file=sys.stderr)
+        context = multiprocessing.get_context('spawn')
+        shard_config = dict(config, **{"decode-workers": 0, "bloom": False})
+        processes = []
+        for start, end in ranges:
+            process = context.Process(target=syncShard, args=(shard_config, self.__shardPath(start, end), start, end))
+            process.start()
+            processes.append(process)
+
+        total = ranges[-1][1] - ranges[0][0] + 1
+        while any(process.is_alive() for process in processes):
+            done = sum(readShardProgress(self.__shardPath(start, end)) - start + 1 for start, end in ranges)
+            sys.stderr.write("Backfilled %d of %d blocks\r" % (max(done, 0), total))
+            sys.stderr.flush()
+            multiprocessing.connection.wait([process.sentinel for process in processes if process.is_alive()],
+                                            timeout=BACKFILL_PROGRESS_INTERVAL)
+
+        # Shards are merged while they are complete, the rest is kept for next run.
+        for (start, end), process in zip(ranges, processes):
+            path = self.__shardPath(start, end)
+            if process.exitcode != 0 or readShardProgress(path) != end:
+                raise RuntimeError("Backfill of blocks {} - {} failed, run again to resume".format(start, end))
+            print("Merging blocks {} - {}".format(start, end), file=sys.stderr)
+            self.__data_store.mergeShard(path, start, end)
+            removeShard(path)
+        print("Backfilled blocks {} - {}".format(ranges[0][0], ranges[-1][1]), file=sys.stderr)
 
     def getBlock(self, height=0):
         return self.__sendJSONRPCRequest(method="get_block", params={"height": height})
@@ -150,74 +541,147 @@ class BlockchainInfo:
             print("There is no tx with given key image up to {} block".format(self.__data_store.getLastScannedBlockHeight()))
         else:
             print("Transaction id containing key image is: txid = {}".format(txid))
+        return txid
+
+    # @return - dict of k_image -> txid, txid is None for key images which are not found.
+    def getTxsByKimages(self, k_images=[]):
+        return self.__data_store.findTxsByKImages(k_images=k_images)
+
+    def getBloomFilter(self):
+        return self.__data_store.getBloomFilter()
+
+    # Stopping decoder processes and closing daemon connections, instance can't sync anymore.
+    def close(self):
+        if self.__decoder is not None:
+            self.__decoder.close()
+            self.__decoder = None
+        self.__rpc.close()
 ####### END PUBLIC API #########
 
 ####### PRIVATE STUFF #########
 
-    def __saveCurrentState(self, block_height=0, data=[]):
-        self.__data_store.updateTx2KImageMany(data)
-        self.__data_store.updateState(key='last_block_scanned',value=block_height)
+    def __shardPath(self, start_height, end_height):
+        return "{}.shard-{}-{}".format(config['db-path'], start_height, end_height)
+
+    # Ranges of shard files left from previous run are reused while they continue DB one after another from
+    # start_height. Shards which don't (already merged, or overlapping blocks DB synced meanwhile, e.g. sequentially)
+    # could never be merged, so they are dropped. Without reusable shards [start_height, end_height] is split into
+    # equal ranges.
+    # @return - list of (start_height, end_height) in height order.
+    def __planShards(self, shards, start_height, end_height):
+        found = []
+        for path in glob.glob(glob.escape(config['db-path']) + '.shard-*-*'):
+            if path.endswith(('-wal', '-shm')):
+                continue
+            found.append(tuple(int(height) for height in path.rsplit('.shard-', 1)[1].split('-')))
+        ranges = []
+        for start, end in sorted(found):
+            if start == (ranges[-1][1] + 1 if ranges else start_height):
+                ranges.append((start, end))
+                continue
+            if end >= start_height:
+                print("Dropping shard {} - {} which does not continue DB synced up to {}".format(
+                    start, end, start_height - 1), file=sys.stderr)
+            removeShard(self.__shardPath(start, end))
+        if ranges:
+            return ranges
+
+        size = (end_height - start_height + 1 + shards - 1) // shards
+        if size <= 0:
+            return []
+        return [(start, min(start + size - 1, end_height)) for start in range(start_height, end_height + 1, size)]
+
+    # Blocks and tx batches of chunk are fetched concurrently on the same pool. Both stages yield results in height
+    # order, so at most 2*threads responses are held in memory at once.
+    # @return - number of txs processed.
+    def __syncChunk(self, executor, block_heights, block_hashes, end_height):
+        batches = self.__fetchOrdered(executor, self.__getBlocks, self.__batchHeights(block_heights), 'blocks')
+        blocks = (block for batch in batches for block in batch)
+        fragments = self.__fetchOrdered(executor, self.__getTxData, self.__batchTxIds(blocks), 'txs')
+        tx_buffer = []
+        for fragment in fragments:
+            tx_buffer.extend(self.__processTxs(fragment['txs']))
+        with STAGE_SECONDS.time(stage='save'):
+            self.__saveCurrentState(block_height=end_height, data=tx_buffer, block_hashes=block_hashes)
+        BLOCKS_SYNCED.inc(len(block_hashes))
+        TXS_PROCESSED.inc(len(tx_buffer))
+        self.__updateLagMetrics()
+        return len(tx_buffer)
+
+    def __updateLagMetrics(self):
+        last_block_scanned = int(self.__data_store.getLastScannedBlockHeight())
+        LAST_BLOCK_SCANNED.set(last_block_scanned)
+        DAEMON_HEIGHT.set(self.getBlockchainHeight())
+        SYNC_LAG.set(max(0, int(self.getBlockchainHeight()) - 1 - last_block_scanned))
+
+    def __saveCurrentState(self, block_height=0, data=[], block_hashes=[]):
+        self.__data_store.saveChunk(data=data, block_hashes=block_hashes, last_block_scanned=block_height)
+
+    # Big batches are spread over decoder processes, small ones are decoded in-process. Decoding is timed per batch,
+    # timer around every __processTx call would cost noticeable part of decoding itself.
+    def __processTxs(self, txs=[]):
+        with STAGE_SECONDS.time(stage='decode'):
+            if self.__decoder is None or len(txs) < MIN_PARALLEL_DECODE:
+                return [self.__processTx(tx) for tx in txs]
+            return self.__decoder.decode(txs)
 
     def __processTx(self, tx=None):
-        txid = tx['tx_hash']
-        type = 'plain'
-        k_images = []
-        as_json = ujson.loads(tx['as_json'])
-        for vin in as_json['vin']:
-            if 'migration' in vin.keys():
-                type = 'migration'
-                k_images.append(vin['migration']['k_image'])
-            if 'key' in vin.keys():
-                k_images.append(vin['key']['k_image'])
-
-        return (txid, type,str(k_images))
-
-    #todo Introduce error checking and raise BlockchainError
+        return tx_decoder.decodeTx(tx)
+
     def __getBlockchainInfo(self):
-        res = requests.get(self.url+"getinfo")
-        return ujson.loads(res.text)
+        return self.__rpc.sendGetRequest("getinfo")
 
     # Every JSON request sent to daemon has corresponding input.
     # @method - name of targeted method
     # @params - parameters for given method.
     # @return - result field of response.
-    # todo Introduce error checking and raise BlockchainError
     def __sendJSONRPCRequest(self, method="", params=None):
-        data = {
-            "jsonrpc": "2.0",
-            "id": "0",
-            "method": method,
-            "params": params
-        }
-
-        res = requests.post(self.url+"json_rpc", data=ujson.dumps(data))
-        return ujson.loads(res.text)["result"]
+        return self.__rpc.sendJSONRPCRequest(method=method, params=params)
 
     def __sendPlainRequest(self, method="", body=None):
-        res = requests.post(self.url+method, data=ujson.dumps(body))
-        return ujson.loads(res.text)
-
-    def __getBlockHeightsWithTxs(self, start_height=0, end_height=0):
-        res = self.__sendJSONRPCRequest(method="get_block_headers_range", params={"start_height": start_height,
-                                                                               "end_height": end_height})
-        block_heights = []
-        for header in res["headers"]:
-            if header["num_txes"] != 0:
-                block_heights.append(header["height"])
-        return block_heights
-
-    def __getTxIds(self, block_heights=[]):
+        return self.__rpc.sendPlainRequest(method=method, body=body)
+
+    # Size of response is returned along with headers, so HeaderPager can adapt its window.
+    # @return - list of headers and size of response in bytes.
+    def __getBlockHeaders(self, start_height=0, end_height=0):
+        res, size = self.__rpc.sendJSONRPCRequestWithSize(method="get_block_headers_range",
+                                                          params={"start_height": start_height,
+                                                                  "end_height": end_height})
+        return res["headers"], size
+
+    # Getting many blocks in one JSON-RPC batch request.
+    def __getBlocks(self, heights=[]):
+        return self.__rpc.sendJSONRPCBatch([("get_block", {"height": height}) for height in heights])
+
+    # Generator submitting fn(item) for every item to executor and yielding results in order of items.
+    # At most 2*threads calls are in flight, so items can be lazy generator as well.
+    # @queue - name of queue_depth metric following number of calls in flight.
+    def __fetchOrdered(self, executor, fn, items, queue=''):
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            QUEUE_DEPTH.set(len(pending), queue=queue)
+            if len(pending) >= 2 * config['threads']:
+                yield pending.popleft().result()
+        while pending:
+            QUEUE_DEPTH.set(len(pending), queue=queue)
+            yield pending.popleft().result()
+        QUEUE_DEPTH.set(0, queue=queue)
+
+    def __batchHeights(self, block_heights):
+        for i in range(0, len(block_heights), BLOCK_BATCH_SIZE):
+            yield block_heights[i:i + BLOCK_BATCH_SIZE]
+
+    # Generator grouping txids of given blocks into batches of TX_BATCH_SIZE.
+    def __batchTxIds(self, blocks):
         txids = []
-        i = 0
-        for height in block_heights:
-            if i % 1000 == 0:
-                sys.stdout.write("Blocks loaded %d of %d \r" % (i, len(block_heights)))
-                sys.stdout.flush()
-            i = i+1
-            res = self.getBlock(height=height)
-            for txid in res["tx_hashes"]:
-                txids.append(txid)
-        return txids
+        for block in blocks:
+            txids.extend(block["tx_hashes"])
+            while len(txids) >= TX_BATCH_SIZE:
+                yield txids[:TX_BATCH_SIZE]
+                txids = txids[TX_BATCH_SIZE:]
+        if txids:
+            yield txids
 
     def __getTxData(self, txs_hashes=[]):
         return self.__sendPlainRequest(method="get_transactions",body={"txs_hashes":txs_hashes,
@@ -232,25 +696,161 @@ def handleCLIArguments():
                         required=False, type=str, default="./main.db")
     parser.add_argument('--daemon-rpc-url', help="Url of the Safex daemon RPC",
                         required=False, type=str, default="http://localhost:17402")
-    parser.add_argument('--key-image', help="Targeted key image", required=True)
+    parser.add_argument('--threads', help="Number of concurrent requests sent to daemon while syncing",
+                        required=False, type=int, default=8)
+    parser.add_argument('--chunk-size', help="Number of blocks synced and committed to DB at once",
+                        required=False, type=int, default=1000)
+    parser.add_argument('--decode-workers', help="Number of processes decoding tx JSON, 0 decodes in main process",
+                        required=False, type=int, default=0)
+    parser.add_argument('--backfill-shards', help="Split historical sync into given number of height ranges synced by "
+                                                  "separate processes into shard DBs and merged afterwards, "
+                                                  "--threads applies to every shard",
+                        required=False, type=int, default=0)
+    parser.add_argument('--sqlite-synchronous', help="SQLite synchronous pragma used for DB writes",
+                        required=False, type=str, default="NORMAL", choices=["OFF", "NORMAL", "FULL"])
+    parser.add_argument('--sqlite-cache-size', help="SQLite page cache size in MiB",
+                        required=False, type=int, default=64)
+    parser.add_argument('--key-image', help="Targeted key image", required=False)
+    parser.add_argument('--key-images-file', help="File with one key image per line, - for stdin",
+                        required=False, type=str)
+    parser.add_argument('--output', help="Output file for --key-images-file lookup, - for stdout",
+                        required=False, type=str, default="-")
+    parser.add_argument('--output-format', help="Format of --key-images-file lookup output",
+                        required=False, type=str, default="csv", choices=["csv", "jsonl"])
+    parser.add_argument('--http-bind', help="Serve key image queries over HTTP on given host:port, "
+                                            "e.g. 127.0.0.1:17480",
+                        required=False, type=str)
+    parser.add_argument('--http-cache-size', help="Number of found key images kept in HTTP server cache",
+                        required=False, type=int, default=100000)
+    parser.add_argument('--bloom', help="Keep bloom filter of key images next to DB, so misses skip SQLite",
+                        action='store_true')
+    parser.add_argument('--metrics-bind', help="Serve Prometheus metrics on http://<host:port>/metrics",
+                        required=False, type=str)
+    parser.add_argument('--profile', help="Profile run with cProfile, write profile to given file and stage timing "
+                                          "report to <file>.stages.txt",
+                        required=False, type=str)
+    parser.add_argument('--follow', help="Keep running and follow blockchain tip, rolling back reorganized blocks",
+                        action='store_true')
+    parser.add_argument('--poll-interval', help="Seconds between two checks of daemon tip in follow mode",
+                        required=False, type=float, default=1.0)
 
     args = vars(parser.parse_args())
+    if args['key_image'] is None and args['key_images_file'] is None and not args['follow'] \
+            and args['http_bind'] is None:
+        parser.error('one of --key-image, --key-images-file, --http-bind or --follow is required')
 
     config['daemon-url'] = args['daemon_rpc_url']
     config['db-path'] = args['db_path']
-
-    return args['key_image']
+    config['threads'] = args['threads']
+    config['chunk-size'] = args['chunk_size']
+    config['decode-workers'] = args['decode_workers']
+    config['sqlite-synchronous'] = args['sqlite_synchronous']
+    config['sqlite-cache-size'] = args['sqlite_cache_size']
+    config['bloom'] = args['bloom']
+
+    return args
+
+
+# Entry point of backfill shard process. Shard is synced as standalone DB, progress goes only to its state table.
+# @shard_config - config of parent process, db-path is replaced with shard path.
+def syncShard(shard_config={}, db_path='', start_height=0, end_height=0):
+    config.update(shard_config)
+    config['db-path'] = db_path
+    sys.stdout = open(os.devnull, 'w')
+    bc = BlockchainInfo()
+    try:
+        bc.getDataFromBlockchain(start_height=start_height, end_height=end_height)
+    finally:
+        bc.close()
+
+
+# @return - last_block_scanned of shard DB, start of shard range minus one if it was not synced yet.
+def readShardProgress(path=''):
+    start_height = int(path.rsplit('.shard-', 1)[1].split('-')[0])
+    if not os.path.exists(path):
+        return start_height - 1
+    try:
+        conn = sqlite3.connect('file:' + path + '?mode=ro', uri=True)
+        try:
+            res = conn.execute("SELECT value FROM state WHERE key='last_block_scanned'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return start_height - 1
+    return max(int(res[0]), start_height - 1) if res is not None else start_height - 1
+
+
+def removeShard(path=''):
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def readKeyImages(path='-'):
+    file = sys.stdin if path == '-' else open(path)
+    try:
+        return [line.strip() for line in file if line.strip() != '']
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+# Writing k_image -> txid mapping as CSV (k_image,txid with empty txid if not found) or JSONL.
+def writeKeyImagesLookup(result={}, path='-', format='csv'):
+    file = sys.stdout if path == '-' else open(path, 'w', newline='')
+    try:
+        if format == 'csv':
+            writer = csv.writer(file)
+            writer.writerow(['k_image', 'txid'])
+            for k_image, txid in result.items():
+                writer.writerow([k_image, txid or ''])
+        else:
+            for k_image, txid in result.items():
+                file.write(ujson.dumps({"k_image": k_image, "txid": txid}) + "\n")
+    finally:
+        if file is not sys.stdout:
+            file.close()
 
 
 def main():
-    k_image = handleCLIArguments()
+    args = handleCLIArguments()
+    if args['profile'] is not None:
+        metrics.startProfiling(args['profile'])
+    if args['metrics_bind'] is not None:
+        metrics.startMetricsServer(args['metrics_bind'])
 
     bc = BlockchainInfo()
-    bc.getDataFromBlockchain()
-    print("Local DB is up to date with {} block!".format(bc.getUpdatedBlockHeight()))
-    print("   ")
-    print("----------------------------------------------------------")
-    bc.getTxByKimage(k_image)
-    print("----------------------------------------------------------")
-
-main()
\ No newline at end of file
+    try:
+        bc.rollbackOrphanedBlocks()
+        if args['backfill_shards'] > 1:
+            bc.backfill(shards=args['backfill_shards'])
+        bc.getDataFromBlockchain()
+        print("Local DB is up to date with {} block!".format(bc.getUpdatedBlockHeight()), file=sys.stderr)
+        if args['key_image'] is not None:
+            print("   ")
+            print("----------------------------------------------------------")
+            bc.getTxByKimage(args['key_image'])
+            print("----------------------------------------------------------")
+        if args['key_images_file'] is not None:
+            result = bc.getTxsByKimages(readKeyImages(args['key_images_file']))
+            writeKeyImagesLookup(result, path=args['output'], format=args['output_format'])
+            print("Found {} of {} key images".format(sum(1 for txid in result.values() if txid is not None),
+                                                     len(result)), file=sys.stderr)
+
+        server = None
+        if args['http_bind'] is not None:
+            server, thread = query_server.startQueryServer(bind=args['http_bind'], db_path=config['db-path'],
+                                                           pool_size=config['threads'],
+                                                           cache_size=args['http_cache_size'],
+                                                           get_bloom=bc.getBloomFilter)
+        if args['follow']:
+            print("Following blockchain tip", file=sys.stderr)
+            bc.followBlockchain(poll_interval=args['poll_interval'],
+                                on_rollback=(lambda fork_height: server.invalidate()) if server is not None else None)
+        elif server is not None:
+            bc.close()
+            thread.join()
+    finally:
+        bc.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/python3.6
+
+import ast
+import os.path
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import schema_migration
+from common.schema_migration import setSchemaVersion
+
+'''
+Schema handling for key image DB.
+
+Version 1 (legacy) - txid_k_images (id, txid, type, k_images) where k_images is str() of python list.
+Version 2 - txs (id, txid, type) and k_images (k_image, tx_id), one row per key image with 32 byte BLOB
+            primary key, so lookup is index seek instead of full table scan.
+Version 3 - txs.block_height and blocks (height, hash) table, needed for detecting and rolling back reorgs.
+Version 4 - txs.txid stored as 32 byte BLOB and txs.type as integer code (0 - plain, 1 - migration).
+'''
+
+SCHEMA_VERSION = 4
+
+# Number of legacy rows converted between two progress printouts.
+MIGRATION_BATCH_SIZE = 10000
+
+
+# Creating tables of current schema version.
+def createSchema(cursor):
+    cursor.execute("CREATE TABLE txs (id INTEGER PRIMARY KEY, txid BLOB UNIQUE, type integer, block_height integer)")
+    cursor.execute("CREATE INDEX txs_block_height ON txs (block_height)")
+    cursor.execute("CREATE TABLE k_images (k_image BLOB PRIMARY KEY, tx_id integer NOT NULL) WITHOUT ROWID")
+    cursor.execute("CREATE TABLE blocks (height INTEGER PRIMARY KEY, hash BLOB)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS state (id integer, key text, value text)")
+
+
+# Version 1 DBs have state table, but no schema_version in it.
+def legacyVersion(cursor):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='txid_k_images'")
+    return 1 if cursor.fetchone() is not None else 0
+
+
+# Converting legacy txid_k_images rows in streaming pass. Rows are read with cursor iteration so whole table is never
+# loaded in memory. Runner executes step in one transaction, so interrupted migration leaves DB untouched.
+def migrateV1ToV2(conn):
+    read_cursor = conn.cursor()
+    write_cursor = conn.cursor()
+    write_cursor.execute("CREATE TABLE txs (id INTEGER PRIMARY KEY, txid text UNIQUE, type text)")
+    write_cursor.execute("CREATE TABLE k_images (k_image BLOB PRIMARY KEY, tx_id integer NOT NULL) WITHOUT ROWID")
+
+    converted = 0
+    read_cursor.execute("SELECT txid, type, k_images FROM txid_k_images ORDER BY rowid")
+    for txid, type, k_images in read_cursor:
+        write_cursor.execute("INSERT OR IGNORE INTO txs (txid, type) VALUES(?,?)", [txid, type])
+        write_cursor.execute("SELECT id FROM txs WHERE txid=?", [txid])
+        tx_id = write_cursor.fetchone()[0]
+        write_cursor.executemany("INSERT OR IGNORE INTO k_images (k_image, tx_id) VALUES(?,?)",
+                                 [(bytes.fromhex(k_image), tx_id) for k_image in ast.literal_eval(k_images)])
+        converted = converted + 1
+        if converted % MIGRATION_BATCH_SIZE == 0:
+            sys.stderr.write("Migrated %d txs\r" % converted)
+            sys.stderr.flush()
+
+    write_cursor.execute("DROP TABLE txid_k_images")
+    setSchemaVersion(write_cursor, 2)
+    print("Migrated {} txs".format(converted), file=sys.stderr)
+
+
+# Heights of txs stored before version 3 are unknown and left NULL. Those txs are far below any possible reorg.
+def migrateV2ToV3(conn):
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE txs ADD COLUMN block_height integer")
+    cursor.execute("CREATE INDEX txs_block_height ON txs (block_height)")
+    cursor.execute("CREATE TABLE blocks (height INTEGER PRIMARY KEY, hash BLOB)")
+    setSchemaVersion(cursor, 3)
+
+
+# Rewriting txs table with binary txids and integer types. Row ids are kept, so k_images.tx_id stays valid.
+def migrateV3ToV4(conn):
+    read_cursor = conn.cursor()
+    write_cursor = conn.cursor()
+    write_cursor.execute("CREATE TABLE txs_v4 (id INTEGER PRIMARY KEY, txid BLOB UNIQUE, type integer, "
+                         "block_height integer)")
+    type_codes = {'plain': 0, 'migration': 1}
+
+    converted = 0
+    batch = []
+    read_cursor.execute("SELECT id, txid, type, block_height FROM txs ORDER BY id")
+    for id, txid, type, block_height in read_cursor:
+        batch.append((id, bytes.fromhex(txid), type_codes[type], block_height))
+        if len(batch) == MIGRATION_BATCH_SIZE:
+            write_cursor.executemany("INSERT INTO txs_v4 (id, txid, type, block_height) VALUES(?,?,?,?)", batch)
+            converted = converted + len(batch)
+            batch = []
+            sys.stderr.write("Migrated %d txs\r" % converted)
+            sys.stderr.flush()
+    write_cursor.executemany("INSERT INTO txs_v4 (id, txid, type, block_height) VALUES(?,?,?,?)", batch)
+    converted = converted + len(batch)
+
+    write_cursor.execute("DROP TABLE txs")
+    write_cursor.execute("ALTER TABLE txs_v4 RENAME TO txs")
+    write_cursor.execute("CREATE INDEX txs_block_height ON txs (block_height)")
+    setSchemaVersion(write_cursor, 4)
+    print("Migrated {} txs".format(converted), file=sys.stderr)
+
+
+MIGRATIONS = {1: migrateV1ToV2, 2: migrateV2ToV3, 3: migrateV3ToV4}
+
+
+def migrate(conn):
+    schema_migration.migrate(conn, MIGRATIONS, SCHEMA_VERSION, name='key image', legacy_version=legacyVersion)
+
+
+if __name__ == '__main__':
+    schema_migration.main('One-shot migration of key image DB to current schema', migrate, SCHEMA_VERSION)
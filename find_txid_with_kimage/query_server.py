@@ -0,0 +1,157 @@
+import os.path
+import re
+import sqlite3
+import sys
+import threading
+import ujson
+from collections import OrderedDict
+from queue import Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import metrics
+from common.http_server import ThreadingServer, KeepAliveHandler, serveInBackground
+
+'''
+Small HTTP/JSON service answering key image queries from the indexer DB.
+
+GET  /kimage/<hex>  - {"k_image": <hex>, "txid": <txid or null>}, 404 if key image is not indexed.
+POST /kimages       - body {"k_images": [<hex>, ...]}, response {"txids": {<hex>: <txid or null>, ...}}
+
+Queries run on pool of read-only connections, so they never block sync writer (DB is in WAL mode). Found key images
+are kept in LRU cache, misses are not cached because they can become hits after next synced block. If bloom filter
+getter is given, key images which filter rules out are answered without DB query. Filter is taken from getter on every
+lookup, because sync loop replaces it with new object when it is rebuilt.
+'''
+
+# Max number of key images bound to single IN (...) query, SQLite default limit of variables is 999.
+QUERY_BATCH_SIZE = 500
+
+HEX_KEY_IMAGE = re.compile('^[0-9a-fA-F]{64}$')
+
+LOOKUP_SECONDS = metrics.histogram('query_lookup_seconds', 'Latency of key image lookups', ['source'])
+K_IMAGES_LOOKED_UP = metrics.counter('query_k_images_total', 'Key images looked up by where answer came from',
+                                     ['source'])
+
+
+class ReadOnlyPool:
+    def __init__(self, db_path='', size=4):
+        self.__connections = Queue()
+        for i in range(size):
+            self.__connections.put(sqlite3.connect('file:' + db_path + '?mode=ro', uri=True, check_same_thread=False))
+
+    # @return - dict of k_image -> txid for found key images.
+    def findTxs(self, k_images=[]):
+        conn = self.__connections.get()
+        try:
+            found = {}
+            for i in range(0, len(k_images), QUERY_BATCH_SIZE):
+                batch = k_images[i:i + QUERY_BATCH_SIZE]
+                cursor = conn.execute("SELECT k_images.k_image, txs.txid FROM k_images "
+                                      "JOIN txs ON txs.id = k_images.tx_id "
+                                      "WHERE k_images.k_image IN (" + ",".join("?" * len(batch)) + ")",
+                                      [bytes.fromhex(k_image) for k_image in batch])
+                for k_image, txid in cursor:
+                    found[k_image.hex()] = txid.hex()
+            return found
+        finally:
+            self.__connections.put(conn)
+
+
+class LRUCache:
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self.__items = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        with self.__lock:
+            value = self.__items.get(key)
+            if value is not None:
+                self.__items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.__lock:
+            self.__items[key] = value
+            self.__items.move_to_end(key)
+            while len(self.__items) > self.capacity:
+                self.__items.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__items.clear()
+
+
+class KeyImageQueryServer(ThreadingServer):
+    # @get_bloom - callable returning current BloomFilter or None.
+    def __init__(self, address, db_path='', pool_size=4, cache_size=100000, get_bloom=None):
+        self.pool = ReadOnlyPool(db_path, size=pool_size)
+        self.cache = LRUCache(cache_size)
+        self.get_bloom = get_bloom
+        super().__init__(address, KeyImageQueryHandler)
+
+    # Looking up key images in cache first and then in DB.
+    # @k_images - list of lowercase hex key images.
+    # @return - dict of k_image -> txid, txid is None for key images which are not found.
+    def lookup(self, k_images=[]):
+        result = {}
+        missing = []
+        bloom = self.get_bloom() if self.get_bloom is not None else None
+        with LOOKUP_SECONDS.time(source='memory'):
+            for k_image in k_images:
+                result[k_image] = self.cache.get(k_image)
+                if result[k_image] is None and (bloom is None or bloom.mightContain(bytes.fromhex(k_image))):
+                    missing.append(k_image)
+        cached = sum(1 for txid in result.values() if txid is not None)
+        K_IMAGES_LOOKED_UP.inc(cached, source='cache')
+        K_IMAGES_LOOKED_UP.inc(len(k_images) - cached - len(missing), source='bloom')
+        K_IMAGES_LOOKED_UP.inc(len(missing), source='db')
+        if missing:
+            with LOOKUP_SECONDS.time(source='db'):
+                found = self.pool.findTxs(missing)
+            for k_image, txid in found.items():
+                self.cache.put(k_image, txid)
+                result[k_image] = txid
+        return result
+
+    # Called by sync loop when blocks were rolled back, cached txids may belong to orphaned blocks.
+    def invalidate(self):
+        self.cache.clear()
+
+
+class KeyImageQueryHandler(KeepAliveHandler):
+    def do_GET(self):
+        if not self.path.startswith('/kimage/'):
+            return self.__send(404, {"error": "Unknown path"})
+        k_image = self.path[len('/kimage/'):]
+        if not HEX_KEY_IMAGE.match(k_image):
+            return self.__send(400, {"error": "Key image must be 64 hex characters"})
+        k_image = k_image.lower()
+        txid = self.server.lookup([k_image])[k_image]
+        self.__send(200 if txid is not None else 404, {"k_image": k_image, "txid": txid})
+
+    def do_POST(self):
+        if self.path != '/kimages':
+            return self.__send(404, {"error": "Unknown path"})
+        try:
+            body = ujson.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            k_images = [k_image.lower() for k_image in body["k_images"]]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return self.__send(400, {"error": "Body must be JSON object with k_images list"})
+        if not all(HEX_KEY_IMAGE.match(k_image) for k_image in k_images):
+            return self.__send(400, {"error": "Key image must be 64 hex characters"})
+        self.__send(200, {"txids": self.server.lookup(k_images)})
+
+    def __send(self, code, body):
+        self.sendData(code, ujson.dumps(body).encode())
+
+
+# Starting server in background thread.
+# @bind - "host:port" string.
+def startQueryServer(bind='127.0.0.1:17480', db_path='', pool_size=4, cache_size=100000, get_bloom=None):
+    host, port = bind.rsplit(':', 1)
+    server = KeyImageQueryServer((host, int(port)), db_path=db_path, pool_size=pool_size, cache_size=cache_size,
+                                 get_bloom=get_bloom)
+    thread = serveInBackground(server)
+    print("Serving key image queries on http://{}:{}".format(host, port), file=sys.stderr)
+    return server, thread
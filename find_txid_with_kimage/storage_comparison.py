@@ -0,0 +1,133 @@
+#!/usr/bin/python3.6
+
+import argparse
+import hashlib
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import migrate_db
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import metrics
+
+'''
+Size and throughput comparison of key image DB storage formats on synthetic txs.
+
+legacy - schema version 1, txid_k_images with hex txid and str(list) of hex key images, LIKE lookup.
+text   - schema version 3, one row per key image, but txid and type stored as text.
+binary - current schema, 32 byte BLOB txid and integer type.
+
+For every format DB file size, insert throughput and lookup latency are reported.
+'''
+
+
+def syntheticTxs(n):
+    txs = []
+    for i in range(n):
+        txid = hashlib.sha256(b'tx' + i.to_bytes(8, 'little')).digest()
+        k_images = [hashlib.sha256(b'ki' + i.to_bytes(8, 'little') + j.to_bytes(1, 'little')).digest()
+                    for j in range(1 + i % 3)]
+        txs.append((txid, i % 10 == 0, k_images, i // 20))
+    return txs
+
+
+def createLegacy(cursor):
+    cursor.execute("CREATE TABLE txid_k_images (id integer, txid text, type text, k_images text)")
+
+
+def insertLegacy(cursor, txs):
+    cursor.executemany("INSERT INTO txid_k_images (txid, type, k_images) VALUES(?,?,?)",
+                       [(txid.hex(), 'migration' if migration else 'plain', str([k.hex() for k in k_images]))
+                        for txid, migration, k_images, height in txs])
+
+
+def lookupLegacy(cursor, k_image):
+    cursor.execute("SELECT txid FROM txid_k_images WHERE k_images like '%" + k_image.hex() + "%'")
+    return cursor.fetchone()
+
+
+def createText(cursor):
+    cursor.execute("CREATE TABLE txs (id INTEGER PRIMARY KEY, txid text UNIQUE, type text, block_height integer)")
+    cursor.execute("CREATE INDEX txs_block_height ON txs (block_height)")
+    cursor.execute("CREATE TABLE k_images (k_image BLOB PRIMARY KEY, tx_id integer NOT NULL) WITHOUT ROWID")
+
+
+def insertText(cursor, txs):
+    for txid, migration, k_images, height in txs:
+        cursor.execute("INSERT INTO txs (txid, type, block_height) VALUES(?,?,?)",
+                       [txid.hex(), 'migration' if migration else 'plain', height])
+        tx_id = cursor.lastrowid
+        cursor.executemany("INSERT INTO k_images (k_image, tx_id) VALUES(?,?)", [(k, tx_id) for k in k_images])
+
+
+def createBinary(cursor):
+    migrate_db.createSchema(cursor)
+
+
+def insertBinary(cursor, txs):
+    for txid, migration, k_images, height in txs:
+        cursor.execute("INSERT INTO txs (txid, type, block_height) VALUES(?,?,?)", [txid, int(migration), height])
+        tx_id = cursor.lastrowid
+        cursor.executemany("INSERT INTO k_images (k_image, tx_id) VALUES(?,?)", [(k, tx_id) for k in k_images])
+
+
+def lookupIndexed(cursor, k_image):
+    cursor.execute("SELECT txs.txid FROM k_images JOIN txs ON txs.id = k_images.tx_id WHERE k_images.k_image=?",
+                   [k_image])
+    return cursor.fetchone()
+
+
+FORMATS = [
+    ('legacy', createLegacy, insertLegacy, lookupLegacy),
+    ('text', createText, insertText, lookupIndexed),
+    ('binary', createBinary, insertBinary, lookupIndexed),
+]
+
+
+def compare(num_txs=100000, num_lookups=1000, legacy_lookups=20):
+    txs = syntheticTxs(num_txs)
+    k_images = [k for tx in txs for k in tx[2]]
+    random.seed(0)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, create, insert, lookup in FORMATS:
+            path = os.path.join(directory, name + '.db')
+            conn = sqlite3.connect(path)
+            cursor = conn.cursor()
+            create(cursor)
+            started = time.time()
+            insert(cursor, txs)
+            conn.commit()
+            insert_time = time.time() - started
+            conn.execute("VACUUM")
+
+            latencies = []
+            for k_image in random.sample(k_images, legacy_lookups if name == 'legacy' else num_lookups):
+                started = time.time()
+                lookup(cursor, k_image)
+                latencies.append(time.time() - started)
+            conn.close()
+            results.append((name, os.path.getsize(path), num_txs / insert_time,
+                            metrics.percentile(latencies, 0.5), metrics.percentile(latencies, 0.99)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare size and throughput of key image DB storage formats')
+    parser.add_argument('--txs', help="Number of synthetic txs", required=False, type=int, default=100000)
+    parser.add_argument('--lookups', help="Number of key image lookups per indexed format",
+                        required=False, type=int, default=1000)
+    args = vars(parser.parse_args())
+
+    print("{:<8} {:>12} {:>10} {:>12} {:>12} {:>12}".format('format', 'size [B]', 'B/tx', 'insert tx/s',
+                                                            'lookup p50', 'lookup p99'))
+    for name, size, insert_rate, p50, p99 in compare(args['txs'], args['lookups']):
+        print("{:<8} {:>12} {:>10.1f} {:>12.0f} {:>10.3f}ms {:>10.3f}ms".format(name, size, size / args['txs'],
+                                                                              insert_rate, p50 * 1000, p99 * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import multiprocessing
+import ujson
+
+'''
+Decoding of transactions returned by get_transactions (decode_as_json) into compact tuples
+
+(txid, type, k_images, block_height)
+
+txid - 32 bytes
+type - TYPE_PLAIN or TYPE_MIGRATION
+k_images - key images packed one after another, 32 bytes each
+block_height - integer
+
+Parsing as_json is CPU bound, so big batches can be decoded in pool of worker processes.
+'''
+
+TYPE_PLAIN = 0
+TYPE_MIGRATION = 1
+
+TYPE_NAMES = {TYPE_PLAIN: 'plain', TYPE_MIGRATION: 'migration'}
+TYPE_CODES = {'plain': TYPE_PLAIN, 'migration': TYPE_MIGRATION}
+
+K_IMAGE_SIZE = 32
+
+
+def decodeTx(tx=None):
+    type = TYPE_PLAIN
+    k_images = []
+    as_json = ujson.loads(tx['as_json'])
+    for vin in as_json['vin']:
+        if 'migration' in vin:
+            type = TYPE_MIGRATION
+            k_images.append(bytes.fromhex(vin['migration']['k_image']))
+        if 'key' in vin:
+            k_images.append(bytes.fromhex(vin['key']['k_image']))
+
+    return (bytes.fromhex(tx['tx_hash']), type, b''.join(k_images), int(tx['block_height']))
+
+
+def decodeTxs(txs=[]):
+    return [decodeTx(tx) for tx in txs]
+
+
+def unpackKeyImages(k_images=b''):
+    return [k_images[i:i + K_IMAGE_SIZE] for i in range(0, len(k_images), K_IMAGE_SIZE)]
+
+
+class TxDecoder:
+    # Worker processes are spawned, not forked, so they don't inherit threads, locks or profiler hook of parent which
+    # may already be running (metrics server, --profile).
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.__pool = multiprocessing.get_context('spawn').Pool(processes=workers)
+
+    # Splitting txs into one part per worker and decoding parts in parallel. Order of txs is kept.
+    def decode(self, txs=[]):
+        part_size = (len(txs) + self.workers - 1) // self.workers
+        parts = [txs[i:i + part_size] for i in range(0, len(txs), part_size)]
+        return [tx for part in self.__pool.map(decodeTxs, parts) for tx in part]
+
+    def close(self):
+        self.__pool.terminate()
+        self.__pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,192 @@
+import math
+import os.path
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import metrics
+
+'''
+Open-loop load generation for seed.py. Transactions are started at target rate given by load profile, regardless of how
+long wallets take to process them, so latency of wallets shows as growing number of in-flight submissions instead of
+silently lowering the rate. When max_in_flight submissions are already running, new submission is skipped and counted,
+achieved rate then falls below target and report shows it.
+
+"load_profile" in config.json:
+
+  "phases" - list of phases run one after another, every phase has "type" and "duration" in seconds:
+    {"type": "constant", "tps": 50}
+    {"type": "step", "from_tps": 10, "step_tps": 10, "step_duration": 60} - rate grows by step_tps every step_duration
+    {"type": "ramp", "from_tps": 5, "to_tps": 200} - rate grows linearly over the phase
+    {"type": "burst", "tps": 10, "burst_tps": 100, "period": 60, "burst_duration": 5} - burst_tps for burst_duration
+                                                                                      at start of every period
+  "repeat" - start again from first phase after last one, default false.
+  "bucket_size" - max number of submissions which can be started at once after pause, default 1 second of target rate.
+  "report_interval" - seconds between progress lines, default 10.
+'''
+
+TARGET_TPS = metrics.gauge('seed_target_tps', 'Submission rate requested by load profile')
+ACHIEVED_TPS = metrics.gauge('seed_achieved_tps', 'Submissions started per second over last report interval')
+IN_FLIGHT = metrics.gauge('seed_in_flight', 'Submissions waiting for wallet')
+SUBMISSIONS = metrics.counter('seed_submissions_total', 'Scheduled submissions by result', ['result'])
+
+# Longest sleep of scheduler loop, so rate changes of profile are picked up in time.
+MAX_SLEEP = 0.05
+
+
+class LoadProfile:
+    def __init__(self, phases=[], repeat=False):
+        if not phases:
+            raise ValueError('Load profile needs at least one phase!')
+        for phase in phases:
+            if phase.get('type') not in ('constant', 'step', 'ramp', 'burst') or phase.get('duration', 0) <= 0:
+                raise ValueError('Unknown load profile phase {}'.format(phase))
+        self.phases = phases
+        self.repeat = repeat
+        self.duration = sum(phase['duration'] for phase in phases)
+
+    # @return - index of phase and target rate in tx/s at elapsed seconds since start, None when profile is finished.
+    def rate(self, elapsed=0.0):
+        if self.repeat:
+            elapsed = elapsed % self.duration
+        for index, phase in enumerate(self.phases):
+            if elapsed < phase['duration']:
+                return index, phase_rate(phase, elapsed)
+            elapsed = elapsed - phase['duration']
+        return None
+
+
+def phase_rate(phase, elapsed):
+    if phase['type'] == 'constant':
+        return phase['tps']
+    if phase['type'] == 'step':
+        return phase['from_tps'] + phase['step_tps'] * math.floor(elapsed / phase['step_duration'])
+    if phase['type'] == 'ramp':
+        return phase['from_tps'] + (phase['to_tps'] - phase['from_tps']) * elapsed / phase['duration']
+    if elapsed % phase['period'] < phase['burst_duration']:
+        return phase['burst_tps']
+    return phase['tps']
+
+
+# Token bucket refilled at rate which changes over time. Tokens are added for time passed at rate of that moment.
+class TokenBucket:
+    def __init__(self, size=1.0):
+        self.size = size
+        self.tokens = 0.0
+
+    def refill(self, rate, seconds):
+        self.tokens = min(max(self.size, 1.0), self.tokens + rate * seconds)
+
+    def take(self):
+        if self.tokens < 1.0:
+            return False
+        self.tokens = self.tokens - 1.0
+        return True
+
+
+class RateScheduler:
+    # @jobs - iterator of (function, args) tuples, function result (bool or tuple of bools) tells if tx succeeded.
+    def __init__(self, profile, jobs, max_in_flight=16, bucket_size=None, report_interval=10.0):
+        self.profile = profile
+        self.max_in_flight = max_in_flight
+        self.bucket_size = bucket_size
+        self.report_interval = report_interval
+        self.__jobs = jobs
+        self.__executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.__lock = threading.Lock()
+        self.__in_flight = 0
+        # Per phase: seconds, target tx scheduled (integral of rate), started, skipped, succeeded, failed.
+        self.__phases = [[0.0, 0.0, 0, 0, 0, 0] for phase in profile.phases]
+
+    @classmethod
+    def from_config(cls, config, jobs, max_in_flight=16):
+        load = config['load_profile']
+        return cls(LoadProfile(load['phases'], repeat=load.get('repeat', False)), jobs, max_in_flight=max_in_flight,
+                   bucket_size=load.get('bucket_size'), report_interval=load.get('report_interval', 10.0))
+
+    # Running until profile is finished (never if it repeats) or interrupted, then waiting for in-flight submissions.
+    def run(self):
+        bucket = TokenBucket()
+        started = last = last_report = time.time()
+        started_at_report = 0
+        target_at_report = 0.0
+        try:
+            while True:
+                now = time.time()
+                current = self.profile.rate(now - started)
+                if current is None:
+                    # Rest of last phase passed while loop waited, e.g. for jobs blocked until wallets have funds.
+                    rest = max(0.0, started + self.profile.duration - last)
+                    last_phase = self.profile.phases[-1]
+                    self.__phases[-1][0] += rest
+                    self.__phases[-1][1] += phase_rate(last_phase, last_phase['duration']) * rest
+                    break
+                index, rate = current
+                bucket.size = self.bucket_size if self.bucket_size is not None else rate
+                bucket.refill(rate, now - last)
+                phase = self.__phases[index]
+                phase[0] = phase[0] + (now - last)
+                phase[1] = phase[1] + rate * (now - last)
+                last = now
+                TARGET_TPS.set(rate)
+
+                while bucket.take():
+                    phase[2 if self.__start(index) else 3] += 1
+
+                if now - last_report >= self.report_interval:
+                    total_started = sum(phase[2] for phase in self.__phases)
+                    total_target = sum(phase[1] for phase in self.__phases)
+                    achieved = (total_started - started_at_report) / (now - last_report)
+                    ACHIEVED_TPS.set(achieved)
+                    print("[{:7.0f}s] target {:7.1f} tx/s, achieved {:7.1f} tx/s, in flight {}, skipped {}".format(
+                        now - started, (total_target - target_at_report) / (now - last_report), achieved,
+                        self.__in_flight, sum(phase[3] for phase in self.__phases)))
+                    started_at_report = total_started
+                    target_at_report = total_target
+                    last_report = now
+
+                wait = MAX_SLEEP if rate <= 0 else min(MAX_SLEEP, (1.0 - bucket.tokens) / rate)
+                time.sleep(max(wait, 0.001))
+        except KeyboardInterrupt:
+            print("Interrupted, waiting for {} submissions in flight".format(self.__in_flight))
+        finally:
+            self.__executor.shutdown(wait=True)
+            print(self.report())
+
+    # @return - table of target and achieved rate per phase.
+    def report(self):
+        lines = ['{:<6} {:<9} {:>10} {:>12} {:>14} {:>9} {:>9} {:>9}'.format(
+            'phase', 'type', 'time [s]', 'target tx/s', 'achieved tx/s', 'skipped', 'ok', 'failed')]
+        for index, (seconds, target, started, skipped, succeeded, failed) in enumerate(self.__phases):
+            if seconds == 0:
+                continue
+            lines.append('{:<6} {:<9} {:>10.1f} {:>12.2f} {:>14.2f} {:>9} {:>9} {:>9}'.format(
+                index, self.profile.phases[index]['type'], seconds, target / seconds, started / seconds, skipped,
+                succeeded, failed))
+        return '\n'.join(lines)
+
+    # @return - False if submission was skipped because max_in_flight submissions are running.
+    def __start(self, index):
+        with self.__lock:
+            if self.__in_flight >= self.max_in_flight:
+                SUBMISSIONS.inc(result='skipped')
+                return False
+            self.__in_flight = self.__in_flight + 1
+            IN_FLIGHT.set(self.__in_flight)
+        fn, args = next(self.__jobs)
+        future = self.__executor.submit(fn, *args)
+        future.add_done_callback(lambda future: self.__finished(index, future))
+        return True
+
+    def __finished(self, index, future):
+        result = future.exception() is None and future.result()
+        succeeded = any(result) if isinstance(result, tuple) else bool(result)
+        if future.exception() is not None:
+            print("Error: submission failed: {}".format(future.exception()))
+        with self.__lock:
+            self.__in_flight = self.__in_flight - 1
+            IN_FLIGHT.set(self.__in_flight)
+            self.__phases[index][4 if succeeded else 5] += 1
+        SUBMISSIONS.inc(result='ok' if succeeded else 'failed')
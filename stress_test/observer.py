@@ -0,0 +1,200 @@
+import csv
+import os.path
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import metrics
+from common.rpc_client import RPCClient
+
+'''
+Observer of stress run. Txids submitted by seed.py are recorded with time of submission, observer follows daemon tip
+(get_block_headers_range, get_block) and tx pool (get_transaction_pool) and measures what stress test is for - how
+blocks grow and how long submitted txs wait for inclusion.
+
+One CSV row is written per new block:
+  time, height, block_size, num_txes, median_size, pool_txs, pool_bytes, own_txs, latency_p50, latency_p90, latency_p99
+median_size is median of sizes of last MEDIAN_WINDOW blocks (the value dynamic block size limit is derived from),
+own_txs and latency_* are submitted txs included in block and their inclusion latency in seconds. Latency is measured
+from submission to moment observer saw the block, so it is rounded up to poll_interval.
+
+Summary is printed and written to <output>.summary.txt when observer is stopped.
+
+"observer" in config.json:
+  "output" - CSV file, default ./observed.csv
+  "poll_interval" - seconds between polls of daemon, default 2
+  "daemon_rpc_url" - daemon url, default http://<wallets_daemon_host>:<wallets_daemon_port>
+'''
+
+# Blocks in median of block sizes, CRYPTONOTE_REWARD_BLOCKS_WINDOW.
+MEDIAN_WINDOW = 100
+
+# Max number of blocks requested at once when observer falls behind.
+HEADERS_BATCH_SIZE = 100
+
+FIELDS = ['time', 'height', 'block_size', 'num_txes', 'median_size', 'pool_txs', 'pool_bytes', 'own_txs',
+          'latency_p50', 'latency_p90', 'latency_p99']
+
+INCLUSION_SECONDS = metrics.histogram('observer_inclusion_seconds', 'Time from submission of tx to its block',
+                                      buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200))
+BLOCK_SIZE = metrics.gauge('observer_block_size_bytes', 'Size of last observed block')
+MEDIAN_SIZE = metrics.gauge('observer_median_block_size_bytes', 'Median size of last MEDIAN_WINDOW blocks')
+POOL_TXS = metrics.gauge('observer_pool_txs', 'Txs in daemon tx pool')
+PENDING_TXS = metrics.gauge('observer_pending_txs', 'Submitted txs not included in block yet')
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+class Observer:
+    def __init__(self, daemon_url='', output='./observed.csv', poll_interval=2.0):
+        self.output = output
+        self.poll_interval = poll_interval
+        self.__rpc = RPCClient(daemon_url, timeout=60)
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__thread = None
+        # txid -> submission time of txs not seen in block yet.
+        self.__pending = {}
+        self.__submitted = 0
+        self.__latencies = []
+        # Pending txs already seen in pool and time they took to get there.
+        self.__in_pool = set()
+        self.__pool_latencies = []
+        self.__sizes = []
+        self.__blocks = []
+        self.__next_height = None
+
+    @classmethod
+    def from_config(cls, config):
+        observer = config.get('observer', {})
+        default_url = 'http://{}:{}'.format(config['wallets_daemon_host'], config['wallets_daemon_port'])
+        return cls(daemon_url=observer.get('daemon_rpc_url', default_url),
+                   output=observer.get('output', './observed.csv'), poll_interval=observer.get('poll_interval', 2.0))
+
+    # Called from submitting threads for every tx accepted by wallet.
+    def record(self, txid=''):
+        with self.__lock:
+            self.__pending[txid] = time.time()
+            self.__submitted = self.__submitted + 1
+            PENDING_TXS.set(len(self.__pending))
+
+    def start(self):
+        height = self.__rpc.sendGetRequest('getinfo')['height']
+        # Sizes of blocks below start are needed only for median.
+        first = max(0, height - MEDIAN_WINDOW)
+        if height > first:
+            self.__sizes = [header['block_size'] for header in self.__headers(first, height - 1)]
+        self.__next_height = height
+        self.__file = open(self.output, 'a', newline='')
+        self.__writer = csv.writer(self.__file)
+        if self.__file.tell() == 0:
+            self.__writer.writerow(FIELDS)
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+        print("Observing blocks from height {}, writing {}".format(height, self.output))
+
+    # Stopping after last poll, printing and saving summary.
+    def stop(self):
+        if self.__thread is None or self.__stopped.is_set():
+            return
+        self.__stopped.set()
+        self.__thread.join()
+        self.__file.close()
+        report = self.summary()
+        with open(self.output + '.summary.txt', 'w') as file:
+            file.write(report)
+        print(report)
+
+    def summary(self):
+        with self.__lock:
+            latencies = list(self.__latencies)
+            pending = len(self.__pending)
+            submitted = self.__submitted
+            pool_latencies = list(self.__pool_latencies)
+        blocks = self.__blocks
+        lines = ['Submitted txs: {}, included: {}, not included: {}'.format(submitted, len(latencies), pending)]
+        if latencies:
+            lines.append('Inclusion latency [s]: p50 {:.1f}, p90 {:.1f}, p99 {:.1f}, max {:.1f}'.format(
+                metrics.percentile(latencies, 0.5), metrics.percentile(latencies, 0.9), metrics.percentile(latencies, 0.99),
+                max(latencies)))
+        if pool_latencies:
+            lines.append('Submission to pool [s]: p50 {:.1f}, p90 {:.1f}'.format(
+                metrics.percentile(pool_latencies, 0.5), metrics.percentile(pool_latencies, 0.9)))
+        if blocks:
+            sizes = [block['block_size'] for block in blocks]
+            lines.append('Blocks observed: {} ({} - {}), txs per block: {:.1f}, max txs: {}'.format(
+                len(blocks), blocks[0]['height'], blocks[-1]['height'],
+                sum(block['num_txes'] for block in blocks) / len(blocks), max(block['num_txes'] for block in blocks)))
+            lines.append('Block size [B]: mean {:.0f}, max {}, median window {:.0f} -> {:.0f}'.format(
+                sum(sizes) / len(sizes), max(sizes), blocks[0]['median_size'], blocks[-1]['median_size']))
+        return '\n'.join(lines) + '\n'
+
+    # Last poll runs after stop was requested, so blocks mined meanwhile are counted.
+    def __run(self):
+        while True:
+            stopped = self.__stopped.is_set()
+            try:
+                self.__poll()
+            except Exception as e:
+                print("Error while observing daemon: {}".format(e))
+            if stopped:
+                return
+            self.__stopped.wait(self.poll_interval)
+
+    def __poll(self):
+        now = time.time()
+        pool = self.__rpc.sendPlainRequest('get_transaction_pool', {}).get('transactions') or []
+        with self.__lock:
+            for tx in pool:
+                submitted = self.__pending.get(tx['id_hash'])
+                if submitted is not None and tx['id_hash'] not in self.__in_pool:
+                    self.__in_pool.add(tx['id_hash'])
+                    self.__pool_latencies.append(now - submitted)
+        POOL_TXS.set(len(pool))
+
+        height = self.__rpc.sendGetRequest('getinfo')['height']
+        while self.__next_height < height:
+            end = min(height - 1, self.__next_height + HEADERS_BATCH_SIZE - 1)
+            headers = self.__headers(self.__next_height, end)
+            blocks = self.__rpc.sendJSONRPCBatch([("get_block", {"height": header['height']}) for header in headers])
+            for header, block in zip(headers, blocks):
+                self.__block(now, header, block.get('tx_hashes', []), pool)
+            self.__next_height = end + 1
+            self.__file.flush()
+
+    def __block(self, now, header, tx_hashes, pool):
+        self.__sizes = (self.__sizes + [header['block_size']])[-MEDIAN_WINDOW:]
+        latencies = []
+        with self.__lock:
+            for txid in tx_hashes:
+                submitted = self.__pending.pop(txid, None)
+                if submitted is not None:
+                    latencies.append(now - submitted)
+                    self.__in_pool.discard(txid)
+            self.__latencies.extend(latencies)
+            PENDING_TXS.set(len(self.__pending))
+        for latency in latencies:
+            INCLUSION_SECONDS.observe(latency)
+        median_size = median(self.__sizes)
+        self.__blocks.append({'height': header['height'], 'block_size': header['block_size'],
+                              'num_txes': header['num_txes'], 'median_size': median_size})
+        BLOCK_SIZE.set(header['block_size'])
+        MEDIAN_SIZE.set(median_size)
+        self.__writer.writerow([round(now, 3), header['height'], header['block_size'], header['num_txes'], median_size,
+                                len(pool), sum(tx.get('blob_size', 0) for tx in pool), len(latencies)] +
+                               ['' if not latencies else round(metrics.percentile(latencies, p), 1)
+                                for p in (0.5, 0.9, 0.99)])
+
+    def __headers(self, start, end):
+        headers = []
+        for i in range(start, end + 1, HEADERS_BATCH_SIZE):
+            res = self.__rpc.sendJSONRPCRequest(method="get_block_headers_range",
+                                                params={"start_height": i,
+                                                        "end_height": min(end, i + HEADERS_BATCH_SIZE - 1)})
+            headers.extend(res['headers'])
+        return headers
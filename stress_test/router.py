@@ -0,0 +1,157 @@
+import os.path
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import metrics
+
+'''
+Balance-aware routing of stress test transfers. Instead of taking wallets strictly in turn, transfer is sent from next
+wallet which has enough unlocked cash (or token) according to locally tracked balances, so wallets with locked funds
+don't cost a round trip to wallet which refuses transaction.
+
+Balances start from values wallets reported at startup. Amount sent is subtracted from sender together with fee margin
+as soon as transfer is dispatched (and returned if wallet refuses it), receiver gets it as locked funds which unlock
+after unlock_seconds. Change of sender is unknown locally, so real unlocked balances are fetched again every
+refresh_interval seconds in background thread and replace local estimate, routing never waits for wallets. Amounts of
+transfers still in flight when fetched balances are swapped in are subtracted from them again.
+
+"router" in config.json:
+  "unlock_seconds" - time after which received funds become spendable, default 10 blocks of 120 s
+  "fee_margin" - cash kept aside for fee of every transfer, default 1
+  "refresh_interval" - seconds between refreshes of real balances, default 120
+'''
+
+FUNDED_WALLETS = metrics.gauge('seed_router_funded_wallets', 'Wallets with unlocked cash for a transfer')
+WAITS = metrics.counter('seed_router_waits_total', 'Times no wallet had unlocked funds for next transfer')
+
+# Seconds between checks of balances while waiting for funds to unlock.
+WAIT_INTERVAL = 1.0
+
+
+class BalanceRouter:
+    # @wallets - ring of seed.Wallet or rpc_wallet.RPCWallet objects with cash_amount and token_amount filled in.
+    def __init__(self, wallets=[], unlock_seconds=1200.0, fee_margin=1.0, refresh_interval=120.0):
+        self.wallets = wallets
+        self.unlock_seconds = unlock_seconds
+        self.fee_margin = fee_margin
+        self.refresh_interval = refresh_interval
+        self.__lock = threading.Lock()
+        self.__unlocked = [[wallet.cash_amount, wallet.token_amount] for wallet in wallets]
+        # Per wallet list of [unlock time, cash, token] of received funds.
+        self.__locked = [[] for wallet in wallets]
+        # Per wallet [cash, token] reserved by route and not settled by transfer yet.
+        self.__reserved = [[0, 0] for wallet in wallets]
+        self.__refreshed = time.time()
+        self.__refreshing = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, wallets):
+        router = config.get('router', {})
+        return cls(wallets, unlock_seconds=router.get('unlock_seconds', 1200.0),
+                   fee_margin=router.get('fee_margin', 1.0), refresh_interval=router.get('refresh_interval', 120.0))
+
+    # Finding wallet which can send given amounts, starting at wallet index start. Amounts are reserved right away.
+    # @return - index of sending wallet or None if no wallet has enough unlocked funds.
+    def route(self, start=0, cash_amount=0, token_amount=0):
+        self.__refresh_if_due()
+        now = time.time()
+        with self.__lock:
+            funded = 0
+            source = None
+            for i in range(len(self.wallets)):
+                index = (start + i) % len(self.wallets)
+                self.__unlock(index, now)
+                cash, token = self.__unlocked[index]
+                if cash >= self.fee_margin:
+                    funded = funded + 1
+                if source is None and cash >= cash_amount + self.fee_margin and token >= token_amount:
+                    source = index
+            FUNDED_WALLETS.set(funded)
+            if source is not None:
+                self.__unlocked[source][0] -= cash_amount + self.fee_margin
+                self.__unlocked[source][1] -= token_amount
+                self.__reserved[source][0] += cash_amount + self.fee_margin
+                self.__reserved[source][1] += token_amount
+            return source
+
+    # Blocking until some wallet can send given amounts.
+    # @return - index of sending wallet.
+    def wait_for_route(self, start=0, cash_amount=0, token_amount=0):
+        source = self.route(start, cash_amount, token_amount)
+        if source is None:
+            WAITS.inc()
+            print("No wallet has {} unlocked cash and {} token, waiting for funds to unlock".format(
+                cash_amount + self.fee_margin, token_amount))
+        while source is None:
+            time.sleep(WAIT_INTERVAL)
+            source = self.route(start, cash_amount, token_amount)
+        return source
+
+    # Sending transfer reserved by route and updating balances according to result.
+    # @return - result of perform_tx.
+    def transfer(self, source, destination, cash_amount=0, token_amount=0):
+        result = (False, False)
+        try:
+            result = self.wallets[source].perform_tx(self.wallets[destination].address, cash_amount, token_amount)
+        finally:
+            cash_ok, token_ok = result
+            with self.__lock:
+                # Fee is paid only if tx was sent, refused amounts are spendable again.
+                self.__unlocked[source][0] += (0 if cash_ok else cash_amount) + \
+                                              (0 if cash_ok or token_ok else self.fee_margin)
+                self.__unlocked[source][1] += 0 if token_ok else token_amount
+                self.__reserved[source][0] -= cash_amount + self.fee_margin
+                self.__reserved[source][1] -= token_amount
+                self.__receive(destination, cash_amount if cash_ok else 0, token_amount if token_ok else 0)
+        return result
+
+    # Migration mints tokens, only receiving wallet balance is tracked.
+    def migrate(self, genesis_wallet, destination, token_amount=0):
+        success = genesis_wallet.migration_tx(self.wallets[destination].address, token_amount)
+        if success:
+            with self.__lock:
+                self.__receive(destination, 0, token_amount)
+        return success
+
+    # Fetching real balances of all wallets in parallel. Locked funds which unlocked meanwhile are already part of them.
+    def refresh(self):
+        with ThreadPoolExecutor(max_workers=min(len(self.wallets), 16)) as executor:
+            balances = list(executor.map(lambda wallet: wallet.get_balance(), self.wallets))
+        now = time.time()
+        with self.__lock:
+            for index, (cash, token) in enumerate(balances):
+                self.__locked[index] = [funds for funds in self.__locked[index] if funds[0] > now]
+                self.__unlocked[index] = [cash - self.__reserved[index][0], token - self.__reserved[index][1]]
+            self.__refreshed = now
+
+    # Starting refresh in background thread when it is due and not running already, route keeps using current
+    # estimate meanwhile.
+    def __refresh_if_due(self):
+        if time.time() - self.__refreshed < self.refresh_interval:
+            return
+        if not self.__refreshing.acquire(blocking=False):
+            return
+        threading.Thread(target=self.__run_refresh, daemon=True).start()
+
+    def __run_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print("Error while refreshing wallet balances: {}".format(e))
+            self.__refreshed = time.time()
+        finally:
+            self.__refreshing.release()
+
+    def __receive(self, index, cash_amount, token_amount):
+        if cash_amount > 0 or token_amount > 0:
+            self.__locked[index].append([time.time() + self.unlock_seconds, cash_amount, token_amount])
+
+    def __unlock(self, index, now):
+        locked = self.__locked[index]
+        while locked and locked[0][0] <= now:
+            unlock_time, cash, token = locked.pop(0)
+            self.__unlocked[index][0] += cash
+            self.__unlocked[index][1] += token
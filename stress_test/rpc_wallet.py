@@ -0,0 +1,115 @@
+import hashlib
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import metrics
+from common.rpc_client import RPCClient, RPCError
+
+'''
+Wallet driven over safex-wallet-rpc JSON-RPC instead of keystrokes to safex-wallet-cli. Class has the same interface as
+seed.Wallet (address, not_connected, get_balance, perform_tx, migration_tx), so seed.py can use either of them.
+
+Every wallet of the ring is served by its own wallet-rpc instance (wallet-rpc opens one wallet), urls are given in
+"wallet_rpc_urls" in the same order as "wallet_electrum_seeds". Requests go over pooled keep-alive connections, so
+several submissions can be in flight at once from different threads.
+
+Method names and their params differ between wallet-rpc builds, names can be overridden with "wallet_rpc_methods" in
+config.json, e.g. {"transfer_token": "transfer_token", "migrate": "migrate"}.
+'''
+
+DEFAULT_METHODS = {"get_address": "get_address", "get_balance": "get_balance", "transfer_cash": "transfer",
+                   "transfer_token": "transfer_token", "migrate": "migrate"}
+
+# Atomic units in one cash or token, amounts in config.json are in whole units like in CLI commands.
+ATOMIC_UNITS = 10000000000
+
+TXS_SUBMITTED = metrics.counter('seed_txs_total', 'Transactions attempted by kind and result', ['kind', 'result'])
+WALLET_BALANCE = metrics.gauge('seed_wallet_unlocked_balance', 'Unlocked balance seen by last balance command',
+                               ['wallet', 'currency'])
+
+
+class RPCWallet:
+    Config = 0
+    Observer = None
+
+    # @url - wallet-rpc url
+    # @pool_size - number of connections to wallet-rpc, at least number of threads submitting through this wallet.
+    def __init__(self, url='', genesis=False, pool_size=4, timeout=60.0):
+        self.genesis = genesis
+        self.url = url
+        self.not_connected = False
+        self.token_amount = 0
+        self.cash_amount = 0
+        self.methods = dict(DEFAULT_METHODS, **RPCWallet.Config.get('wallet_rpc_methods', {}))
+        self.__rpc = RPCClient(url, pool_size=pool_size, timeout=timeout)
+        try:
+            self.address = self.__rpc.sendJSONRPCRequest(method=self.methods['get_address'], params={})['address']
+        except Exception as e:
+            print("Wallet rpc {} is not reachable: {}".format(url, e))
+            self.address = ''
+            self.not_connected = True
+            return
+        self.get_balance()
+
+    # @return - unlocked cash and token balance in whole units.
+    def get_balance(self):
+        res = self.__rpc.sendJSONRPCRequest(method=self.methods['get_balance'], params={})
+        self.cash_amount = res.get('unlocked_balance', 0) / ATOMIC_UNITS
+        self.token_amount = res.get('unlocked_token_balance', 0) / ATOMIC_UNITS
+        WALLET_BALANCE.set(self.cash_amount, wallet=self.url, currency='cash')
+        WALLET_BALANCE.set(self.token_amount, wallet=self.url, currency='token')
+        return self.cash_amount, self.token_amount
+
+    # Same semantics as seed.Wallet.perform_tx, amount 0 skips transaction of that kind.
+    # @return bool pair indicating if txs are successful.
+    def perform_tx(self, address, cash_amount, token_amount=0):
+        cash_tx_ok = False
+        token_tx_ok = False
+        if cash_amount > 0:
+            txid = self.__submit('cash', self.methods['transfer_cash'],
+                                 {"destinations": [{"address": address, "amount": int(cash_amount * ATOMIC_UNITS)}],
+                                  "mixin": RPCWallet.Config['ring_size'] - 1})
+            if txid is not None:
+                cash_tx_ok = True
+                print("Cash tx:{}".format(txid))
+        if token_amount > 0:
+            txid = self.__submit('token', self.methods['transfer_token'],
+                                 {"destinations": [{"address": address,
+                                                    "token_amount": int(token_amount * ATOMIC_UNITS)}],
+                                  "mixin": RPCWallet.Config['ring_size'] - 1})
+            if txid is not None:
+                token_tx_ok = True
+                print("Token tx:{}".format(txid))
+        return cash_tx_ok, token_tx_ok
+
+    # Only possible if wallet is genesis wallet. If not exception is risen.
+    # @return bool indicating if tx is successful.
+    def migration_tx(self, address, amount):
+        if self.genesis == False:
+            raise Exception("This is not genesis wallet, you cant execute migration tx!")
+        txid = self.__submit('migration', self.methods['migrate'],
+                             {"address": address, "bitcoin_hash": hashlib.sha256(str(time.time()).encode()).hexdigest(),
+                              "amount": int(amount * ATOMIC_UNITS)})
+        if txid is not None:
+            print("Migration tx:{}".format(txid))
+        return txid is not None
+
+    def close(self):
+        self.__rpc.close()
+
+    # Failed transfer (e.g. not enough unlocked funds) is reported and counted, not raised, like in CLI wallet.
+    # @return - txid or None if wallet refused transaction.
+    def __submit(self, kind, method, params):
+        try:
+            res = self.__rpc.sendJSONRPCRequest(method=method, params=params)
+        except (RPCError, IOError, ValueError) as e:
+            print("Error: {} tx from {} failed: {}".format(kind, self.url, e))
+            TXS_SUBMITTED.inc(kind=kind, result='error')
+            return None
+        TXS_SUBMITTED.inc(kind=kind, result='ok')
+        txid = res.get('tx_hash') or (res.get('tx_hash_list') or [None])[0]
+        if txid is not None and RPCWallet.Observer is not None:
+            RPCWallet.Observer.record(txid)
+        return txid
@@ -5,8 +5,8 @@ This script is intended to work with config.json file for configuring basic para
 Script is creating one advanced wallet and n wallet processes and communicating with them in order to seed testnet with
 transactions. Transactions are performed in cycles, w1 -> w2, w2 -> w3 ... wn -> w1, where wx is wallet.
 
-Please keep in mind if there is no enough unlocked amount of cash (or token) transactions will not be executed. So it
-will effect to total number of transactions executed.
+Unlocked balances of wallets are tracked locally (see router.py). Wallet without enough unlocked cash (or token) is
+skipped and next wallet in ring sends instead, when no wallet has enough, script waits until some funds unlock.
 
 Printout of tx ids and attempts of cash value txs are left on purpose to indicate execution of script.
 
@@ -14,8 +14,8 @@ Script requires at least Python3+ version.
 
 config.json explained
 
-  "num_of_tx" - Number of calls for perform_tx method. Total number of transaction is num_of_tx + num_of_tx/3. For
-                every 3  cash transaction there is one additional token transaction.
+  "num_of_tx" - Number of cash transactions per cycle. Total number of transaction is num_of_tx + 2*num_of_tx/3. Every
+                cash transaction except every third one is followed by token transaction.
   "num_of_mtx" - Number of migration transactions per every migration_period_coeff cycle. E.g. if migration_period_coeff
                  is 3, after 3*(num_of_tx) will be exactly num_of_mtx migration transactions.
   "lower_cash" - Lower boundary for cash amount.
@@ -35,6 +35,20 @@ config.json explained
   "wallets_daemon_port" - Port value for safexd daemon where wallet will connect.
   "wallet_files_path" - Directory where wallet files will be or are stored.
   "wallet_log_path": - Directory for log files to be stored.
+  "backend" - "cli" (default) drives wallet cli processes, "rpc" drives already running safex-wallet-rpc instances
+              (see rpc_wallet.py). Wallet files for wallet-rpc can be generated from seeds by one run with "cli".
+  "wallet_rpc_urls" - Array of wallet-rpc urls, one per electrum seed in the same order. Used with "rpc" backend.
+  "genesis_wallet_rpc_url" - Url of wallet-rpc serving advanced (genesis) wallet. Used with "rpc" backend.
+  "wallet_rpc_methods" - Optional overrides of wallet-rpc method names, see rpc_wallet.DEFAULT_METHODS.
+  "max_in_flight" - Number of submissions running concurrently, default 16 with "rpc" backend and 1 with "cli".
+                    Commands of one CLI wallet are always run one at a time.
+  "command_timeouts" - Optional overrides of seconds CLI wallet gets for "startup", "balance", "transfer_cash",
+                       "transfer_token" and "migrate" commands. Wallet missing deadline is killed and restarted.
+  "load_profile" - Optional open-loop target rate schedule replacing sleep_tx/sleep_mtx pacing, see load_scheduler.py.
+  "bootstrap_threads" - Number of wallets started at once, default 16.
+  "router" - Optional settings of balance-aware choice of sending wallet, see router.py.
+  "observer" - Optional, records submitted txs and follows daemon blocks and tx pool, writes block size and inclusion
+               latency time series and summary, see observer.py.
 
 '''
 
@@ -48,8 +62,22 @@ import hashlib
 import time
 import random
 import atexit
+import functools
+import threading
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
 from queue import Queue, Empty
+from rpc_wallet import RPCWallet, TXS_SUBMITTED, WALLET_BALANCE
+from load_scheduler import RateScheduler
+from observer import Observer
+from router import BalanceRouter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import metrics
+
+COMMAND_SECONDS = metrics.histogram('wallet_command_seconds', 'Time from writing wallet command to its result',
+                                    ['command'])
 
 # Generate advanced wallet process
 def create_genesis_wallet_process(config):
@@ -64,94 +92,138 @@ def create_genesis_wallet_process(config):
     process.stdin.flush()
     return process
 
-# Generate simple wallet processes to be used later
-def create_wallet_processes(config):
-    wallet_processes = []
-    index = 0
-    for seed in config['wallet_electrum_seeds']:
-        wallet_file_name = config['wallet_files_path'] + 'wallet_' + str(index) + '.bin'
-        print('Creating wallet @{}'.format(wallet_file_name))
-        args_wallet = []
-        if not os.path.isfile(wallet_file_name):
-            args_wallet = [config['simple_wallet_path_cli'],
-                           '--testnet',
-                           '--generate-new-wallet',
-                           wallet_file_name,
-                           '--restore-deterministic-wallet',
-                           '--electrum-seed={}'.format(seed),
-                           '--daemon-host',
-                           config['wallets_daemon_host'],
-                           '--password',
-                           "",
-                           '--log-file',
-                           config['wallet_files_path'] + "log_" + str(index) + '.log'
-                           ]
-            print(subprocess.list2cmdline(args_wallet))
-            wallet_processes.append(subprocess.Popen(args_wallet, stdin=subprocess.PIPE, stdout=subprocess.PIPE))
-            sleep(5) # give some time to wallet to initialize
-            wallet_processes[-1].stdin.write("\n".encode())
-            wallet_processes[-1].stdin.flush()
-            wallet_processes[-1].stdin.write("0\n".encode())
-            wallet_processes[-1].stdin.flush()
-        else:
-            args_wallet = [config['simple_wallet_path_cli'],
-                           '--testnet',
-                           '--wallet-file',
-                           wallet_file_name,
-                           '--daemon-host',
-                           config['wallets_daemon_host'],
-                           '--log-file',
-                           config['wallet_files_path'] + "log_" + str(index) + '.log',
-                           '--password',
-                           ""
-                           ]
-            print(subprocess.list2cmdline(args_wallet))
-            wallet_processes.append(subprocess.Popen(args_wallet, stdin=subprocess.PIPE, stdout=subprocess.PIPE))
-        index = index + 1
-    return wallet_processes
+# Generate one simple wallet process. Wallet file is generated from seed on first start and opened afterwards.
+def create_wallet_process(config, index, seed):
+    wallet_file_name = config['wallet_files_path'] + 'wallet_' + str(index) + '.bin'
+    print('Creating wallet @{}'.format(wallet_file_name))
+    args_wallet = []
+    if not os.path.isfile(wallet_file_name):
+        args_wallet = [config['simple_wallet_path_cli'],
+                       '--testnet',
+                       '--generate-new-wallet',
+                       wallet_file_name,
+                       '--restore-deterministic-wallet',
+                       '--electrum-seed={}'.format(seed),
+                       '--daemon-host',
+                       config['wallets_daemon_host'],
+                       '--password',
+                       "",
+                       '--log-file',
+                       config['wallet_files_path'] + "log_" + str(index) + '.log'
+                       ]
+        print(subprocess.list2cmdline(args_wallet))
+        process = subprocess.Popen(args_wallet, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        sleep(5) # give some time to wallet to initialize
+        process.stdin.write("\n".encode())
+        process.stdin.flush()
+        process.stdin.write("0\n".encode())
+        process.stdin.flush()
+    else:
+        args_wallet = [config['simple_wallet_path_cli'],
+                       '--testnet',
+                       '--wallet-file',
+                       wallet_file_name,
+                       '--daemon-host',
+                       config['wallets_daemon_host'],
+                       '--log-file',
+                       config['wallet_files_path'] + "log_" + str(index) + '.log',
+                       '--password',
+                       ""
+                       ]
+        print(subprocess.list2cmdline(args_wallet))
+        process = subprocess.Popen(args_wallet, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    return process
+
+class WalletTimeout(Exception):
+    pass
+
+
+class WalletExited(Exception):
+    pass
+
+
+# Reading wallet stdout on its own thread, so commands can wait for their output with deadline instead of blocking
+# in readline. Lines are kept as str() of bytes read, which is what parsing in Wallet expects. None marks end of output.
+class OutputReader:
+    def __init__(self, process):
+        self.lines = Queue()
+        self.__thread = threading.Thread(target=self.__read, args=(process.stdout,), daemon=True)
+        self.__thread.start()
+
+    # @return - next line, raises WalletTimeout if no line arrives before deadline (time.time() value).
+    def readline(self, deadline):
+        try:
+            line = self.lines.get(timeout=max(deadline - time.time(), 0))
+        except Empty:
+            raise WalletTimeout()
+        if line is None:
+            self.lines.put(None)
+            raise WalletExited()
+        return line
+
+    # Dropping output left from previous commands (prompts, late errors), so it isn't taken as result of next one.
+    def drain(self):
+        try:
+            while True:
+                line = self.lines.get_nowait()
+                if line is None:
+                    self.lines.put(None)
+                    return
+        except Empty:
+            pass
+
+    def __read(self, stdout):
+        for line in iter(stdout.readline, b''):
+            self.lines.put(str(line))
+        self.lines.put(None)
+
+
+# Seconds given to wallet for finishing command, can be overridden by "command_timeouts" in config.json.
+COMMAND_TIMEOUTS = {"startup": 600, "balance": 60, "transfer_cash": 300, "transfer_token": 300, "migrate": 300}
+
+WALLET_TIMEOUTS = metrics.counter('wallet_command_timeouts_total', 'Wallet commands which missed deadline or lost wallet',
+                                  ['command'])
+WALLET_RESTARTS = metrics.counter('wallet_restarts_total', 'Wallet processes restarted after failed command')
 
 
 # Class implementing basic operations with wallet needed for seeding testnet.
+# Commands of one wallet are serialized by lock, different wallets can be used from different threads. Wallet which
+# misses deadline of command or exits is killed and started again by start_process, other wallets are not affected.
 class Wallet:
     Config = 0
+    Observer = None
 
-    def __init__(self, process, genesis=False):
+    # @start_process - function starting wallet process, used for restarting it.
+    # @name - label of wallet in metrics and messages, stays the same when process is restarted.
+    def __init__(self, start_process, genesis=False, name=''):
         self.genesis = genesis
-        self.process = process
+        self.name = name
         self.not_connected = False
-        self.__process_initial_information()
         self.token_amount = 0
         self.cash_amount = 0
+        self.__start_process = start_process
+        self.__lock = threading.Lock()
+        self.__broken = False
+        self.__start()
         self.get_balance()
 
-    # Processing initial info about wallet
-    # Getting error statuses regarding connection etc
-    def __process_initial_information(self):
-        line = str(self.process.stdout.readline())
-        while True:
-            if line.find("wallet: SFX") != -1:
-               self.address =  line.split(": ",1)[1][:-3] # Get key and remove \n' from the end.
-            if line.find("Background refresh") != -1:
-                break
-            if line.find("wallet failed to connect to daemon") != -1 :
-                self.not_connected = True
-            line = str(self.process.stdout.readline())
-        d = 'd'
-
     # Get balance
     def get_balance(self):
-        self.process.stdin.write("balance\n".encode())
-        self.process.stdin.flush()
-        line = str(self.process.stdout.readline)
-        while line.find("unlocked cash balance") == -1:
-            line = str(self.process.stdout.readline())
-        cash = line.split("unlocked cash balance: ",1)[1][:-3]
-        while line.find("unlocked token balance") == -1:
-            line = str(self.process.stdout.readline())
-        token = line.split("unlocked token balance: ",1)[1][:-3]
-
-        self.token_amount = float(token)
-        self.cash_amount = float(cash)
+        def parse(deadline):
+            line = self.__readline(deadline)
+            while line.find("unlocked cash balance") == -1:
+                line = self.__readline(deadline)
+            cash = line.split("unlocked cash balance: ",1)[1][:-3]
+            while line.find("unlocked token balance") == -1:
+                line = self.__readline(deadline)
+            token = line.split("unlocked token balance: ",1)[1][:-3]
+            return float(cash), float(token)
+
+        balance = self.__command('balance', ["balance\n"], parse)
+        if balance is not None:
+            self.cash_amount, self.token_amount = balance
+            WALLET_BALANCE.set(self.cash_amount, wallet=self.name, currency='cash')
+            WALLET_BALANCE.set(self.token_amount, wallet=self.name, currency='token')
 
         return self.cash_amount, self.token_amount
 
@@ -164,139 +236,282 @@ class Wallet:
         token_tx_ok = False
         if cash_amount > 0:
             cash_transfer_cmd = "transfer_cash " + str(Wallet.Config['ring_size']) + " " + address + " " + str(cash_amount) + "\n"
-            self.process.stdin.write(cash_transfer_cmd.encode())
-            self.process.stdin.flush()
-            self.process.stdin.write("\n".encode())
-            self.process.stdin.flush()
-            self.process.stdin.write("y\n".encode())
-            self.process.stdin.flush()
-            self.process.stdin.write("y\n".encode())
-            self.process.stdin.flush()
-            self.process.stdin.write("y\n".encode())
-            self.process.stdin.flush()
-            line = str(self.process.stdout.readline())
-            while line.find("Error: ") == -1 and line.find("Transaction successfully") == -1 :
-                line = str(self.process.stdout.readline())
-            if line.find("Transaction successfully") != -1:
+            line = self.__command('transfer_cash', [cash_transfer_cmd, "\n", "y\n", "y\n", "y\n"],
+                                  self.__result_parser("Error: ", "Transaction successfully"))
+            if line is not None and line.find("Transaction successfully") != -1:
                 cash_tx_ok = True
+                self.__submitted(line.split("transaction <", 1)[1][:-4])
                 print("Cash tx:{}".format(line.split("transaction <", 1)[1][:-4]))
+            TXS_SUBMITTED.inc(kind='cash', result='ok' if cash_tx_ok else 'error')
         if token_amount > 0:
             cash_transfer_cmd = "transfer_token " + str(Wallet.Config['ring_size']) + " "  + address + " " + str(token_amount) + "\n"
-            self.process.stdin.write(cash_transfer_cmd.encode())
-            self.process.stdin.flush()
-            self.process.stdin.write("\n".encode())
-            self.process.stdin.flush()
-            self.process.stdin.write("y\n".encode())
-            self.process.stdin.flush()
-            self.process.stdin.write("y\n".encode())
-            self.process.stdin.flush()
-            self.process.stdin.write("y\n".encode())
-            self.process.stdin.flush()
-            line = str(self.process.stdout.readline())
-            while line.find("Error: ") == -1 and line.find("Transaction successfully") == -1:
-                line = str(self.process.stdout.readline())
-            if line.find("Transaction successfully") != -1:
+            line = self.__command('transfer_token', [cash_transfer_cmd, "\n", "y\n", "y\n", "y\n"],
+                                  self.__result_parser("Error: ", "Transaction successfully"))
+            if line is not None and line.find("Transaction successfully") != -1:
+                self.__submitted(line.split("transaction <", 1)[1][:-4])
                 print("Token tx:{}".format(line.split("transaction <", 1)[1][:-4]))
                 token_tx_ok = True
+            TXS_SUBMITTED.inc(kind='token', result='ok' if token_tx_ok else 'error')
 
         return cash_tx_ok, token_tx_ok
 
     # Only possible if wallet is genesis wallet. If not exception is risen.
     # @return bool indicating if tx is successful.
     def migration_tx(self, address, amount):
-        self.process.stdin.flush()
         if self.genesis == False:
             raise Exception("This is not genesis wallet process, you cant execute migration tx!")
 
         success = False
         cmd = "migrate " + address + " " + hashlib.sha256(str(time.time()).encode()).hexdigest() + " " + str(amount) + "\n"
-        self.process.stdin.write(cmd.encode())
-        self.process.stdin.flush()
-        sleep(1)
-        self.process.stdin.write("\n".encode())
-        self.process.stdin.flush()
-        self.process.stdin.write("y\n".encode())
-        self.process.stdin.flush()
-
-        line = str(self.process.stdout.readline())
-        while line.find("Transaction successfully submitted") == -1 and line.find("Error:") == -1:
-            line = str(self.process.stdout.readline())
-        if line.find("Transaction successfully submitted") != -1:
+        line = self.__command('migrate', [cmd, 1, "\n", "y\n"],
+                              self.__result_parser("Error:", "Transaction successfully submitted"))
+        if line is not None and line.find("Transaction successfully submitted") != -1:
+            self.__submitted(line.split("transaction <", 1)[1][:-4])
             print("Migration tx:{}".format(line.split("transaction <", 1)[1][:-4]))
             success = True
+        TXS_SUBMITTED.inc(kind='migration', result='ok' if success else 'error')
         return success
 
+    def kill(self):
+        self.process.kill()
+
+    def __submitted(self, txid):
+        if Wallet.Observer is not None:
+            Wallet.Observer.record(txid)
+
+    # Starting wallet process and processing initial info about it.
+    # Getting error statuses regarding connection etc
+    def __start(self):
+        self.process = self.__start_process()
+        self.__output = OutputReader(self.process)
+        deadline = time.time() + self.__timeout('startup')
+        line = self.__readline(deadline)
+        while True:
+            if line.find("wallet: SFX") != -1:
+               self.address =  line.split(": ",1)[1][:-3] # Get key and remove \n' from the end.
+            if line.find("Background refresh") != -1:
+                break
+            if line.find("wallet failed to connect to daemon") != -1 :
+                self.not_connected = True
+            line = self.__readline(deadline)
+
+    # Writing command to wallet and parsing its output with deadline.
+    # @inputs - lines written to wallet stdin, number means pause in seconds before next line.
+    # @parse - function reading output of command, gets deadline as argument.
+    # @return - result of parse, None if wallet missed deadline or exited. Such wallet is restarted.
+    def __command(self, name, inputs, parse):
+        with self.__lock:
+            try:
+                if self.__broken:
+                    self.__restart()
+                self.__output.drain()
+                with COMMAND_SECONDS.time(command=name):
+                    deadline = time.time() + self.__timeout(name)
+                    for data in inputs:
+                        if isinstance(data, str):
+                            self.process.stdin.write(data.encode())
+                            self.process.stdin.flush()
+                        else:
+                            sleep(data)
+                    return parse(deadline)
+            except (WalletTimeout, WalletExited, IOError) as e:
+                WALLET_TIMEOUTS.inc(command=name)
+                print("Error: wallet {} (pid {}) failed {} ({}), restarting it".format(
+                    self.name, self.process.pid, name, type(e).__name__))
+                self.__broken = True
+                try:
+                    self.__restart()
+                except (WalletTimeout, WalletExited, IOError) as e:
+                    print("Error: wallet restart failed ({}), retrying before next command".format(type(e).__name__))
+                return None
+
+    def __restart(self):
+        WALLET_RESTARTS.inc()
+        self.process.kill()
+        self.process.wait()
+        self.__start()
+        self.__broken = False
+
+    # @return - parse function returning first line containing one of markers.
+    def __result_parser(self, *markers):
+        def parse(deadline):
+            line = self.__readline(deadline)
+            while all(line.find(marker) == -1 for marker in markers):
+                line = self.__readline(deadline)
+            return line
+        return parse
+
+    def __readline(self, deadline):
+        return self.__output.readline(deadline)
+
+    def __timeout(self, command):
+        return Wallet.Config.get('command_timeouts', {}).get(command, COMMAND_TIMEOUTS[command])
+
 
 # Read command line arguments regarding transaction emission.
 parser = argparse.ArgumentParser(description='Fill testnet with transactions. @Safex')
 
 parser.add_argument('--config', help="Path to config file",
                     required=False, type=str, default="./config.json")
+parser.add_argument('--metrics-bind', help="Serve Prometheus metrics on http://<host:port>/metrics",
+                    required=False, type=str)
+parser.add_argument('--profile', help="Profile run with cProfile, write profile to given file and stage timing "
+                                      "report to <file>.stages.txt",
+                    required=False, type=str)
 
 args = vars(parser.parse_args())
 config_path  = args['config']
 
+if args['profile'] is not None:
+    metrics.startProfiling(args['profile'])
+if args['metrics_bind'] is not None:
+    metrics.startMetricsServer(args['metrics_bind'])
+
 file_config = open(config_path)
 config = json.loads(file_config.read())
 
 # Set Wallet class "static" variable for accessing configuration parameters.
 Wallet.Config = config
-
-# Create children processes for wallets
-genesis_wallet_process = create_genesis_wallet_process(config)
-wallet_processes = create_wallet_processes(config)
-
-# Create class from process.
-genesis_wallet = Wallet(genesis_wallet_process, genesis=True)
-cash, token = genesis_wallet.get_balance()
-print("Genesis wallet balance cash={0} token={1}".format(cash, token))
+RPCWallet.Config = config
+backend = config.get('backend', 'cli')
+max_in_flight = config.get('max_in_flight', 16 if backend == 'rpc' else 1)
+
+# Every wallet process is recorded as soon as it is started, so it is killed at exit or on failed bootstrap even if its
+# Wallet never finished starting. Process started after cleanup began is killed right away.
+wallet_processes = []
+wallet_processes_lock = threading.Lock()
+stopping = False
+
+def tracked(start_process):
+    def start():
+        process = start_process()
+        with wallet_processes_lock:
+            wallet_processes[:] = [p for p in wallet_processes if p.poll() is None] + [process]
+            if stopping:
+                process.kill()
+        return process
+    return start
 
 def kill_child_processes():
-    for wallet in wallet_processes:
-        wallet.kill()
-    genesis_wallet_process.kill()
+    global stopping
+    with wallet_processes_lock:
+        stopping = True
+        for process in wallet_processes:
+            if process.poll() is None:
+                process.kill()
 
-# Create Wallet objects and test for connection errors.
-wallets = []
+atexit.register(kill_child_processes)
+
+# Wallets are started in parallel, each of them waits only for its own process or wallet-rpc.
+bootstrap = ThreadPoolExecutor(max_workers=config.get('bootstrap_threads', 16))
+if backend == 'rpc':
+    genesis_future = bootstrap.submit(RPCWallet, config['genesis_wallet_rpc_url'], genesis=True,
+                                      pool_size=max_in_flight)
+    futures = [bootstrap.submit(RPCWallet, url, pool_size=max_in_flight) for url in config['wallet_rpc_urls']]
+else:
+    # Functions starting wallet processes are kept by wallets for restarts.
+    genesis_future = bootstrap.submit(Wallet, tracked(functools.partial(create_genesis_wallet_process, config)),
+                                      genesis=True, name='genesis')
+    futures = [bootstrap.submit(Wallet, tracked(functools.partial(create_wallet_process, config, index, seed)),
+                                name=str(index))
+               for index, seed in enumerate(config['wallet_electrum_seeds'])]
+
+# If any wallet fails to start, wallets not started yet are cancelled and processes of all others are killed, so
+# bootstrap threads waiting for their wallets finish instead of keeping interpreter alive until startup deadline.
+try:
+    for future in concurrent.futures.as_completed([genesis_future] + futures):
+        future.result()
+except BaseException:
+    for future in futures:
+        future.cancel()
+    kill_child_processes()
+    raise
+genesis_wallet = genesis_future.result()
+wallets = [future.result() for future in futures]
+bootstrap.shutdown()
+print("Genesis wallet balance cash={0} token={1}".format(genesis_wallet.cash_amount, genesis_wallet.token_amount))
+
+# Test wallets for connection errors.
 not_connected_error = False
-for process in wallet_processes:
-    wallets.append(Wallet(process))
-    if wallets[-1].not_connected:
+for wallet in wallets:
+    if wallet.not_connected:
         not_connected_error = True
         break
-    cash, token = wallets[-1].get_balance()
-    print(wallets[-1].address)
-    print("Cash balance: {} Token balance: {}".format(cash, token))
-    sleep(5)
+    print(wallet.address)
+    print("Cash balance: {} Token balance: {}".format(wallet.cash_amount, wallet.token_amount))
 
 if not_connected_error:
     print("There are wallets which are not connected to the network! Please check configuration!")
     exit(1)
 
-# Schedule
-cycles = 0
-txs = 0
-n = len(wallets)
-atexit.register(kill_child_processes)
-print("Generating txs: ")
-while 1 :
-    if cycles % config["migration_period_coeff"] == 0:
-        for i in range(config['num_of_mtx']):
+router = BalanceRouter.from_config(config, wallets)
+
+# Submissions run on thread pool, at most max_in_flight at once. Loop blocks when all slots are taken, so wallets are
+# never asked for more than they can process concurrently. With single slot it is the same as calling directly.
+def submit(fn, *args):
+    in_flight.acquire()
+    future = executor.submit(fn, *args)
+    future.add_done_callback(submitted)
+    return future
+
+def submitted(future):
+    in_flight.release()
+    if future.exception() is not None:
+        print("Error: submission failed: {}".format(future.exception()))
+
+# Transactions in order of original cycles: num_of_mtx migrations every migration_period_coeff cycles of num_of_tx
+# cash transfers, every cash transfer except every third one (starting with first) is followed by token transfer.
+# Every job is one transaction.
+# @yield - function, its args and sleep after submitting it when no load profile is given.
+def generate_jobs():
+    cycles = 0
+    txs = 0
+    n = len(wallets)
+    while 1 :
+        if cycles % config["migration_period_coeff"] == 0:
+            for i in range(config['num_of_mtx']):
+                token_amount = random.randint(config['lower_token'], config['higher_token'])
+                print("Attempting to migrate {} tokens".format(token_amount))
+                yield router.migrate, (genesis_wallet, txs % n, token_amount), config['sleep_mtx']
+                txs = txs + 1
+
+        for i in range(config['num_of_tx']):
+
+            cash_amount = random.randint(config['lower_cash'], config['higher_cash'])
             token_amount = random.randint(config['lower_token'], config['higher_token'])
-            print("Attempting to migrate {} tokens".format(token_amount))
-            genesis_wallet.migration_tx(wallets[txs % n].address, token_amount)
-            sleep(config['sleep_mtx'])
+            print("Attempting to transfer {} cash ".format(cash_amount))
+            # Next wallet in turn sends if it has funds, otherwise first one after it which has. It sends to its
+            # neighbour in ring.
+            source = router.wait_for_route(txs % n, cash_amount=cash_amount)
+            if i % 3:
+                yield router.transfer, (source, (source + 1) % n, cash_amount, 0), 0
+                source = router.wait_for_route(txs % n, token_amount=token_amount)
+                yield router.transfer, (source, (source + 1) % n, 0, token_amount), config['sleep_tx']
+            else:
+                yield router.transfer, (source, (source + 1) % n, cash_amount, 0), config['sleep_tx']
             txs = txs + 1
 
-    for i in range(config['num_of_tx']):
-
-        cash_amount = random.randint(config['lower_cash'], config['higher_cash'])
-        token_amount = random.randint(config['lower_token'], config['higher_token'])
-        print("Attempting to transfer {} cash ".format(cash_amount))
-        wallets[txs % n].perform_tx(wallets[(txs+1) % n].address, cash_amount, token_amount if i % 3 else 0)
-        sleep(config['sleep_tx'])
-        txs = txs + 1
+        cycles = cycles + 1
+        if txs > 10000:
+            txs = 0
 
-    cycles = cycles + 1
-    if txs > 10000:
-        txs = 0
+# Schedule
+if 'observer' in config:
+    observer = Observer.from_config(config)
+    Wallet.Observer = observer
+    RPCWallet.Observer = observer
+    observer.start()
+    # Exit handlers run in reverse order, summary is written before wallets are killed.
+    atexit.register(observer.stop)
+print("Generating txs: ")
+if 'load_profile' in config:
+    # Open-loop rate given by profile, sleep_tx and sleep_mtx are not used.
+    scheduler = RateScheduler.from_config(config, ((fn, args) for fn, args, pause in generate_jobs()),
+                                          max_in_flight=max_in_flight)
+    scheduler.run()
+else:
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+    for fn, args, pause in generate_jobs():
+        submit(fn, *args)
+        sleep(pause)
@@ -0,0 +1,26 @@
+import importlib.util
+import os.path
+import sys
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+sys.path.insert(0, REPO)
+
+
+# Tools import their sibling modules by plain name (migrate_db, bloom_filter, ...) and two tools have migrate_db.py,
+# so every tool module is loaded under unique name with its own directory first on sys.path.
+# @directory - tool directory relative to repo root.
+# @return - loaded module.
+def loadToolModule(directory='', name='', alias=''):
+    path = os.path.join(REPO, directory)
+    sys.modules.pop('migrate_db', None)
+    sys.path.insert(0, path)
+    try:
+        spec = importlib.util.spec_from_file_location(alias or name, os.path.join(path, name + '.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+        return module
+    finally:
+        sys.path.remove(path)
+        sys.modules.pop('migrate_db', None)
@@ -0,0 +1,47 @@
+import pytest
+
+from conftest import loadToolModule
+
+find_txid_by_k_image = loadToolModule('find_txid_with_kimage', 'find_txid_by_k_image', 'find_txid_by_k_image')
+
+
+@pytest.fixture
+def openDB(tmp_path, monkeypatch):
+    monkeypatch.setitem(find_txid_by_k_image.config, 'db-path', str(tmp_path / 'main.db'))
+
+    def openDB(bloom=False):
+        monkeypatch.setitem(find_txid_by_k_image.config, 'bloom', bloom)
+        return find_txid_by_k_image.DB()
+    return openDB
+
+
+def saveBlock(db, height, block_hash, txid, k_image):
+    db.saveChunk([(bytes.fromhex(txid), 0, bytes.fromhex(k_image), height)], [(height, block_hash)], height)
+
+
+# Run without --bloom rolls reorganized block back and resyncs to same height, filter left by earlier run with --bloom
+# has synced_height equal to DB but misses key images of new block.
+def test_filter_is_rebuilt_after_resync_to_same_height_without_it(openDB):
+    db = openDB(bloom=True)
+    saveBlock(db, 5, 'a1' * 32, '11' * 32, '21' * 32)
+    assert db.findTxByKImage('21' * 32) == '11' * 32
+
+    db = openDB(bloom=False)
+    db.rollbackToHeight(4)
+    saveBlock(db, 5, 'a2' * 32, '12' * 32, '22' * 32)
+
+    db = openDB(bloom=True)
+    assert db.getBloomFilter().synced_hash == bytes.fromhex('a2' * 32)
+    assert db.findTxByKImage('22' * 32) == '12' * 32
+    assert db.findTxsByKImages(['21' * 32, '22' * 32]) == {'21' * 32: None, '22' * 32: '12' * 32}
+
+
+def test_filter_in_sync_with_db_is_reused(openDB, capsys):
+    db = openDB(bloom=True)
+    saveBlock(db, 5, 'a1' * 32, '11' * 32, '21' * 32)
+    capsys.readouterr()
+
+    db = openDB(bloom=True)
+    assert 'Building key image bloom filter' not in capsys.readouterr().err
+    assert db.getBloomFilter().synced_height == 5
+    assert db.findTxByKImage('21' * 32) == '11' * 32
@@ -0,0 +1,33 @@
+import sqlite3
+
+from conftest import loadToolModule
+
+deposit_system_example = loadToolModule('deposit_system_example', 'deposit_system_example', 'deposit_system_example')
+
+
+def payment(pid, txid, amount, block_height=5):
+    return {"payment_id": pid, "tx_hash": txid, "block_height": block_height, "unlock_time": 0, "amount": amount,
+            "token_amount": 0, "token_transaction": False}
+
+
+def balance(path, pid):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT cash, token FROM user WHERE pid = ?", [pid]).fetchone()
+    finally:
+        conn.close()
+
+
+def test_payment_for_unknown_pid_is_credited_once_user_exists(tmp_path):
+    path = str(tmp_path / 'main.db')
+    db = deposit_system_example.DB(path)
+    db.createUser(username='alice', pid='p1')
+
+    assert db.creditPayments([payment('p1', 't1', 10), payment('p2', 't2', 20)], last_block_scanned=5) == (1, ['p2'])
+    assert db.creditPayments([payment('p2', 't2', 20)], last_block_scanned=5) == (0, [])
+
+    db.createUser(username='bob', pid='p2')
+    assert db.creditPayments([payment('p2', 't2', 20), payment('p2', 't3', 5, 6)], last_block_scanned=6) == (2, [])
+    assert db.creditPayments([payment('p2', 't2', 20)], last_block_scanned=6) == (0, [])
+    assert balance(path, 'p1') == (10, 0)
+    assert balance(path, 'p2') == (25, 0)
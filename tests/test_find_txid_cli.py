@@ -0,0 +1,43 @@
+import csv
+import io
+import os.path
+import subprocess
+import sys
+
+import pytest
+
+from common.http_server import serveInBackground
+from conftest import REPO, loadToolModule
+
+mock_safexd = loadToolModule('benchmark', 'mock_safexd', 'mock_safexd')
+
+SCRIPT = os.path.join(REPO, 'find_txid_with_kimage', 'find_txid_by_k_image.py')
+
+
+@pytest.fixture
+def chain():
+    chain = mock_safexd.SyntheticChain(height=30, txs_per_block=3, inputs_per_tx=2)
+    server = mock_safexd.MockHTTPServer(('127.0.0.1', 0), mock_safexd.MockDaemon(chain=chain))
+    serveInBackground(server)
+    yield chain, 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+# Sync progress and status lines must not end up in lookup written to stdout.
+def test_key_images_lookup_on_stdout_is_clean_csv(tmp_path, chain):
+    chain, url = chain
+    missing = 'ff' * 32
+    key_images_path = tmp_path / 'k_images.txt'
+    key_images_path.write_text('\n'.join([chain.keyImage(5, 1, 0), chain.keyImage(20, 0, 'migration'), missing]))
+
+    res = subprocess.run([sys.executable, SCRIPT, '--db-path', str(tmp_path / 'main.db'), '--daemon-rpc-url', url,
+                          '--decode-workers', '0', '--key-images-file', str(key_images_path), '--output', '-'],
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=60)
+
+    assert res.returncode == 0, res.stderr
+    assert list(csv.reader(io.StringIO(res.stdout))) == [['k_image', 'txid'],
+                                                         [chain.keyImage(5, 1, 0), chain.txid(5, 1)],
+                                                         [chain.keyImage(20, 0, 'migration'), chain.txid(20, 0)],
+                                                         [missing, '']]
+    assert 'Local DB is up to date' in res.stderr
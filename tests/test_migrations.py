@@ -0,0 +1,155 @@
+import sqlite3
+
+import pytest
+
+from conftest import loadToolModule
+
+kimage_migrate_db = loadToolModule('find_txid_with_kimage', 'migrate_db', 'kimage_migrate_db')
+deposit_migrate_db = loadToolModule('deposit_system_example', 'migrate_db', 'deposit_migrate_db')
+
+TXID = 'ab' * 32
+K_IMAGES = ['cd' * 32, 'ef' * 32]
+
+
+def tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+
+def kimageVersion(conn):
+    return kimage_migrate_db.schema_migration.getSchemaVersion(conn.cursor(), kimage_migrate_db.legacyVersion)
+
+
+def createKImageV1(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE txid_k_images (id integer, txid text, type text, k_images text)")
+    conn.execute("CREATE TABLE state (id integer, key text, value text)")
+    conn.execute("INSERT INTO state (key, value) VALUES('last_block_scanned', '5')")
+    conn.execute("INSERT INTO txid_k_images (txid, type, k_images) VALUES(?,?,?)", [TXID, 'plain', str(K_IMAGES)])
+    conn.commit()
+    return conn
+
+
+def test_kimage_migration_from_v1(tmp_path):
+    conn = createKImageV1(str(tmp_path / 'main.db'))
+    kimage_migrate_db.migrate(conn)
+
+    assert kimageVersion(conn) == kimage_migrate_db.SCHEMA_VERSION
+    rows = conn.execute("SELECT k_images.k_image, txs.txid, txs.type FROM k_images "
+                        "JOIN txs ON txs.id = k_images.tx_id ORDER BY k_images.k_image").fetchall()
+    assert rows == [(bytes.fromhex(k_image), bytes.fromhex(TXID), 0) for k_image in K_IMAGES]
+
+
+def test_failed_kimage_v1_migration_leaves_db_untouched_and_can_be_repeated(tmp_path):
+    conn = createKImageV1(str(tmp_path / 'main.db'))
+    conn.execute("INSERT INTO txid_k_images (txid, type, k_images) VALUES(?,?,?)", ['12' * 32, 'plain', "['zz']"])
+    conn.commit()
+
+    with pytest.raises(ValueError):
+        kimage_migrate_db.migrate(conn)
+    assert tables(conn) == {'txid_k_images', 'state'}
+    assert kimageVersion(conn) == 1
+
+    conn.execute("DELETE FROM txid_k_images WHERE k_images = ?", ["['zz']"])
+    conn.commit()
+    kimage_migrate_db.migrate(conn)
+    assert kimageVersion(conn) == kimage_migrate_db.SCHEMA_VERSION
+    assert conn.execute("SELECT count(*) FROM k_images").fetchone()[0] == len(K_IMAGES)
+
+
+def createKImageV3(path, txs=[]):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE txs (id INTEGER PRIMARY KEY, txid text UNIQUE, type text, block_height integer)")
+    conn.execute("CREATE INDEX txs_block_height ON txs (block_height)")
+    conn.execute("CREATE TABLE k_images (k_image BLOB PRIMARY KEY, tx_id integer NOT NULL) WITHOUT ROWID")
+    conn.execute("CREATE TABLE blocks (height INTEGER PRIMARY KEY, hash BLOB)")
+    conn.execute("CREATE TABLE state (id integer, key text, value text)")
+    conn.execute("INSERT INTO state (key, value) VALUES('schema_version', '3')")
+    conn.executemany("INSERT INTO txs (txid, type, block_height) VALUES(?,?,?)", txs)
+    conn.commit()
+    return conn
+
+
+def test_failed_kimage_v3_migration_keeps_txs_and_can_be_repeated(tmp_path):
+    conn = createKImageV3(str(tmp_path / 'main.db'), [(TXID, 'plain', 10), ('12' * 32, 'unknown', 11)])
+
+    with pytest.raises(KeyError):
+        kimage_migrate_db.migrate(conn)
+    assert 'txs_v4' not in tables(conn)
+    assert conn.execute("SELECT txid, type FROM txs ORDER BY id").fetchall() == [(TXID, 'plain'),
+                                                                                 ('12' * 32, 'unknown')]
+    assert kimageVersion(conn) == 3
+
+    conn.execute("UPDATE txs SET type = 'migration' WHERE type = 'unknown'")
+    conn.commit()
+    kimage_migrate_db.migrate(conn)
+    assert kimageVersion(conn) == kimage_migrate_db.SCHEMA_VERSION
+    assert conn.execute("SELECT txid, type, block_height FROM txs ORDER BY id").fetchall() == \
+        [(bytes.fromhex(TXID), 0, 10), (bytes.fromhex('12' * 32), 1, 11)]
+
+
+def createKImageV2(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE txs (id INTEGER PRIMARY KEY, txid text UNIQUE, type text)")
+    conn.execute("CREATE TABLE k_images (k_image BLOB PRIMARY KEY, tx_id integer NOT NULL) WITHOUT ROWID")
+    conn.execute("CREATE TABLE state (id integer, key text, value text)")
+    conn.execute("INSERT INTO state (key, value) VALUES('schema_version', '2')")
+    conn.execute("INSERT INTO txs (txid, type) VALUES(?,?)", [TXID, 'plain'])
+    conn.commit()
+    return conn
+
+
+# Step interrupted after all its DDL ran, e.g. process killed before commit.
+def test_interrupted_kimage_v2_migration_can_be_repeated(tmp_path):
+    conn = createKImageV2(str(tmp_path / 'main.db'))
+
+    def interrupted(conn):
+        kimage_migrate_db.migrateV2ToV3(conn)
+        raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        kimage_migrate_db.schema_migration.migrate(conn, {2: interrupted}, 3, name='key image')
+    assert 'blocks' not in tables(conn)
+    assert [row[1] for row in conn.execute("PRAGMA table_info(txs)")] == ['id', 'txid', 'type']
+    assert kimageVersion(conn) == 2
+
+    kimage_migrate_db.migrate(conn)
+    assert kimageVersion(conn) == kimage_migrate_db.SCHEMA_VERSION
+    assert conn.execute("SELECT txid, type, block_height FROM txs").fetchall() == [(bytes.fromhex(TXID), 0, None)]
+
+
+def depositVersion(conn):
+    return deposit_migrate_db.schema_migration.getSchemaVersion(conn.cursor(), deposit_migrate_db.legacyVersion)
+
+
+def createDepositV1(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE pid_txid (id integer, pid text, txid text, block_height integer)")
+    conn.execute("CREATE TABLE state (id integer, key text, value text)")
+    conn.execute("CREATE TABLE user (id integer, username text, pid VARCHAR(64), cash integer, token integer, "
+                 "integrated_address text)")
+    conn.execute("INSERT INTO state (key, value) VALUES('last_block_scanned', '7')")
+    conn.execute("INSERT INTO user (username, pid, cash, token) VALUES('alice', 'p1', 1, 2)")
+    conn.execute("INSERT INTO pid_txid (pid, txid, block_height) VALUES('p1', 't1', 3)")
+    conn.commit()
+    return conn
+
+
+# Tables are rewritten through user_v2, pid_txid_v2 and state_v2, interrupted rewrite must not leave any of them.
+def test_interrupted_deposit_v1_migration_can_be_repeated(tmp_path):
+    conn = createDepositV1(str(tmp_path / 'main.db'))
+
+    def interrupted(conn):
+        deposit_migrate_db.migrateV1ToV2(conn)
+        raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        deposit_migrate_db.schema_migration.migrate(conn, {1: interrupted}, 2, name='deposit system',
+                                                    legacy_version=deposit_migrate_db.legacyVersion)
+    assert tables(conn) == {'pid_txid', 'state', 'user'}
+    assert depositVersion(conn) == 1
+
+    deposit_migrate_db.migrate(conn)
+    assert depositVersion(conn) == deposit_migrate_db.SCHEMA_VERSION
+    assert conn.execute("SELECT id, username, pid, cash, token, wallet FROM user").fetchall() == \
+        [(1, 'alice', 'p1', 1, 2, 0)]
+    assert conn.execute("SELECT value FROM state WHERE key='last_block_scanned'").fetchone() == ('7',)
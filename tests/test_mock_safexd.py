@@ -0,0 +1,23 @@
+import time
+
+from conftest import loadToolModule
+
+mock_safexd = loadToolModule('benchmark', 'mock_safexd', 'mock_safexd')
+
+
+def test_submitted_tx_is_mined_in_next_block_and_can_be_fetched():
+    chain = mock_safexd.SyntheticChain(height=10, txs_per_block=3, block_time=0.2)
+    daemon = mock_safexd.MockDaemon(chain=chain)
+    height = chain.height
+    txid = daemon.handle('/json_rpc', {"method": "transfer", "params": {}})["result"]["tx_hash"]
+    assert [tx["id_hash"] for tx in chain.poolTxs()] == [txid]
+
+    while chain.height <= height:
+        time.sleep(0.05)
+    assert chain.poolTxs() == []
+    block = daemon.handle('/json_rpc', {"method": "get_block", "params": {"height": height}})["result"]
+    assert block["block_header"]["num_txes"] == 4
+    assert block["tx_hashes"][-1] == txid
+    tx = daemon.handle('/get_transactions', {"txs_hashes": [txid]})["txs"][0]
+    assert tx["tx_hash"] == txid
+    assert tx["block_height"] == height
@@ -0,0 +1,59 @@
+import ujson
+
+import pytest
+
+from common.http_server import KeepAliveHandler, ThreadingServer, serveInBackground
+from common.rpc_client import RPCClient, RPCError
+
+
+# Answering every POST with next of given response bodies and counting requests which were batches.
+class ScriptedHandler(KeepAliveHandler):
+    def do_POST(self):
+        body = ujson.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.batches = self.server.batches + isinstance(body, list)
+        response = self.server.responses.pop(0)
+        if response is None:
+            response = {"jsonrpc": "2.0", "id": body["id"], "result": body["params"]}
+        self.sendData(200, response if isinstance(response, bytes) else ujson.dumps(response).encode())
+
+
+@pytest.fixture
+def server():
+    server = ThreadingServer(('127.0.0.1', 0), ScriptedHandler)
+    server.responses = []
+    server.batches = 0
+    serveInBackground(server)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def batchResult(ids):
+    return [{"jsonrpc": "2.0", "id": str(i), "result": {"n": i}} for i in ids]
+
+
+def test_transient_batch_failure_is_raised_and_batching_stays_on(server):
+    client = RPCClient('http://127.0.0.1:{}'.format(server.server_address[1]))
+    calls = [("get_block", {"n": 0}), ("get_block", {"n": 1})]
+    server.responses = [b'<html>Bad Gateway</html>', batchResult([0]),
+                        {"jsonrpc": "2.0", "id": "0", "error": {"code": -1, "message": "Busy"}}, batchResult([1, 0])]
+
+    with pytest.raises(ValueError):
+        client.sendJSONRPCBatch(calls)
+    with pytest.raises(RPCError):
+        client.sendJSONRPCBatch(calls)
+    with pytest.raises(RPCError):
+        client.sendJSONRPCBatch(calls)
+    assert client.sendJSONRPCBatch(calls) == [{"n": 0}, {"n": 1}]
+    assert server.batches == 4
+
+
+def test_rejected_batch_falls_back_to_single_calls(server):
+    client = RPCClient('http://127.0.0.1:{}'.format(server.server_address[1]))
+    calls = [("get_block", {"n": 0}), ("get_block", {"n": 1})]
+    server.responses = [{"jsonrpc": "2.0", "id": 0, "error": {"code": -32700, "message": "Parse error"}},
+                        None, None, None, None]
+
+    assert client.sendJSONRPCBatch(calls) == [{"n": 0}, {"n": 1}]
+    assert client.sendJSONRPCBatch(calls) == [{"n": 0}, {"n": 1}]
+    assert server.batches == 1
@@ -0,0 +1,11 @@
+import multiprocessing
+
+from conftest import loadToolModule
+
+tx_decoder = loadToolModule('find_txid_with_kimage', 'tx_decoder', 'tx_decoder')
+
+
+def test_decoder_processes_are_stopped_on_exit():
+    with tx_decoder.TxDecoder(workers=2):
+        assert len(multiprocessing.active_children()) == 2
+    assert multiprocessing.active_children() == []